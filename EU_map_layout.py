@@ -3,68 +3,119 @@
 #############################
 
 # General libraries
-from re import M
+import inspect
+import sys
+from functools import wraps
 import numpy as np
 import pandas as pd
-# Import plotly
-import plotly.express as px
-import plotly.io as pio
+# Import plotly (plotly.express is imported when a figure template is first built)
 import plotly.graph_objects as go
 # Import dash
+import flask
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, State, ClientsideFunction
 import dash_bootstrap_components as dbc
-from jupyter_dash import JupyterDash
 import dash_daq as daq # toggle switch
 
-# To convert country names and iso codes
-from pycountry_convert import country_alpha2_to_country_name, country_alpha3_to_country_alpha2
-
-# Set renderer to view in jupyter notebook
-pio.renderers.default = "notebook"
+# Columnar data store with CSV fallback, swapped in on refresh
+from data_store import memory_report
+from dataset import LiveDataset, affected
+# More datasets served from per Schengen country partitions
+from registry import DatasetRegistry, parse_datasets
+from data_index import ALL_COUNTRIES
+# Filtered-frame cache shared by the callbacks
+from callback_cache import FilterCache, make_backend
+import settings
+# Median rankings of frames the cube cannot hold, and the same as dataset tasks
+from aggregates import dataset_per_origin, dataset_top_k, per_origin_frame, top_k_frame
+# Aggregations in the request thread or in a process pool
+import executor
+
+from http_cache import HttpCache
+# Cached figure layouts and patch updates
+import figure_encoding
+from figure_cache import can_patch, figure_template, fill_template, patch_figure, round_values
+# Integer country code lookups
+from country_codes import country_mask
+# Line plot series with rollups and derived series
+from timeseries import series_frame, series_label
+# Level of detail of the bubble plot
+from scatter_lod import density_grid, in_view, level_of_detail, view_ranges
+# Coalescing of hover requests
+from coalesce import TAB_STORE, HoverCoalescer, coalesced, install_session_cookie, new_tab_id, tab_callback
+# Figures of the default view embedded in the layout
+from prerender import Snapshot
+# Opt-in callback timings served at /metrics
+import instrumentation
+from instrumentation import instrumented, span
 
 
 ####################################
 # Load and prepare data
 ####################################
 
-def load_data():
-    # Load data globally
-    df = pd.read_csv("data/df_iso_schengen_origin.csv")
-
-    # Add columns for full Schengen country names
-    df["Schengen_country"] = df["SCH_CODE"].apply(lambda x: country_alpha2_to_country_name(country_alpha3_to_country_alpha2(x)))
-
-    # Capatilize all column names to prevent string matching conflicts
-    df.columns = [x.capitalize() for x in df.columns]
-    # Remove underscores from column names
-    df.columns = [name.replace("_", ' ') for name in df.columns]
-
-    # drop all nan from all country columns
-    df.dropna(subset = ['Schengen country'], inplace = True)
-    df.dropna(subset = ['Country'], inplace = True)
-
-    return df
+# Memory-maps data/df_iso_schengen_origin.store (built with `python data_store.py`)
+# and falls back to parsing data/df_iso_schengen_origin.csv. live.current holds
+# the frame, index, cube, features and time range; callbacks read it once so a
+# refresh (POST /admin/refresh) swaps all of it at once
+live = LiveDataset()
 
-df = load_data()
-
-####################################
-# Define features that can be selected by used from columns names
-# Save features in list
-feature_list = df.columns.unique().to_list()
-# Select features to be excluded
-remove_features = ['Year', 'Country code', 'Sch code', 'Schengen country', "Country"]
-# Remove those features from list
-feature_list = [ele for ele in feature_list if ele not in remove_features]
-
-# Define min and max time range for slider and graphs
-min_time = min(df["Year"])
-max_time = max(df["Year"])
+# The live dataset and the datasets of VISA_DATASETS, by dropdown name.
+# datasets.view(name, schengen_country) is the dataset a callback reads.
+datasets = DatasetRegistry(live, settings.DEFAULT_DATASET, parse_datasets(settings.DATASETS),
+                           settings.PARTITION_MEMORY_MB << 20)
 
 ####################################
 # Define data and plotting functions
 ####################################
 
+# Rows of one country of origin within a filter, shared by all callbacks of one interaction
+filter_cache = FilterCache(make_backend(settings.FILTER_CACHE_BACKEND,
+                                        settings.FILTER_CACHE_SIZE,
+                                        settings.FILTER_CACHE_DIR))
+
+# Rows of the selected Schengen country (or all countries) within the year range,
+# optionally only for one country of origin
+def filter_data(schengen_country, year_range, origin_country = None, dataset = None):
+    if dataset is None:
+        dataset = live.current
+
+    with span("filter"):
+        # A slice of the frame, or rows of all countries kept by the index
+        data = dataset.index.query(schengen_country, year_range)
+        if origin_country is None:
+            return data
+
+        key = (dataset.source, schengen_country, tuple(year_range), origin_country)
+        # Positions within the selection, the same in every worker reading this source
+        positions = filter_cache.get_or_compute(
+            key, lambda: np.flatnonzero(country_mask(data['Country code'], origin_country)))
+        return data.take(positions) # includes all rows for selected Schengen countries
+
+# Keep the cached rows of the cells a refresh did not change
+def carry_over_filter_cache(previous, dataset, changed):
+    def rename(key):
+        source, schengen_country, year_range, origin_country = key
+        # Keys of the new data and of the other datasets stay
+        if source != previous.source:
+            return key
+        if affected(changed, schengen_country, year_range):
+            return None
+        return (dataset.source,) + key[1:]
+    filter_cache.rekey(rename)
+
+live.listeners.append(carry_over_filter_cache)
+
+# Runs the heavy aggregations (VISA_EXECUTOR=process: in a pool with deadlines)
+aggregation_executor = executor.make_executor(settings.EXECUTOR,
+                                              settings.EXECUTOR_WORKERS,
+                                              settings.EXECUTOR_MAX_PENDING,
+                                              settings.EXECUTOR_TIMEOUT)
+
+# How the data arrays of the figures are encoded and serialized (VISA_FIGURE_ENCODING)
+figure_encoding.install(settings.FIGURE_ENCODING)
+
+
 # Header content to introduce the dashboard
 def drawHeader():
     return html.Div([
@@ -82,12 +133,15 @@ def drawHeader():
     ])
 
 
-# Create world map for visa statistics
-def drawWorldMap(data = df, feature = "Total population"):
-    figure = go.Figure(data=go.Choropleth(
-                        locations = data['Country code'],
-                        z = data[str(feature)].round(2),
-                        text ='Feature: '+str(feature)+'<br>'+'Country: '+data['Country'],
+# World map layout and trace settings, built once per feature
+@figure_template
+def worldMapTemplate(feature):
+    return go.Figure(data=go.Choropleth(
+                        locations = [],
+                        z = [],
+                        customdata = [],
+                        # Hover text from the country names instead of one string per country
+                        hovertemplate = 'Feature: '+str(feature)+'<br>Country: %{customdata}<br>%{z}<extra></extra>',
                         colorscale = 'YlGnBu',
                         autocolorscale=False,
                         reversescale=False,
@@ -134,26 +188,65 @@ def drawWorldMap(data = df, feature = "Total population"):
                             showarrow = True
                         )]
                     ).update_layout(margin={"r":0,"t":100,"l":10,"b":0},)
-    return figure
+
+# Data arrays of the world map, one value per country of origin
+def worldMapData(data, feature):
+    return [{
+        'locations': np.asarray(data['Country code'], dtype = object),
+        'z': round_values(data[str(feature)], settings.MAP_DECIMALS, settings.MAP_SIGNIFICANT_DIGITS),
+        'customdata': np.asarray(data['Country'], dtype = object),
+    }]
+
+# Median of a feature per country of origin over the year range
+def worldMapFrame(schengen_country, year_range, feature, dataset):
+    def inline():
+        if dataset.cube.exact:
+            return dataset.cube.per_origin(schengen_country, year_range, feature)
+        return per_origin_frame(filter_data(schengen_country, year_range, dataset = dataset), feature)
+    return aggregation_executor.run('worldmap', dataset, dataset_per_origin, schengen_country, year_range, feature,
+                                    inline = inline)
+
+# Countries and medians of the 10 highest (or lowest if ascending) medians over the year range
+def barplotFrame(schengen_country, year_range, feature, ascending, dataset):
+    def inline():
+        if dataset.cube.exact:
+            return dataset.cube.top_k(schengen_country, year_range, feature, k = 10, ascending = ascending)
+        return top_k_frame(filter_data(schengen_country, year_range, dataset = dataset), feature,
+                           k = 10, ascending = ascending)
+    return aggregation_executor.run('barplot', dataset, dataset_top_k, schengen_country, year_range, feature,
+                                    10, ascending, inline = inline)
+
+# Create world map for visa statistics
+def drawWorldMap(data, feature = "Total population"):
+    return fill_template(worldMapTemplate(feature), worldMapData(data, feature))
+
+# Graph contents before the first callback (pre-rendered or empty)
+EMPTY_FIGURE = {'data': [], 'layout': {}}
+# Country hovered before the user hovers the world map
+DEFAULT_HOVER = {'points': [{'location': 'Germany'}]}
 
 # Create world map for visa statistics
-worldmap_card = html.Div([
+def worldmapCard(figure = EMPTY_FIGURE):
+    return html.Div([
                     dbc.Card(
                         dbc.CardBody([
                             dcc.Graph(
                                 id = "worldmap",
-                                hoverData={'points': [{'location': 'Germany'}]}     
+                                figure = figure,
+                                hoverData=DEFAULT_HOVER
                             ) 
                         ])
                     ),  
                 ])
 
-# Histogram displaying map statistics in detail and ordered by country
-def drawBarplot(data = df, feature = "Visas issued"):
-    # Plot the bar chart
+# Bar chart layout and trace settings, built once per feature
+@figure_template
+def barplotTemplate(feature):
+    import plotly.express as px
+    # Plot the bar chart with a placeholder bar
     figure = px.bar(
-                        x=data['Country'],
-                        y=data[str(feature)], 
+                        x=[''],
+                        y=[0.0], 
                         height=450,
                         labels={'x':'Country', 'y':str(feature)},
                     ).update_layout(
@@ -166,13 +259,23 @@ def drawBarplot(data = df, feature = "Visas issued"):
     
     return figure
 
+# Data arrays of the bar chart
+def barplotData(data, feature):
+    return [{'x': data['Country'], 'y': data[str(feature)]}]
+
+# Histogram displaying map statistics in detail and ordered by country
+def drawBarplot(data, feature = "Visas issued"):
+    return fill_template(barplotTemplate(feature), barplotData(data, feature))
+
 
 # Create container for barplot
-barplot_card = dbc.Card(
+def barplotCard(figure = EMPTY_FIGURE):
+    return dbc.Card(
             dbc.CardBody(
                 [
                     dcc.Graph(
                         id = "barplot",
+                        figure = figure,
                         config={
                             'displayModeBar': False,
                         }
@@ -181,10 +284,12 @@ barplot_card = dbc.Card(
             )
         )
 
-# Correlation scatter plot with size displaying a third feature
-def drawBubblePlot(data = df, feature_x = "Visas issued", feature_y = "Visas denied", country_code = None):
-
-    figure = px.scatter(data, # plot for selected country
+# Bubble plot layout and trace settings, built once per feature pair
+@figure_template
+def bubblePlotTemplate(feature_x, feature_y):
+    import plotly.express as px
+    placeholder = pd.DataFrame({feature_x: [0.0], feature_y: [0.0], "Number of visa applications": [1.0]})
+    figure = px.scatter(placeholder, # plot for selected country
                     x=feature_x,
                     y=feature_y,
                     size="Number of visa applications", 
@@ -197,29 +302,92 @@ def drawBubblePlot(data = df, feature_x = "Visas issued", feature_y = "Visas den
                                 margin={"r":0,"t":0,"l":0,"b":0}
                                 )
 
-    # Highlight points for selected country of origin
-    # Extract data points
-    df_origin_country = data[data['Country code'].str.contains(country_code)] # includes all rows for selected Schengen countries
-    x = df_origin_country[feature_x]
-    y = df_origin_country[feature_y]
-
-    if country_code:
-        figure.add_trace(go.Scatter(
-                            x=x, 
-                            y=y,
-                            opacity=0.8,
-                            mode = 'markers',
-                            marker_size = 30,
-                            marker_color = "orange"))
+    # Trace to highlight points for selected country of origin
+    figure.add_trace(go.Scatter(
+                        x=[], 
+                        y=[],
+                        opacity=0.8,
+                        mode = 'markers',
+                        marker_size = 30,
+                        marker_color = "orange"))
+
+    # Density grid replacing the points when too many are in view
+    figure.add_trace(go.Heatmap(
+                        x=[],
+                        y=[],
+                        z=[],
+                        visible=False,
+                        showscale=False,
+                        colorscale='Blues',
+                        hovertemplate=feature_x+'=%{x}<br>'+feature_y+'=%{y}<br>%{z} points<extra></extra>'))
 
     return figure
 
+# Density grids of the filtered frames, shared by hover updates of the same view
+density_cache = FilterCache(make_backend("memory", settings.FILTER_CACHE_SIZE))
+
+# Zoom is kept while only the hovered country changes and reset by a new filter or dataset
+def bubbleRevision(source, schengen_country, year_range, feature_x, feature_y):
+    return '{}|{}|{}|{}|{}|{}'.format(source, schengen_country, year_range[0], year_range[1], feature_x, feature_y)
+
+# Data arrays of the bubble plot, of the highlighted country of origin (its
+# rows, see filter_data) and of the density grid, at the level of detail of
+# the points in view
+def bubblePlotData(data, feature_x, feature_y, df_origin_country = None, view = None, cache_key = None):
+    x = data[feature_x].to_numpy(dtype = np.float64)
+    y = data[feature_y].to_numpy(dtype = np.float64)
+    sizes = data["Number of visa applications"]
+    # Same bubble scaling as px.scatter(size_max=60)
+    sizeref = sizes.max() / 60 ** 2 if len(sizes) else 1
+
+    if df_origin_country is None:
+        df_origin_country = data.iloc[0:0]
+    highlight = {'x': df_origin_country[feature_x], 'y': df_origin_country[feature_y]}
+
+    x_range, y_range = view_ranges(view)
+    shown = in_view(x, y, x_range, y_range) if x_range or y_range else slice(None)
+    points = len(x) if isinstance(shown, slice) else int(shown.sum())
+    detail = level_of_detail(points, settings.BUBBLE_WEBGL_THRESHOLD, settings.BUBBLE_DENSITY_THRESHOLD)
+    trace_type = 'scatter' if detail == 'svg' else 'scattergl'
+
+    if detail == 'density':
+        def compute():
+            return density_grid(x, y, settings.BUBBLE_DENSITY_BINS, x_range, y_range)
+        grid = compute() if cache_key is None else density_cache.get_or_compute((cache_key, x_range, y_range), compute)
+        return [
+            {'type': trace_type, 'x': [], 'y': [], 'marker.size': [], 'marker.sizeref': sizeref},
+            dict(highlight, type = trace_type),
+            dict(grid, visible = True),
+        ]
+
+    return [
+        {'type': trace_type, 'x': x[shown], 'y': y[shown], 'marker.size': sizes.to_numpy()[shown], 'marker.sizeref': sizeref},
+        dict(highlight, type = trace_type),
+        {'visible': False, 'x': [], 'y': [], 'z': []},
+    ]
+
+# Layout updates of the bubble plot: the zoom revision and whether zooming
+# needs the server to bin the points in view again. Plain markers of all
+# points zoom in the browser alone (bubbleView in assets/clientside.js)
+def bubbleLayout(data, revision):
+    detail = level_of_detail(len(data), settings.BUBBLE_WEBGL_THRESHOLD, settings.BUBBLE_DENSITY_THRESHOLD)
+    return {'uirevision': revision, 'meta.rebin': detail != 'svg'}
+
+# Correlation scatter plot with size displaying a third feature
+def drawBubblePlot(data, feature_x = "Visas issued", feature_y = "Visas denied", df_origin_country = None,
+                   view = None, revision = None, cache_key = None):
+    return fill_template(bubblePlotTemplate(feature_x, feature_y),
+                         bubblePlotData(data, feature_x, feature_y, df_origin_country, view, cache_key),
+                         bubbleLayout(data, revision))
+
 # Create container for barplot
-bubbleplot_card = dbc.Card(
+def bubbleplotCard(figure = EMPTY_FIGURE):
+    return dbc.Card(
             dbc.CardBody(
                 [
                     dcc.Graph(
                         id = "bubble_plot",
+                        figure = figure,
                         config={
                             'displayModeBar': False,
                         }
@@ -229,10 +397,12 @@ bubbleplot_card = dbc.Card(
         )
 
 
-# Time series plot for each feature
-def drawLinePlot(data = df, feature_x = "Year", feature_y = "Visas denied"):
-
-    figure = px.scatter(data, # plot for selected country
+# Line plot layout and trace settings, built once per feature and time range
+@figure_template
+def linePlotTemplate(feature_x, feature_y, min_time, max_time):
+    import plotly.express as px
+    placeholder = pd.DataFrame({feature_x: [min_time], feature_y: [0.0]})
+    figure = px.scatter(placeholder, # plot for selected country
                     x=feature_x,
                     y=feature_y,
                     size_max=60).update_layout(
@@ -253,25 +423,52 @@ def drawLinePlot(data = df, feature_x = "Year", feature_y = "Visas denied"):
 
     return figure
 
+# Data arrays of the line plot
+def linePlotData(data, feature_x, feature_y):
+    return [{'x': data[feature_x], 'y': data[feature_y]}]
+
+# Time series plot for each feature over the time range (of the current data by default)
+def drawLinePlot(data, feature_x = "Year", feature_y = "Visas denied", time_range = None):
+    if time_range is None:
+        time_range = (live.current.min_time, live.current.max_time)
+    return fill_template(linePlotTemplate(feature_x, feature_y, *time_range),
+                         linePlotData(data, feature_x, feature_y))
+
 
 
 # Create container for barplot
-lineplot_card = dbc.Card(
+def lineplotCard(figure = EMPTY_FIGURE):
+    return dbc.Card(
             dbc.CardBody(
                 [
                     dcc.Graph(
                         id = "line_plot",
+                        figure = figure,
                         config={
                             'displayModeBar': False,
                         }
-                    ) 
+                    ),
+                    # Feature 1 or a series derived from the visa counts (timeseries.py)
+                    dcc.RadioItems(
+                        id = "line_series",
+                        options = [
+                            {'label': 'Feature 1', 'value': 'value'},
+                            {'label': 'Change to previous year', 'value': 'yoy'},
+                            {'label': 'Rejection rate', 'value': 'rejection_rate'},
+                        ],
+                        value = 'value',
+                        inline = True,
+                        inputStyle = {'margin-right': '5px', 'margin-left': '10px'},
+                        # The browser draws the plain feature with VISA_CLIENTSIDE_HOVER=1
+                        style = {'display': 'none'} if settings.CLIENTSIDE_HOVER else {},
+                    ),
                 ]
             )
         )
 
 
-# Define dropdown field
-def dropdown(label, label_list):
+# Dropdown options and the preselected value
+def dropdownItems(label_list, extra_items = []):
     # Remove nans
     list_items = label_list[~pd.isnull(label_list)]
     # Convert all features to lower case to allow ordering
@@ -280,21 +477,46 @@ def dropdown(label, label_list):
     list_items.sort()
     # Create dictionary with labels and name to pass to the dropdown list
     list_items = [{'label':name, 'value':name} for name in list_items]
+    # Extra items (e.g. "All countries") go on top but are not preselected
+    extra_items = [{'label':name, 'value':name} for name in extra_items]
+
+    return extra_items + list_items, list_items[0].get("label") # first_label
+
+# Define dropdown field
+def dropdown(label, label_list, extra_items = []):
+    options, value = dropdownItems(label_list, extra_items)
 
     return  html.Div([
         dbc.Card(
             dbc.CardBody([
                 #dcc.Dropdown(id = "dd", label = "dfdf", value = "sd")
                 html.H6(label),
-                dcc.Dropdown(id = label, options=list_items, \
-                searchable = True, value =list_items[0].get("label")), # first_label
+                dcc.Dropdown(id = label, options=options, \
+                searchable = True, value =value),
             ])
         ),  
     ])
 
+# Dataset selection in registry order, hidden when only the default dataset is served
+def datasetDropdown(names):
+    return html.Div([
+        dbc.Card(
+            dbc.CardBody([
+                html.H6("Dataset"),
+                dcc.Dropdown(id = "Dataset", options=[{'label':name, 'value':name} for name in names],
+                             value = names[0], clearable = False),
+            ])
+        ),
+    ], style = {} if len(names) > 1 else {'display': 'none'})
+
+
+# Slider marks every other year (or sparser for long ranges), from the first year
+def sliderMarks(min_time, max_time):
+    step = max(2, -(-(max_time - min_time) // 6))
+    return {year: str(year) for year in range(min_time, max_time + 1, step)}
 
 # Slider to select time frame
-def timeSlider():
+def timeSlider(min_time, max_time):
     return html.Div([
         dbc.Card(
             dbc.CardBody([
@@ -307,11 +529,7 @@ def timeSlider():
                                     step = 1, 
                                     value=[min_time, max_time],
                                     allowCross=False,
-                                    marks={
-                                            2014: '2014',
-                                            2016: '2016',
-                                            2018: '2018',
-                                    },
+                                    marks=sliderMarks(min_time, max_time),
                     ),
                 ], className="mb-3"
                 )
@@ -327,172 +545,514 @@ def timeSlider():
 # Define text color
 text_color = "#9F9F9F"
 
+# Inside a notebook kernel the dashboard runs with JupyterDash, everywhere
+# else (python EU_map_layout.py, gunicorn wsgi:server) with plain Dash
+def running_in_notebook():
+    return 'ipykernel' in sys.modules
+
 # Build App
-app = JupyterDash(external_stylesheets=[dbc.themes.SLATE])
-
-app.layout = html.Div([
-    dbc.Card(
-        dbc.CardBody([
-            dbc.Row([
-                # Container for header
-                dbc.Col([
-                    drawHeader()
-                ], width=12),
-            ], align='center'), 
-            html.Br(),
-            dbc.Row([
-                # Container for world map
-                dbc.Col([
-                    worldmap_card
-                ], width=8),
-                # Container for user input
-                dbc.Col([
-                    dropdown(label = "Schengen country", label_list = df["Schengen country"].unique()),#, first_label= "Germany"),
-                    dropdown(label = "Country feature 1", label_list = np.array(feature_list)),#, first_label= "All countries"), # Column pandas index needs conversion to array to allow sorting
-                    dropdown(label = "Country feature 2", label_list = np.array(feature_list)),#, first_label= "All countries"),
-                    timeSlider(),
-                    html.P(id = "item_display")
-                ], width=4),
-            ], align='top'), 
-            html.Br(),
-            dbc.Row([
-                # Container for barplot
-                dbc.Col([
-                    barplot_card
-                ], width=4),
-                # Container for bubble chart
-                dbc.Col([
-                    bubbleplot_card
-                ], width=4),
-                dbc.Col([
-                    lineplot_card
-                ], width=4),
-            ], align='center'),
-            dbc.Row([
-                dbc.Col([
-                    daq.ToggleSwitch(id='my-toggle-switch', size=30, value=True),   #
-                    html.Div(id='my-toggle-switch-output')
-                ], width=4),
-            ], align='left'),    
-        ]), color = 'dark'
-    )
-])
+if running_in_notebook():
+    import plotly.io as pio
+    from jupyter_dash import JupyterDash
+    # Set renderer to view in jupyter notebook
+    pio.renderers.default = "notebook"
+    app = JupyterDash(__name__, external_stylesheets=[dbc.themes.SLATE])
+else:
+    app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SLATE])
+
+# Identify browser sessions so stale hover requests can be dropped
+install_session_cookie(app.server)
+
+# Callback timings, payload sizes and cache gauges at /metrics
+if settings.METRICS:
+    instrumentation.install(app.server)
+
+# POST /admin/refresh and the VISA_REFRESH_INTERVAL watcher
+live.install(app.server)
+
+# 503 for a saturated aggregation pool, 504 past the deadline
+executor.install(app.server)
+
+# Repeated callback requests served from memory, ETags and compression of
+# all responses (installed last, so it compresses the final body)
+http_cache = HttpCache(settings.RESPONSE_CACHE_MB << 20, settings.COMPRESS_MIN_BYTES, settings.COMPRESS_LEVEL,
+                       version = lambda: live.current.source)
+http_cache.install(app.server)
+
+# Layout built per page load from the current data, so dropdowns and the
+# time slider follow a refresh
+def serveLayout():
+    dataset = live.current
+    # Figures of the default view, so the first paint needs no callbacks.
+    # Rendered on the first page request (or read from the snapshot): dash
+    # also calls this at import to validate the layout, without a request.
+    outputs = {}
+    if settings.PRERENDER and flask.has_request_context():
+        outputs = {key[0]: output for key, output in defaultFigures(dataset).items()}
+    return html.Div([
+        dbc.Card(
+            dbc.CardBody([
+                dbc.Row([
+                    # Container for header
+                    dbc.Col([
+                        drawHeader()
+                    ], width=12),
+                ], align='center'), 
+                html.Br(),
+                dbc.Row([
+                    # Container for world map
+                    dbc.Col([
+                        worldmapCard(outputs.get('worldmap', EMPTY_FIGURE))
+                    ], width=8),
+                    # Container for user input
+                    dbc.Col([
+                        datasetDropdown(datasets.names()),
+                        dropdown(label = "Schengen country", label_list = np.array(dataset.index.countries, dtype = object), extra_items = [ALL_COUNTRIES]),#, first_label= "Germany"),
+                        dropdown(label = "Country feature 1", label_list = np.array(dataset.features)),#, first_label= "All countries"), # Column pandas index needs conversion to array to allow sorting
+                        dropdown(label = "Country feature 2", label_list = np.array(dataset.features)),#, first_label= "All countries"),
+                        timeSlider(dataset.min_time, dataset.max_time),
+                        html.P(id = "item_display")
+                    ], width=4),
+                ], align='top'), 
+                html.Br(),
+                dbc.Row([
+                    # Container for barplot
+                    dbc.Col([
+                        barplotCard(outputs.get('barplot', [EMPTY_FIGURE])[0])
+                    ], width=4),
+                    # Container for bubble chart
+                    dbc.Col([
+                        bubbleplotCard(outputs.get('bubble_plot', EMPTY_FIGURE))
+                    ], width=4),
+                    dbc.Col([
+                        lineplotCard(outputs.get('line_plot', EMPTY_FIGURE))
+                    ], width=4),
+                ], align='center'),
+                dbc.Row([
+                    dbc.Col([
+                        daq.ToggleSwitch(id='my-toggle-switch', size=30, value=True),   #
+                        html.Div(id='my-toggle-switch-output', children=outputs.get('barplot', [None, None])[1])
+                    ], width=4),
+                ], align='left'),    
+                # Figures and per-country slices for hover highlighting in the browser
+                dcc.Store(id='hover_store'),
+                # Zoomed axis ranges of the bubble plot
+                dcc.Store(id='bubble_view'),
+                # Id of this browser tab, superseding requests per tab (coalesce.py)
+                dcc.Store(id=TAB_STORE, storage_type='memory', data=new_tab_id()),
+            ]), color = 'dark'
+        )
+    ])
+
+
+################################
+# Pre-rendered figures
+################################
+
+# Outputs of the default view (rendered once per dataset) and of the states
+# pre-rendered by `python prerender.py`
+snapshot = Snapshot()
+
+# Snapshot keys: figure and callback inputs, with the hovered country for the
+# hover data. Only the default dataset is pre-rendered.
+def hoverLocation(hoverData):
+    return hoverData['points'][0]['location'] if hoverData else None
+
+def isDefaultDataset(dataset_name):
+    return dataset_name in (None, datasets.default_name)
+
+def worldmapKey(schengen_country, feature_1, year_range, dataset_name = None):
+    if not isDefaultDataset(dataset_name):
+        return None
+    return ('worldmap', schengen_country, feature_1, *year_range)
+
+def barplotKey(toggle, feature, schengen_country, year_range, dataset_name = None):
+    if not isDefaultDataset(dataset_name):
+        return None
+    return ('barplot', bool(toggle), feature, schengen_country, *year_range)
+
+def bubbleplotKey(schengen_country, hoverData, feature_1, feature_2, year_range, view = None, dataset_name = None):
+    # Zoomed views are never pre-rendered
+    if view or not isDefaultDataset(dataset_name):
+        return None
+    return ('bubble_plot', schengen_country, hoverLocation(hoverData), feature_1, feature_2, *year_range)
+
+def lineplotKey(schengen_country, hoverData, feature_1, year_range, dataset_name = None, series = None):
+    if not isDefaultDataset(dataset_name) or series not in (None, 'value'):
+        return None
+    return ('line_plot', schengen_country, hoverLocation(hoverData), feature_1, *year_range)
+
+# Answer states found in the snapshot without computing them
+def prerendered(key):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args):
+            output = snapshot.get(live.current.source, key(*args))
+            return function(*args) if output is None else output
+        return wrapper
+    return decorator
+
+# Dropdown values, time range, hover and toggle a page starts with (see dropdown())
+def defaultState(dataset):
+    features = sorted(dataset.features)
+    return {
+        'schengen_country': sorted(dataset.index.countries)[0],
+        'feature_1': features[0],
+        'feature_2': features[0],
+        'year_range': [dataset.min_time, dataset.max_time],
+        'hoverData': DEFAULT_HOVER,
+        'toggle': True,
+    }
+
+# Outputs of the default view by snapshot key, rendered by the plain callback functions
+def defaultFigures(dataset):
+    state = defaultState(dataset)
+    schengen_country, feature_1, feature_2 = state['schengen_country'], state['feature_1'], state['feature_2']
+    year_range, hoverData, toggle = state['year_range'], state['hoverData'], state['toggle']
+    renders = [
+        (worldmapKey(schengen_country, feature_1, year_range),
+         lambda: inspect.unwrap(update_worldmap)(schengen_country, feature_1, year_range)),
+        (barplotKey(toggle, feature_1, schengen_country, year_range),
+         lambda: list(inspect.unwrap(update_barplot)(toggle, feature_1, schengen_country, year_range))),
+        (bubbleplotKey(schengen_country, hoverData, feature_1, feature_2, year_range),
+         lambda: inspect.unwrap(update_bubbleplot)(schengen_country, hoverData, feature_1, feature_2, year_range)),
+        (lineplotKey(schengen_country, hoverData, feature_1, year_range),
+         lambda: inspect.unwrap(update_lineplot)(schengen_country, hoverData, feature_1, year_range)),
+    ]
+    return {key: snapshot.get_or_render(dataset.source, key, render) for key, render in renders}
+
+# World map and bar charts of every Schengen country x feature over the whole time range
+def combinationFigures(dataset):
+    year_range = [dataset.min_time, dataset.max_time]
+    figures = {}
+    for schengen_country in [ALL_COUNTRIES] + list(dataset.index.countries):
+        for feature in dataset.features:
+            figures[worldmapKey(schengen_country, feature, year_range)] = \
+                inspect.unwrap(update_worldmap)(schengen_country, feature, year_range)
+            for toggle in [False, True]:
+                figures[barplotKey(toggle, feature, schengen_country, year_range)] = \
+                    list(inspect.unwrap(update_barplot)(toggle, feature, schengen_country, year_range))
+    return figures
 
 ################################
 # Interactive callback functions
 ################################
 
-# Callback function to update the map
+# Inputs that only change the data of a figure, not its layout. Callbacks
+# fired by these alone may answer with a patch (VISA_FIGURE_PATCH=1).
+filter_inputs = ["Schengen country.value", "time_slider.value"]
+hover_inputs = filter_inputs + ["worldmap.hoverData"]
+
+# Queue, deduplicate and drop superseded hover-driven computations
+hover_coalescer = HoverCoalescer(settings.HOVER_MAX_CONCURRENT) if settings.HOVER_COALESCE else None
+
+# Hover-driven callbacks run on the server unless the browser computes the
+# hover highlight from the hover_store (VISA_CLIENTSIDE_HOVER=1)
+def hover_callback(*args, **kwargs):
+    if settings.CLIENTSIDE_HOVER:
+        return lambda function: function
+    return tab_callback(app, *args, **kwargs)
+
+# Controls of the selected dataset, keeping the selection where the dataset has it
 @app.callback(
+    Output("Schengen country", "options"),
+    Output("Schengen country", "value"),
+    Output("Country feature 1", "options"),
+    Output("Country feature 1", "value"),
+    Output("Country feature 2", "options"),
+    Output("Country feature 2", "value"),
+    Output("time_slider", "min"),
+    Output("time_slider", "max"),
+    Output("time_slider", "value"),
+    Output("time_slider", "marks"),
+    Input("Dataset", "value"),
+    State("Schengen country", "value"),
+    State("Country feature 1", "value"),
+    State("Country feature 2", "value"),
+    State("time_slider", "value"),
+    prevent_initial_call = True,
+)
+def update_dataset_controls(dataset_name, schengen_country, feature_1, feature_2, year_range):
+    controls = datasets.controls(dataset_name)
+    min_time, max_time = controls['min_time'], controls['max_time']
+
+    country_options, first_country = dropdownItems(np.array(controls['countries'], dtype = object), [ALL_COUNTRIES])
+    feature_options, first_feature = dropdownItems(np.array(controls['features']))
+
+    def keep(value, options, default):
+        return value if value in [option['value'] for option in options] else default
+
+    # The selected years clipped to the years of the dataset, all of them if none are left
+    start, stop = max(year_range[0], min_time), min(year_range[1], max_time)
+    year_range = [start, stop] if start <= stop else [min_time, max_time]
+
+    return (country_options, keep(schengen_country, country_options, first_country),
+            feature_options, keep(feature_1, feature_options, first_feature),
+            feature_options, keep(feature_2, feature_options, first_feature),
+            min_time, max_time, year_range, sliderMarks(min_time, max_time))
+
+
+# Callback function to update the map
+@tab_callback(app,
     Output('worldmap', 'figure'),
     [
         Input("Schengen country", "value"),
         Input("Country feature 1", "value"),
-        Input("time_slider", "value")
+        Input("time_slider", "value"),
+        Input("Dataset", "value")
     ],
+    prevent_initial_call = settings.PRERENDER,
 )
+@instrumented
+@prerendered(worldmapKey)
 # Function for callback
-def update_worldmap(schengen_country, feature_1, year_range):
+def update_worldmap(schengen_country, feature_1, year_range, dataset_name = None):
+    dataset = datasets.view(dataset_name, schengen_country)
 
-    # Filter by Schengen country if not all countries are selected
-    if schengen_country != "All countries":
-        df_schengen_country = df[df['Schengen country'].str.contains(schengen_country)] # includes all rows for selected Schengen countries
+    # One median per country of origin in the selected Schengen country and years
+    with span("groupby"):
+        df_per_origin = worldMapFrame(schengen_country, year_range, feature_1, dataset)
 
-    # Filter dataset by year range
-    df_filtered_year = df_schengen_country[(df_schengen_country['Year'] >= year_range[0]) & (df_schengen_country['Year'] <= year_range[1])]
+    with span("figure"):
+        # Only send the new data if the map is already on the client
+        if can_patch(filter_inputs):
+            return patch_figure(worldMapData(df_per_origin, feature_1))
 
-    # Display selected feature on worldmap
-    worldmap = drawWorldMap(data = df_filtered_year, feature = feature_1)
+        # Display selected feature on worldmap
+        worldmap = drawWorldMap(data = df_per_origin, feature = feature_1)
     
     return worldmap
 
 # Callback function for barplot
-@app.callback(
+@tab_callback(app,
     Output('barplot', 'figure'),
     Output('my-toggle-switch-output', 'children'),    
     Input('my-toggle-switch', 'value'),
     Input("Country feature 1", "value"),
     Input("Schengen country", "value"),
-    Input("time_slider", "value")
+    Input("time_slider", "value"),
+    Input("Dataset", "value"),
+    prevent_initial_call = settings.PRERENDER,
 )
-def update_barplot(toggle, feature, schengen_country, year_range):
-    
-    # Filter by Schengen country if not all countries are selected
-    if schengen_country != "All countries":
-        df_schengen_country = df[df['Schengen country'].str.contains(schengen_country)] # includes all rows for selected Schengen countries
-    # Filter dataset by year range
-    df_filtered_year = df_schengen_country[(df_schengen_country['Year'] >= year_range[0]) & (df_schengen_country['Year'] <= year_range[1])]
-    # Calculate median across all years
-    df_filtered_year = df_filtered_year.groupby('Country').median()[feature].reset_index()
+@instrumented
+@prerendered(barplotKey)
+def update_barplot(toggle, feature, schengen_country, year_range, dataset_name = None):
+    dataset = datasets.view(dataset_name, schengen_country)
     
-    if toggle == False:
-        df_filtered_year = pd.DataFrame(df_filtered_year.sort_values(by=[str(feature)], ascending=False)).reset_index()
-        df_filtered_year = df_filtered_year.head(10)
-    else:
-        df_filtered_year = pd.DataFrame(df_filtered_year.sort_values(by=[str(feature)], ascending=True)).reset_index()
-        df_filtered_year = df_filtered_year.head(10)
-    # Draw bar plot with selected feature
-    barplot = drawBarplot(data = df_filtered_year, feature = feature)
+    # Median across the selected years of the 10 highest countries, or of the 10 lowest when toggled
+    with span("groupby"):
+        df_filtered_year = barplotFrame(schengen_country, year_range, feature, bool(toggle), dataset)
+
+    with span("figure"):
+        # Only send the new bars if the bar chart is already on the client
+        if can_patch(filter_inputs + ["my-toggle-switch.value"]):
+            return patch_figure(barplotData(df_filtered_year, feature)), 'Change order: {}.'.format(toggle)
+
+        # Draw bar plot with selected feature
+        barplot = drawBarplot(data = df_filtered_year, feature = feature)
     
     return barplot, 'Change order: {}.'.format(toggle)
 
 
 # Callback to update bubble plot by the country, where the user hovers over
-@app.callback(
+@hover_callback(
     Output("bubble_plot", "figure"),
     Input("Schengen country", "value"),
     Input('worldmap', 'hoverData'),
     Input("Country feature 1", "value"),
     Input("Country feature 2", "value"),
-    Input("time_slider", "value"))
+    Input("time_slider", "value"),
+    Input("bubble_view", "data"),
+    Input("Dataset", "value"),
+    prevent_initial_call = settings.PRERENDER)
+@instrumented
+@prerendered(bubbleplotKey)
+@coalesced(hover_coalescer)
 # Function to update bubble plot
-def update_bubbleplot(schengen_country, hoverData, feature_1, feature_2, year_range):
-
-    # Filter by Schengen country if not all countries are selected
-    if schengen_country != "All countries":
-        df_schengen_country = df[df['Schengen country'].str.contains(schengen_country)] # includes all rows for selected Schengen countries
-
-    # Filter dataset by year range
-    df_filtered_year = df_schengen_country[(df_schengen_country['Year'] >= year_range[0]) & (df_schengen_country['Year'] <= year_range[1])]
-
-    # Draw bubbleplot
-    bubbleplot = drawBubblePlot(data = df_filtered_year, 
-                                        feature_x = feature_2, 
-                                        feature_y = feature_1, 
-                                        country_code = hoverData['points'][0]['location'])
+def update_bubbleplot(schengen_country, hoverData, feature_1, feature_2, year_range, view = None, dataset_name = None):
+    dataset = datasets.view(dataset_name, schengen_country)
+
+    # Filter by Schengen country and year range
+    df_filtered_year = filter_data(schengen_country, year_range, dataset = dataset)
+
+    country_code = hoverData['points'][0]['location']
+    # Rows of the hovered country of origin, from positions the filter cache shares across hovers and workers
+    df_origin_country = filter_data(schengen_country, year_range, country_code, dataset) if country_code else None
+
+    # Zoomed axis ranges, if they belong to the figure of this filter
+    revision = bubbleRevision(dataset.source, schengen_country, year_range, feature_2, feature_1)
+    if not view or view.get('revision') != revision:
+        view = None
+    cache_key = (dataset.source, schengen_country, tuple(year_range), feature_2, feature_1)
+
+    with span("figure"):
+        # Only send the new points if the bubble plot is already on the client
+        if can_patch(hover_inputs + ["bubble_view.data"]):
+            return patch_figure(bubblePlotData(df_filtered_year, feature_2, feature_1, df_origin_country, view, cache_key),
+                                bubbleLayout(df_filtered_year, revision))
+
+        # Draw bubbleplot
+        bubbleplot = drawBubblePlot(data = df_filtered_year, 
+                                            feature_x = feature_2, 
+                                            feature_y = feature_1, 
+                                            df_origin_country = df_origin_country,
+                                            view = view,
+                                            revision = revision,
+                                            cache_key = cache_key)
 
     return bubbleplot
 
 
 # Callback to update line plot by the country, where the user hovers over
-@app.callback(
+@hover_callback(
     Output('line_plot', 'figure'),
     Input("Schengen country", "value"),
     Input('worldmap', 'hoverData'),
     Input("Country feature 1", "value"),
-    Input("time_slider", "value"))
+    Input("time_slider", "value"),
+    Input("Dataset", "value"),
+    Input("line_series", "value"),
+    prevent_initial_call = settings.PRERENDER)
+@instrumented
+@prerendered(lineplotKey)
+@coalesced(hover_coalescer)
 # Function to update line plot
-def update_lineplot(schengen_country, hoverData, feature_1, year_range):
+def update_lineplot(schengen_country, hoverData, feature_1, year_range, dataset_name = None, series = None):
 
-    # Filter by Schengen country if not all countries are selected
-    if schengen_country != "All countries":
-        df_schengen_country = df[df['Schengen country'].str.contains(schengen_country)] # includes all rows for selected Schengen countries
+    dataset = datasets.view(dataset_name, schengen_country)
 
-    # Filter by country of origin
     # Extract country names from map hover data and the displayed alpha country code
     origin_country = hoverData['points'][0]['location']
-    # Then filter by country
-    df_origin_country = df_schengen_country[df_schengen_country['Country code'].str.contains(origin_country)] # includes all rows for selected Schengen countries
+    label = series_label(series, feature_1)
+
+    # One value per year: a lookup in the time series of the cube, with the
+    # rollup over all Schengen countries for "All countries"
+    with span("groupby"):
+        if dataset.cube.exact:
+            df_series = dataset.timeseries.frame(schengen_country, origin_country, feature_1, year_range, series)
+        else:
+            df_origin = filter_data(schengen_country, [dataset.min_time, dataset.max_time], origin_country, dataset)
+            df_series = series_frame(df_origin, feature_1, year_range, series)
+
+    with span("figure"):
+        # Only send the new series if the line plot is already on the client
+        if can_patch(hover_inputs):
+            return patch_figure(linePlotData(df_series, "Year", label))
+
+        # Plot bubble plot
+        lineplot = drawLinePlot(data = df_series, feature_x = "Year", feature_y = label,
+                                time_range = (dataset.min_time, dataset.max_time))
 
-    # Filter dataset by year range
-    df_filtered_year = df_origin_country[(df_origin_country['Year'] >= year_range[0]) & (df_origin_country['Year'] <= year_range[1])]
+    return lineplot
 
-    # Plot bubble plot
-    lineplot = drawLinePlot(data = df_filtered_year, feature_x = "Year", feature_y = feature_1)
 
-    return lineplot
+# Figures for the current filter and the rows of every country of origin,
+# from which the browser draws the hover highlight
+@instrumented
+def hoverStoreData(schengen_country, feature_1, feature_2, year_range, dataset_name = None):
+    dataset = datasets.view(dataset_name, schengen_country)
+
+    # Filter by Schengen country and year range
+    df_filtered_year = filter_data(schengen_country, year_range, dataset = dataset)
+
+    # Rows of each country of origin for the highlight, and its time series:
+    # the same series as update_lineplot, with the rollup for "All countries"
+    with span("groupby"):
+        origins = df_filtered_year.groupby('Country code', sort = False, observed = True)
+        if dataset.cube.exact:
+            series = dataset.timeseries.by_origin(schengen_country, feature_1, year_range)
+        else:
+            frames = {code: series_frame(rows, feature_1, year_range) for code, rows in origins}
+            series = {code: (df['Year'].to_numpy(), df[feature_1].to_numpy()) for code, df in frames.items()}
+        slices = {}
+        for code, rows in origins:
+            years, values = series.get(code, ([], []))
+            slices[code] = {'x': rows[feature_2], 'y': rows[feature_1], 'line': {'x': years, 'y': values}}
+
+    with span("figure"):
+        return {
+            'bubble': drawBubblePlot(data = df_filtered_year, feature_x = feature_2, feature_y = feature_1,
+                                     revision = bubbleRevision(dataset.source, schengen_country, year_range,
+                                                               feature_2, feature_1)),
+            'line': drawLinePlot(data = df_filtered_year.iloc[0:0], feature_x = "Year", feature_y = feature_1,
+                                 time_range = (dataset.min_time, dataset.max_time)),
+            'slices': slices,
+        }
+
+
+if not settings.CLIENTSIDE_HOVER:
+    # Keep the zoomed axis ranges of the bubble plot for re-binning (assets/clientside.js)
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'visa', function_name = 'bubbleView'),
+        Output('bubble_view', 'data'),
+        Input('bubble_plot', 'relayoutData'),
+        State('bubble_plot', 'figure'),
+        State('bubble_view', 'data'))
+
+if settings.CLIENTSIDE_HOVER:
+    # Refresh the store when the filter changes
+    app.callback(
+        Output('hover_store', 'data'),
+        Input("Schengen country", "value"),
+        Input("Country feature 1", "value"),
+        Input("Country feature 2", "value"),
+        Input("time_slider", "value"),
+        Input("Dataset", "value"))(hoverStoreData)
+
+    # Hover highlighting in the browser (assets/clientside.js)
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'visa', function_name = 'bubblePlot'),
+        Output("bubble_plot", "figure"),
+        Input('worldmap', 'hoverData'),
+        Input('hover_store', 'data'))
+
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'visa', function_name = 'linePlot'),
+        Output('line_plot', 'figure'),
+        Input('worldmap', 'hoverData'),
+        Input('hover_store', 'data'))
+
+
+# Cache and hover queue statistics for sizing workers
+@app.server.route('/stats')
+def stats():
+    return {
+        'filter_cache': filter_cache.stats(),
+        'hover': hover_coalescer.stats() if hover_coalescer else None,
+        'executor': aggregation_executor.stats(),
+        'http': http_cache.stats(),
+        'data': live.current.summary(),
+        'datasets': datasets.stats(),
+        'memory': memory_report(live.current.frame),
+    }
+
+
+# Cache and hover queue gauges for /metrics
+def cache_metrics():
+    gauges = [('visa_filter_cache_' + name, {}, value) for name, value in filter_cache.stats().items()]
+    for name, template in [('worldmap', worldMapTemplate), ('barplot', barplotTemplate),
+                           ('bubble_plot', bubblePlotTemplate), ('line_plot', linePlotTemplate)]:
+        info = template.cache_info()
+        requests = info.hits + info.misses
+        gauges.append(('visa_figure_template_hit_rate', {'figure': name}, info.hits / requests if requests else 0.0))
+    if hover_coalescer:
+        gauges += [('visa_hover_' + name, {}, value) for name, value in hover_coalescer.stats().items()]
+    gauges += [('visa_executor_' + name, {}, value) for name, value in aggregation_executor.stats().items()
+               if not isinstance(value, str)]
+    gauges += [('visa_http_' + name, {}, value) for name, value in http_cache.stats().items()]
+    gauges += [('visa_partition_' + name, {}, value) for name, value in datasets.cache.stats().items()]
+    for name, column in memory_report(live.current.frame).items():
+        gauges.append(('visa_column_bytes', {'column': name, 'mapped': str(column['mapped']).lower()}, column['bytes']))
+    return gauges
+
+instrumentation.metrics.add_collector(cache_metrics)
+
+
+# Set last: dash renders the layout once to validate it (without the
+# default figures, see serveLayout)
+app.layout = serveLayout
 
 
 # Run the dashbord on a local server
 if __name__ == "__main__":
-    app.run_server(debug=True, port=8050, host='0.0.0.0')
\ No newline at end of file
+    app.run(debug=True, port=8050, host='0.0.0.0')
\ No newline at end of file
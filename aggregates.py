@@ -0,0 +1,205 @@
+#############################
+# Pre-aggregated feature cube
+#############################
+# Every feature is kept as a dense (Schengen country, origin country, year)
+# array with NaN for missing rows, in the dtype of the store column
+# (float32 for most features), built the first time the feature is
+# selected. Medians over a year range are a sort along one small axis; the
+# medians of the last MEDIAN_CACHE_SIZE (feature, Schengen country, year
+# range) queries are kept, so repeating a query is a lookup, and the
+# top/bottom k countries are picked with np.argpartition instead of
+# sorting all of them.
+#
+# After a data refresh the features built by the previous cube are copied
+# over and only the changed (Schengen country, year) cells are rewritten.
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from data_index import ALL_COUNTRIES
+
+
+# Median vectors (one value per origin country) kept per cube
+MEDIAN_CACHE_SIZE = 1024
+
+# Median of every row ignoring NaN (NaN for rows without values). Faster
+# than np.nanmedian for the short rows of the cube and warning free.
+def nanmedian_rows(block):
+    if block.shape[1] == 0:
+        return np.full(len(block), np.nan)
+    ordered = np.sort(block, axis = 1) # NaN sort to the end
+    counts = np.count_nonzero(~np.isnan(block), axis = 1)
+    rows = np.arange(len(block))
+    # Mean of the middle values in double precision, like pandas
+    lower = ordered[rows, np.maximum((counts - 1) // 2, 0)].astype(np.float64)
+    upper = ordered[rows, np.maximum(counts // 2, 0)]
+    medians = (lower + upper) / 2
+    medians[counts == 0] = np.nan
+    return medians
+
+
+# Positions of the k smallest (ascending) or largest values, ordered, ignoring NaN
+def top_k_positions(values, k, ascending):
+    valid = np.flatnonzero(~np.isnan(values))
+    keys = values[valid] if ascending else -values[valid]
+    if len(valid) > k:
+        chosen = np.argpartition(keys, k - 1)[:k]
+        valid, keys = valid[chosen], keys[chosen]
+    return valid[np.argsort(keys, kind = "mergesort")]
+
+
+class FeatureCube:
+
+    def __init__(self, index, previous = None, changed = None):
+        frame = index.frame
+        self.index = index
+        self.frame = frame
+        self.countries = index.countries
+        self.country_positions = {name: i for i, name in enumerate(self.countries)}
+
+        schengen_codes = pd.Categorical(frame["Schengen country"], categories = self.countries).codes
+        origin_codes, origins = pd.factorize(frame["Country"], sort = True)
+        self.origins = np.asarray(origins, dtype = object)
+        # Alpha-3 code of every origin country (for the world map locations)
+        self.origin_codes = np.empty(len(self.origins), dtype = object)
+        self.origin_codes[origin_codes] = np.asarray(frame["Country code"], dtype = object)
+
+        years = frame["Year"].to_numpy()
+        self.first_year = int(years.min()) if len(years) else 0
+        self.years = np.arange(self.first_year, int(years.max()) + 1 if len(years) else 0)
+
+        self.shape = (len(self.countries), len(self.origins), len(self.years))
+        self.cells = (schengen_codes, origin_codes, years - self.first_year)
+        # A cube cell holds one row; datasets with repeated keys use the frame instead
+        flat = np.ravel_multi_index(self.cells, self.shape) if len(frame) else np.array([], dtype = int)
+        self.exact = len(np.unique(flat)) == len(flat)
+
+        self.cubes = {}
+        # (feature, Schengen country, first year, last year + 1) -> medians per origin
+        self.medians_cache = OrderedDict()
+        self.lock = threading.Lock()
+
+        if previous is not None and changed is not None:
+            self.carry_over(previous, changed)
+
+    # Copy the features built by a cube of the same countries and origins
+    # over the same or fewer years, rewriting only the changed cells
+    def carry_over(self, previous, changed):
+        offset = previous.first_year - self.first_year
+        if not (self.exact and previous.exact and self.countries == previous.countries
+                and np.array_equal(self.origins, previous.origins)
+                and offset >= 0 and offset + len(previous.years) <= len(self.years)):
+            return
+
+        changed = [(self.country_positions[country], year) for country, year in changed
+                   if country in self.country_positions]
+        rows = [np.arange(*self.index.bounds(self.countries[position], (year, year))) for position, year in changed]
+        rows = np.concatenate(rows) if rows else np.array([], dtype = int)
+        cells = tuple(axis[rows] for axis in self.cells)
+        # Cells of years outside this cube had no rows before and have none now
+        slabs = [(position, year - self.first_year) for position, year in changed
+                 if 0 <= year - self.first_year < len(self.years)]
+
+        for feature, old in list(previous.cubes.items()):
+            if feature not in self.frame.columns:
+                continue
+            cube = np.full(self.shape, np.nan, dtype = old.dtype)
+            cube[:, :, offset:offset + old.shape[2]] = old
+            for position, year in slabs:
+                cube[position, :, year] = np.nan
+            cube[cells] = self.frame[feature].to_numpy()[rows]
+            self.cubes[feature] = cube
+
+    # Dense array of one feature, built on first use
+    def values(self, feature):
+        cube = self.cubes.get(feature)
+        if cube is None:
+            with self.lock:
+                cube = self.cubes.get(feature)
+                if cube is None:
+                    # float32 columns stay float32, anything else is float64 (NaN marks missing cells)
+                    dtype = np.float32 if self.frame[feature].dtype == np.float32 else np.float64
+                    cube = np.full(self.shape, np.nan, dtype = dtype)
+                    cube[self.cells] = self.frame[feature].to_numpy(dtype = dtype)
+                    self.cubes[feature] = cube
+        return cube
+
+    # Year axis slice for a year range
+    def year_slice(self, year_range):
+        start = max(int(year_range[0]) - self.first_year, 0)
+        stop = max(int(year_range[1]) - self.first_year + 1, start)
+        return slice(start, stop)
+
+    # Median of a feature per origin country over a year range, pooled over
+    # all Schengen countries for "All countries" (like groupby('Country').median())
+    def medians(self, schengen_country, year_range, feature):
+        years = self.year_slice(year_range)
+        key = (feature, schengen_country, years.start, years.stop)
+        with self.lock:
+            medians = self.medians_cache.get(key)
+            if medians is not None:
+                self.medians_cache.move_to_end(key)
+                return medians
+
+        medians = self.compute_medians(schengen_country, years, feature)
+        # Shared by every caller, so read only
+        medians.flags.writeable = False
+        with self.lock:
+            self.medians_cache[key] = medians
+            while len(self.medians_cache) > MEDIAN_CACHE_SIZE:
+                self.medians_cache.popitem(last = False)
+        return medians
+
+    def compute_medians(self, schengen_country, years, feature):
+        cube = self.values(feature)
+        if schengen_country == ALL_COUNTRIES:
+            block = cube[:, :, years].transpose(1, 0, 2).reshape(len(self.origins), -1)
+        elif schengen_country in self.country_positions:
+            block = cube[self.country_positions[schengen_country], :, years]
+        else:
+            block = np.empty((len(self.origins), 0))
+        return nanmedian_rows(block)
+
+    # Countries and medians of the k highest (or lowest if ascending) medians
+    def top_k(self, schengen_country, year_range, feature, k = 10, ascending = False):
+        medians = self.medians(schengen_country, year_range, feature)
+        positions = top_k_positions(medians, k, ascending)
+        return pd.DataFrame({"Country": self.origins[positions], feature: medians[positions]})
+
+    # Code, name and median of every origin country with a value in the year range
+    def per_origin(self, schengen_country, year_range, feature):
+        medians = self.medians(schengen_country, year_range, feature)
+        valid = np.flatnonzero(~np.isnan(medians))
+        return pd.DataFrame({"Country code": self.origin_codes[valid], "Country": self.origins[valid],
+                             feature: medians[valid]})
+
+
+# Same ranking straight from a filtered frame (datasets the cube cannot hold)
+def top_k_frame(data, feature, k = 10, ascending = False):
+    medians = data.groupby("Country", observed = True)[feature].median()
+    positions = top_k_positions(medians.to_numpy(dtype = np.float64), k, ascending)
+    return pd.DataFrame({"Country": medians.index[positions], feature: medians.to_numpy()[positions]})
+
+
+# Same per origin medians straight from a filtered frame
+def per_origin_frame(data, feature):
+    medians = data.groupby(["Country code", "Country"], observed = True)[feature].median().dropna()
+    return medians.reset_index()
+
+
+# Tasks of the execution backend (executor.py). They read nothing but the
+# dataset, so they run in the request thread or in a pool process alike.
+
+def dataset_per_origin(dataset, schengen_country, year_range, feature):
+    if dataset.cube.exact:
+        return dataset.cube.per_origin(schengen_country, year_range, feature)
+    return per_origin_frame(dataset.index.query(schengen_country, year_range), feature)
+
+
+def dataset_top_k(dataset, schengen_country, year_range, feature, k = 10, ascending = False):
+    if dataset.cube.exact:
+        return dataset.cube.top_k(schengen_country, year_range, feature, k, ascending)
+    return top_k_frame(dataset.index.query(schengen_country, year_range), feature, k, ascending)
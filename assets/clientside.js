@@ -0,0 +1,77 @@
+// Hover highlighting computed in the browser (VISA_CLIENTSIDE_HOVER=1).
+// The server stores the bubble and line plot figures for the current
+// filter together with the rows and the time series of every country of
+// origin in the hover_store; hovering the world map only picks a slice
+// from it.
+// bubbleView keeps the zoomed axis ranges of the bubble plot for the
+// server to bin the points in view again (scatter_lod.py), only for
+// figures the server marked with layout.meta.rebin: plain markers of all
+// points zoom in the browser without a round trip.
+
+(function() {
+    // Rows and time series of the hovered country of origin, empty if it has none
+    function hoveredSlice(hoverData, store) {
+        var code = hoverData && hoverData.points && hoverData.points[0].location;
+        return store.slices[code] || {x: [], y: [], line: {x: [], y: []}};
+    }
+
+    // Copy of a figure with new values for some keys of one trace
+    function withTrace(figure, position, updates) {
+        var data = figure.data.slice();
+        data[position] = Object.assign({}, data[position], updates);
+        return Object.assign({}, figure, {data: data});
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        visa: {
+            // Bubble plot with the points of the hovered country highlighted
+            bubblePlot: function(hoverData, store) {
+                if (!store) {
+                    return window.dash_clientside.no_update;
+                }
+                var slice = hoveredSlice(hoverData, store);
+                return withTrace(store.bubble, 1, {x: slice.x, y: slice.y});
+            },
+
+            // Zoomed axis ranges of the bubble plot, tagged with the figure
+            // revision so the server ignores ranges of a previous filter
+            bubbleView: function(relayoutData, figure, view) {
+                var rebin = figure && figure.layout && figure.layout.meta && figure.layout.meta.rebin;
+                if (!relayoutData || !rebin) {
+                    return window.dash_clientside.no_update;
+                }
+                var revision = figure && figure.layout ? figure.layout.uirevision : null;
+                var next = {revision: revision, x: null, y: null};
+                if (view && view.revision === revision) {
+                    next.x = view.x;
+                    next.y = view.y;
+                }
+                var changed = false;
+                ['x', 'y'].forEach(function(axis) {
+                    var prefix = axis + 'axis.';
+                    if (relayoutData[prefix + 'autorange']) {
+                        next[axis] = null;
+                        changed = true;
+                    } else if (relayoutData[prefix + 'range[0]'] !== undefined) {
+                        next[axis] = [relayoutData[prefix + 'range[0]'], relayoutData[prefix + 'range[1]']];
+                        changed = true;
+                    } else if (relayoutData[prefix + 'range']) {
+                        next[axis] = relayoutData[prefix + 'range'];
+                        changed = true;
+                    }
+                });
+                // Resizes and other layout events keep the current view
+                return changed ? next : window.dash_clientside.no_update;
+            },
+
+            // Time series of the hovered country
+            linePlot: function(hoverData, store) {
+                if (!store) {
+                    return window.dash_clientside.no_update;
+                }
+                var slice = hoveredSlice(hoverData, store);
+                return withTrace(store.line, 0, slice.line);
+            }
+        }
+    });
+})();
@@ -0,0 +1,211 @@
+#############################
+# Callback benchmark
+#############################
+# Drives update_worldmap, update_barplot, update_bubbleplot and
+# update_lineplot of EU_map_layout over a grid of dropdown, slider and
+# hover inputs on synthetic datasets of several sizes. For every callback
+# it reports p50/p95/p99 latency of the stages the callbacks time with
+# their instrumentation spans (filter, groupby, figure; see
+# instrumentation.py), of serializing the output and of the whole
+# callback, as JSON:
+#
+#   $ python benchmarks/bench_callbacks.py --scales 1,10,100 --output bench.json
+#   $ python benchmarks/bench_callbacks.py --scales 1 --compare bench.json
+#
+# Each scale runs in its own process in a temporary directory holding the
+# generated data, since EU_map_layout loads the data at import.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+# Import the dashboard from the repository with its stage timers on
+def setup_child():
+    os.environ["VISA_METRICS"] = "1"
+    sys.path.insert(0, REPO_DIR)
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000 # milliseconds
+    return {
+        "n": len(samples),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+    }
+
+
+####################################
+# Callbacks
+####################################
+
+# The callback of EU_map_layout called with the inputs of one grid point
+def callback_call(m, name, inputs):
+    schengen_country, feature_1, feature_2, year_range, code, toggle = inputs
+    hover = {'points': [{'location': code}]}
+    calls = {
+        "update_worldmap": lambda: m.update_worldmap(schengen_country, feature_1, year_range),
+        "update_barplot": lambda: m.update_barplot(toggle, feature_1, schengen_country, year_range),
+        "update_bubbleplot": lambda: m.update_bubbleplot(schengen_country, hover, feature_1, feature_2, year_range),
+        "update_lineplot": lambda: m.update_lineplot(schengen_country, hover, feature_1, year_range),
+    }
+    return calls[name]
+
+
+# Run a callback as a fresh interaction and serialize its output. Returns
+# the seconds of the stages its spans timed (filter, groupby, figure; a
+# groupby that filters includes the filter), of serializing and in total,
+# and the response body.
+def time_callback(m, call, to_json):
+    from instrumentation import record_stages
+
+    # The filter and median caches start empty, like for a new interaction
+    m.filter_cache.clear()
+    m.live.current.cube.medians_cache.clear()
+    with record_stages() as stages:
+        start = time.perf_counter()
+        output = call()
+        callback = time.perf_counter() - start
+    start = time.perf_counter()
+    body = to_json(output)
+    stages["serialize"] = time.perf_counter() - start
+    stages["total"] = callback + stages["serialize"]
+    return stages, body
+
+
+CALLBACKS = ["update_worldmap", "update_barplot", "update_bubbleplot", "update_lineplot"]
+
+
+# Dropdown, slider, hover and toggle values to drive the callbacks with
+def input_grid(m, size):
+    dataset = m.live.current
+    countries = [m.ALL_COUNTRIES] + [name for name in ["Germany", "France", "Malta"] if name in dataset.index.countries]
+    features = [feature for feature in ["Visas issued", "Visas denied", "Total population"] if feature in dataset.features] or dataset.features[:3]
+    min_time, max_time = dataset.min_time, dataset.max_time
+    mid = (min_time + max_time) // 2
+    year_ranges = [[min_time, max_time], [mid, max_time], [max_time, max_time]]
+    codes = [code for code in ["CHN", "IND", "TUR", "MAR"] if code in set(dataset.frame["Country code"])]
+
+    grid = list(itertools.product(countries, features, features[:2], year_ranges, codes[:2], [False, True]))
+    if size == "small":
+        grid = grid[::max(len(grid) // 24, 1)]
+    return grid
+
+
+# Benchmark the data in the current directory (runs in a child process)
+def run_scale(repeat, grid_size):
+    start = time.perf_counter()
+    import EU_map_layout as m
+    import_time = time.perf_counter() - start
+
+    from plotly.io.json import to_json_plotly
+
+    results = {}
+    grid = input_grid(m, grid_size)
+    for name in CALLBACKS:
+        samples = {}
+        for inputs in grid:
+            call = callback_call(m, name, inputs)
+            for _ in range(repeat):
+                stages, _ = time_callback(m, call, to_json_plotly)
+                for stage, seconds in stages.items():
+                    samples.setdefault(stage, []).append(seconds)
+        results[name] = {stage: percentiles(values) for stage, values in samples.items()}
+
+    return {"rows": len(m.live.current.frame), "import_s": import_time, "inputs": len(grid), "callbacks": results}
+
+
+# Generate a dataset, build its store and benchmark it in a fresh process
+# (running script, this one by default, with --child and args)
+def bench_scale(scale, repeat, grid_size, script = __file__, args = ()):
+    sys.path.insert(0, BENCH_DIR)
+    from synthetic import write_dataset
+
+    with tempfile.TemporaryDirectory() as workdir:
+        write_dataset(os.path.join(workdir, "data", "df_iso_schengen_origin.csv"), scale)
+        env = dict(os.environ, PYTHONPATH = os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, "data_store.py")], cwd = workdir, env = env,
+                       check = True, stdout = subprocess.DEVNULL)
+        output = subprocess.run([sys.executable, os.path.abspath(script), "--child",
+                                 "--repeat", str(repeat), "--grid", grid_size] + list(args),
+                                cwd = workdir, env = env, check = True, stdout = subprocess.PIPE)
+    return json.loads(output.stdout.decode().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd = REPO_DIR, stdout = subprocess.PIPE,
+                              stderr = subprocess.DEVNULL, check = True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Ratio of the p50 of every stage to a previous run (> 1 is slower)
+def compare(results, baseline):
+    rows = []
+    for scale, scale_results in results["scales"].items():
+        old_scale = baseline["scales"].get(scale)
+        if old_scale is None:
+            continue
+        for name, stages in scale_results["callbacks"].items():
+            for stage, stats in stages.items():
+                old = old_scale["callbacks"].get(name, {}).get(stage)
+                if old and old["p50_ms"] > 0:
+                    rows.append((scale, name, stage, old["p50_ms"], stats["p50_ms"], stats["p50_ms"] / old["p50_ms"]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the dashboard callbacks")
+    parser.add_argument("--scales", default = "1,10", help = "comma separated dataset sizes (multiples of the original)")
+    parser.add_argument("--repeat", type = int, default = 3, help = "samples per input combination")
+    parser.add_argument("--grid", choices = ["small", "full"], default = "small", help = "input combinations")
+    parser.add_argument("--output", help = "write the results to this JSON file")
+    parser.add_argument("--compare", help = "JSON results of a previous run to compare with")
+    parser.add_argument("--child", action = "store_true", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        setup_child()
+        print(json.dumps(run_scale(args.repeat, args.grid)))
+        return
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scales": {},
+    }
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        results["scales"][str(scale)] = bench_scale(scale, args.repeat, args.grid)
+        for name, stages in results["scales"][str(scale)]["callbacks"].items():
+            print("scale {:>3}  {:<18} ".format(scale, name)
+                  + "  ".join("{} {:.2f}/{:.2f}/{:.2f}".format(stage, stats["p50_ms"], stats["p95_ms"], stats["p99_ms"])
+                              for stage, stats in stages.items()))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for scale, name, stage, old, new, ratio in compare(results, baseline):
+            print("scale {:>3}  {:<18} {:<9} p50 {:8.2f} -> {:8.2f} ms  x{:.2f}".format(scale, name, stage, old, new, ratio))
+
+
+if __name__ == "__main__":
+    main()
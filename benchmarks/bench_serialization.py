@@ -0,0 +1,145 @@
+#############################
+# Figure encoding benchmark
+#############################
+# Compares the figure encodings of figure_encoding.py (VISA_FIGURE_ENCODING)
+# on the figures of update_worldmap, update_barplot, update_bubbleplot and
+# update_lineplot over the input grid of bench_callbacks.py. For every
+# encoding and callback it reports p50/p95/p99 latency of the figure stage
+# of the callback (building the figure with its encoded arrays) and of
+# serializing its output to JSON, the mean response size raw and gzip
+# compressed, and whether the responses decode to the same values as with
+# "json":
+#
+#   $ python benchmarks/bench_serialization.py --scales 1,10 --output serialization.json
+#
+# Encodings that fall back (no orjson, plotly.js without typed arrays) are
+# reported under the encoding that ran instead.
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_callbacks import (CALLBACKS, bench_scale, callback_call, git_commit, input_grid, percentiles, setup_child,
+                             time_callback)
+
+
+# Serialized figure with its typed arrays decoded to lists
+def decoded(value):
+    if isinstance(value, dict):
+        if "bdata" in value and "dtype" in value:
+            values = np.frombuffer(base64.b64decode(value["bdata"]), dtype = "<" + value["dtype"])
+            if "shape" in value:
+                values = values.reshape([int(size) for size in value["shape"].split(",")])
+            return values.astype(np.float64).tolist()
+        return {key: decoded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decoded(item) for item in value]
+    return value
+
+
+# Same figure values, numbers compared as floats (NaN equal to NaN and null)
+def same_values(a, b):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same_values(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same_values(x, y) for x, y in zip(a, b))
+    numbers = (int, float, type(None))
+    if isinstance(a, numbers) and isinstance(b, numbers) and not isinstance(a, bool) and not isinstance(b, bool):
+        a, b = (np.nan if value is None else float(value) for value in (a, b))
+        return a == b or (np.isnan(a) and np.isnan(b))
+    return a == b
+
+
+# Benchmark every encoding on the data in the current directory (runs in a child process)
+def run_scale(repeat, grid_size, encodings):
+    import EU_map_layout as m
+    import figure_encoding
+    from plotly.io.json import to_json_plotly
+
+    grid = input_grid(m, grid_size)
+    results = {}
+    reference = {}
+    for requested in ["json"] + [encoding for encoding in encodings if encoding != "json"]:
+        encoding = figure_encoding.install(requested)
+        callbacks = {}
+        for name in CALLBACKS:
+            samples = {"figure": [], "serialize": []}
+            raw, compressed, same = [], [], True
+            for i, inputs in enumerate(grid):
+                call = callback_call(m, name, inputs)
+                # Only the figure and serialize stages depend on the encoding
+                for _ in range(repeat):
+                    stages, body = time_callback(m, call, to_json_plotly)
+                    for stage in samples:
+                        samples[stage].append(stages[stage])
+
+                body = body.encode()
+                raw.append(len(body))
+                compressed.append(len(gzip.compress(body, mtime = 0)))
+                values = decoded(json.loads(body))
+                if requested == "json":
+                    reference[(name, i)] = values
+                else:
+                    same = same and same_values(values, reference[(name, i)])
+
+            callbacks[name] = {stage: percentiles(values) for stage, values in samples.items()}
+            callbacks[name].update({"bytes": float(np.mean(raw)), "gzip_bytes": float(np.mean(compressed)),
+                                    "same_values": same})
+        results[encoding] = {"requested": requested, "callbacks": callbacks}
+
+    # Back to the default for anything running after
+    figure_encoding.install("json")
+    return {"rows": len(m.live.current.frame), "inputs": len(grid), "encodings": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the figure encodings")
+    parser.add_argument("--scales", default = "1,10", help = "comma separated dataset sizes (multiples of the original)")
+    parser.add_argument("--encodings", default = "json,orjson,typed", help = "comma separated encodings to compare")
+    parser.add_argument("--repeat", type = int, default = 3, help = "samples per input combination")
+    parser.add_argument("--grid", choices = ["small", "full"], default = "small", help = "input combinations")
+    parser.add_argument("--output", help = "write the results to this JSON file")
+    parser.add_argument("--child", action = "store_true", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    encodings = args.encodings.split(",")
+    if args.child:
+        setup_child()
+        print(json.dumps(run_scale(args.repeat, args.grid, encodings)))
+        return
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scales": {},
+    }
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        scale_results = results["scales"][str(scale)] = bench_scale(scale, args.repeat, args.grid, __file__,
+                                                                    ["--encodings", args.encodings])
+        for encoding, encoding_results in scale_results["encodings"].items():
+            for name, stats in encoding_results["callbacks"].items():
+                print("scale {:>3}  {:<7} {:<18} figure {:.2f}/{:.2f}  serialize {:.2f}/{:.2f} ms  "
+                      "{:>9.0f} bytes  {:>8.0f} gzip{}".format(
+                          scale, encoding, name, stats["figure"]["p50_ms"], stats["figure"]["p95_ms"],
+                          stats["serialize"]["p50_ms"], stats["serialize"]["p95_ms"],
+                          stats["bytes"], stats["gzip_bytes"], "" if stats["same_values"] else "  DIFFERENT VALUES"))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
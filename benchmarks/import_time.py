@@ -0,0 +1,127 @@
+#############################
+# Startup time report
+#############################
+# Imports EU_map_layout in a fresh interpreter with `python -X importtime`
+# and reports the wall time of the import and the import cost per
+# top-level package. EU_map_layout's own entry is the module body
+# (loading the data and building the layout).
+#
+#   $ python benchmarks/import_time.py                 # report
+#   $ python benchmarks/import_time.py --budget 2.5    # fail if slower
+#   $ python benchmarks/import_time.py --forbid plotly.express,IPython
+#
+# --forbid fails if importing the dashboard imports any of these modules
+# (or their submodules) beyond what importing dash alone does; some dash
+# versions import IPython themselves when it is installed. tests/test_startup.py
+# runs both checks.
+#
+# Without data in the working directory a synthetic dataset is generated
+# and its store built, like a deployed dyno.
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+MODULE = "EU_map_layout"
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def measure(workdir):
+    code = "import time; start = time.perf_counter(); import {}; print(time.perf_counter() - start)".format(MODULE)
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd = workdir, env = env,
+                            stdout = subprocess.PIPE, stderr = subprocess.PIPE, check = True)
+    wall = float(result.stdout.decode().split()[-1])
+
+    # Self time of every module, summed per top-level package
+    packages = defaultdict(int)
+    for line in result.stderr.decode().splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            packages[match.group(4).split(".")[0]] += int(match.group(1))
+
+    return {
+        "import_s": wall,
+        "packages_ms": {name: micros / 1000 for name, micros in sorted(packages.items(), key = lambda item: -item[1])},
+    }
+
+
+# Forbidden modules imported by the dashboard, and those dash imports by itself
+def forbidden_imports(workdir, forbidden):
+    code = ("import json, sys; import dash; before = set(sys.modules); import {}; "
+            "print(json.dumps([sorted(before), sorted(set(sys.modules) - before)]))").format(MODULE)
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    result = subprocess.run([sys.executable, "-c", code], cwd = workdir, env = env,
+                            stdout = subprocess.PIPE, check = True)
+    before, added = json.loads(result.stdout.decode().splitlines()[-1])
+
+    def matching(modules):
+        return sorted({name for name in forbidden for module in modules
+                       if module == name or module.startswith(name + ".")})
+    return matching(added), matching(before)
+
+
+def has_data(workdir):
+    data = os.path.join(workdir, "data")
+    return any(os.path.exists(os.path.join(data, name))
+               for name in ["df_iso_schengen_origin.csv", "df_iso_schengen_origin.store"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Report the import time of the dashboard")
+    parser.add_argument("--budget", type = float, help = "fail if importing takes longer (seconds)")
+    parser.add_argument("--top", type = int, default = 15, help = "packages to list")
+    parser.add_argument("--json", action = "store_true", help = "print the report as JSON")
+    parser.add_argument("--forbid", default = "", help = "comma separated modules the import must not load")
+    args = parser.parse_args()
+    forbidden = [name for name in args.forbid.split(",") if name]
+
+    def run(workdir):
+        report = measure(workdir)
+        if forbidden:
+            report["forbidden"], report["imported_by_dash"] = forbidden_imports(workdir, forbidden)
+        return report
+
+    if has_data(os.getcwd()):
+        report = run(os.getcwd())
+    else:
+        sys.path.insert(0, BENCH_DIR)
+        from synthetic import write_dataset
+        with tempfile.TemporaryDirectory() as workdir:
+            write_dataset(os.path.join(workdir, "data", "df_iso_schengen_origin.csv"))
+            subprocess.run([sys.executable, os.path.join(REPO_DIR, "data_store.py")], cwd = workdir,
+                           check = True, stdout = subprocess.DEVNULL)
+            report = run(workdir)
+
+    if args.json:
+        print(json.dumps(report, indent = 2))
+    else:
+        print("import {}: {:.3f} s".format(MODULE, report["import_s"]))
+        for name, millis in list(report["packages_ms"].items())[:args.top]:
+            print("  {:<28} {:8.1f} ms".format(name, millis))
+
+        if report.get("imported_by_dash"):
+            print("  imported by dash itself: {}".format(", ".join(report["imported_by_dash"])))
+
+    failed = False
+    if args.budget is not None and report["import_s"] > args.budget:
+        print("Startup budget exceeded: {:.3f} s > {:.3f} s".format(report["import_s"], args.budget), file = sys.stderr)
+        failed = True
+    if report.get("forbidden"):
+        print("Import loads {}".format(", ".join(report["forbidden"])), file = sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
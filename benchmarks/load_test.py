@@ -0,0 +1,460 @@
+#############################
+# Load test
+#############################
+# Replays browser sessions against a running dashboard through the same
+# requests the Dash renderer sends, to find how many concurrent users a
+# worker configuration sustains. Every simulated user loads the page
+# (layout, dependencies and the initial callbacks) and then keeps
+# interacting with it:
+#
+# - dropdown changes (Schengen country and the two features)
+# - time slider drags (a few slider values in quick succession)
+# - bursts of world map hover events, sent as fast as a moving mouse
+#   fires them without waiting for the previous responses
+#
+# Callbacks are found in /_dash-dependencies and fired with the inputs and
+# states of the session, like the renderer does, and their outputs are
+# fed back (including chained callbacks). It reports throughput, latency
+# percentiles, superseded requests (204) and errors per callback:
+#
+#   $ python benchmarks/load_test.py --url http://localhost:8050 --users 20 --duration 60
+#   $ python benchmarks/load_test.py --gunicorn --workers 2 --threads 4 --users 20
+#   $ python benchmarks/load_test.py --gunicorn --scale 10 --output load.json
+#
+# --gunicorn starts a local gunicorn with the repository's configuration
+# (on the synthetic data of benchmarks/synthetic.py with --scale) and
+# stops it afterwards, so capacity planning runs fully offline.
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_callbacks import git_commit, percentiles
+
+
+# Countries of origin hovered when the page holds no world map yet
+FALLBACK_CODES = ["CHN", "IND", "TUR", "RUS", "MAR", "USA", "BRA", "NGA"]
+
+# Chained callbacks followed per user action
+MAX_CHAIN = 3
+
+
+####################################
+# Dash protocol
+####################################
+
+# Component id and property of "id.prop" (ids may contain spaces, not dots)
+def split_prop(prop_id):
+    component, _, prop = prop_id.rpartition(".")
+    return component, prop
+
+
+# Outputs of a dependency: "..a.x...b.y.." for several outputs, "a.x" for one
+def parse_outputs(output):
+    if output.startswith("..") and output.endswith(".."):
+        return [split_prop(part) for part in output[2:-2].split("...")], True
+    return [split_prop(output)], False
+
+
+# Initial props of every component with an id in the layout tree
+def layout_props(node, props = None):
+    props = {} if props is None else props
+    if isinstance(node, list):
+        for child in node:
+            layout_props(child, props)
+    elif isinstance(node, dict):
+        node_props = node.get("props", {})
+        if "id" in node_props and isinstance(node_props["id"], str):
+            for name, value in node_props.items():
+                props[(node_props["id"], name)] = value
+        for value in node_props.values():
+            if isinstance(value, (dict, list)):
+                layout_props(value, props)
+    return props
+
+
+class Callback:
+
+    def __init__(self, dependency):
+        self.output = dependency["output"]
+        self.outputs, self.multi = parse_outputs(self.output)
+        self.inputs = [(item["id"], item["property"]) for item in dependency["inputs"]]
+        self.state = [(item["id"], item["property"]) for item in dependency.get("state", [])]
+        self.initial = not dependency.get("prevent_initial_call")
+        # Short name for the report: the first output
+        self.name = "{}.{}".format(*self.outputs[0])
+
+    def body(self, props, changed):
+        outputs = [{"id": component, "property": prop} for component, prop in self.outputs]
+        return {
+            "output": self.output,
+            "outputs": outputs if self.multi else outputs[0],
+            "inputs": [{"id": component, "property": prop, "value": props.get((component, prop))}
+                       for component, prop in self.inputs],
+            "state": [{"id": component, "property": prop, "value": props.get((component, prop))}
+                      for component, prop in self.state],
+            "changedPropIds": ["{}.{}".format(*key) for key in changed],
+        }
+
+
+####################################
+# Transport
+####################################
+
+class Client:
+
+    def __init__(self, url, timeout):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        # One cookie jar per simulated browser (session cookie of coalesce.py)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    # Status, decoded JSON (or None) and seconds of one request
+    def request(self, path, body = None):
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(self.url + path, data = data,
+                                         headers = {"Content-Type": "application/json"} if data else {})
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout = self.timeout) as response:
+                payload = response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            payload, status = error.read(), error.code
+        except (urllib.error.URLError, OSError):
+            return None, None, time.perf_counter() - start
+        seconds = time.perf_counter() - start
+        try:
+            return status, json.loads(payload) if payload else None, seconds
+        except ValueError:
+            return status, None, seconds
+
+
+####################################
+# Sessions
+####################################
+
+class Results:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name, status, seconds):
+        with self.lock:
+            self.statuses[name][str(status)] += 1
+            if status in (200, 204):
+                self.latencies[name].append(seconds)
+
+    def report(self, duration):
+        report = {}
+        for name in sorted(self.statuses):
+            statuses = dict(self.statuses[name])
+            requests = sum(statuses.values())
+            errors = sum(count for status, count in statuses.items() if status not in ("200", "204"))
+            report[name] = dict(
+                percentiles(self.latencies[name]) if self.latencies[name] else {"n": 0},
+                requests = requests,
+                throughput_rps = requests / duration,
+                superseded = statuses.get("204", 0),
+                errors = errors,
+                error_rate = errors / requests if requests else 0.0,
+                statuses = statuses,
+            )
+        return report
+
+
+class Session:
+
+    def __init__(self, client, callbacks, layout, results, rng, hover_interval):
+        self.client = client
+        self.callbacks = callbacks
+        self.props = layout_props(layout)
+        self.results = results
+        self.rng = rng
+        self.hover_interval = hover_interval
+        # Requests in flight, like the browser does not wait for hover responses
+        self.pool = ThreadPoolExecutor(4)
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.pool.shutdown(wait = True)
+
+    # Send one callback and apply its outputs to the page
+    def send(self, callback, changed):
+        with self.lock:
+            body = callback.body(self.props, changed)
+        status, payload, seconds = self.client.request("/_dash-update-component", body)
+        self.results.record(callback.name, status, seconds)
+        if status != 200 or not payload:
+            return []
+        updated = []
+        with self.lock:
+            for component, props in payload.get("response", {}).items():
+                for prop, value in props.items():
+                    self.props[(component, prop)] = value
+                    updated.append((component, prop))
+        return updated
+
+    # Fire the callbacks listening to changed props, following chains
+    def fire(self, changed, depth = 0):
+        triggered = [callback for callback in self.callbacks
+                     if any(key in changed for key in callback.inputs)]
+        futures = [self.pool.submit(self.send, callback, [key for key in changed if key in callback.inputs])
+                   for callback in triggered]
+        if depth + 1 >= MAX_CHAIN:
+            return futures
+        chained = []
+        for future in futures:
+            updated = future.result()
+            if updated:
+                chained += self.fire(updated, depth + 1)
+        return futures + chained
+
+    def set(self, key, value):
+        with self.lock:
+            self.props[key] = value
+        return self.fire([key])
+
+    def load(self):
+        for path in ["/", "/_dash-layout", "/_dash-dependencies"]:
+            status, _, seconds = self.client.request(path)
+            self.results.record("GET " + path, status, seconds)
+        futures = [self.pool.submit(self.send, callback, []) for callback in self.callbacks if callback.initial]
+        wait(futures)
+
+    def options(self, component):
+        options = self.props.get((component, "options")) or []
+        return [option["value"] if isinstance(option, dict) else option for option in options]
+
+    def hover_codes(self):
+        figure = self.props.get(("worldmap", "figure")) or {}
+        locations = (figure.get("data") or [{}])[0].get("locations")
+        return locations if isinstance(locations, list) and locations else FALLBACK_CODES
+
+    def change_dropdown(self):
+        component = self.rng.choice(["Schengen country", "Country feature 1", "Country feature 2"])
+        values = self.options(component)
+        if values:
+            wait(self.set((component, "value"), self.rng.choice(values)))
+
+    def drag_slider(self):
+        low = self.props.get(("time_slider", "min"))
+        high = self.props.get(("time_slider", "max"))
+        if low is None or high is None:
+            return
+        start = self.rng.randint(low, high)
+        futures = []
+        for _ in range(self.rng.randint(2, 4)):
+            stop = self.rng.randint(start, high)
+            futures += self.set(("time_slider", "value"), [start, stop])
+        wait(futures)
+
+    def hover_burst(self):
+        codes = self.hover_codes()
+        futures = []
+        for _ in range(self.rng.randint(5, 15)):
+            hover = {"points": [{"location": self.rng.choice(codes)}]}
+            with self.lock:
+                self.props[("worldmap", "hoverData")] = hover
+            futures += [self.pool.submit(self.send, callback, [("worldmap", "hoverData")])
+                        for callback in self.callbacks if ("worldmap", "hoverData") in callback.inputs]
+            time.sleep(self.hover_interval)
+        wait(futures)
+
+    def act(self):
+        action = self.rng.choices([self.change_dropdown, self.drag_slider, self.hover_burst],
+                                  weights = [0.25, 0.15, 0.6])[0]
+        action()
+
+
+# One simulated user: sessions back to back until the deadline
+def run_user(url, callbacks, layout, results, seed, deadline, think, hover_interval, actions, timeout):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        session = Session(Client(url, timeout), callbacks, layout, results, rng, hover_interval)
+        try:
+            session.load()
+            for _ in range(actions):
+                if time.monotonic() >= deadline:
+                    break
+                session.act()
+                time.sleep(rng.expovariate(1 / think) if think > 0 else 0)
+        finally:
+            session.close()
+
+
+def load_test(url, users, duration, think, hover_interval, actions, timeout, seed):
+    client = Client(url, timeout)
+    _, dependencies, _ = client.request("/_dash-dependencies")
+    _, layout, _ = client.request("/_dash-layout")
+    if dependencies is None or layout is None:
+        raise SystemExit("No dashboard at {}".format(url))
+    # Clientside callbacks run in the browser
+    callbacks = [Callback(dependency) for dependency in dependencies if not dependency.get("clientside_function")]
+
+    results = Results()
+    start = time.monotonic()
+    deadline = start + duration
+    threads = [threading.Thread(target = run_user, daemon = True,
+                                args = (url, callbacks, layout, results, seed + user, deadline,
+                                        think, hover_interval, actions, timeout))
+               for user in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    callbacks_report = results.report(elapsed)
+    requests = sum(stats["requests"] for stats in callbacks_report.values())
+    errors = sum(stats["errors"] for stats in callbacks_report.values())
+    return {
+        "url": url,
+        "users": users,
+        "duration_s": elapsed,
+        "requests": requests,
+        "throughput_rps": requests / elapsed,
+        "errors": errors,
+        "error_rate": errors / requests if requests else 0.0,
+        "callbacks": callbacks_report,
+    }
+
+
+####################################
+# Local gunicorn
+####################################
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("gunicorn exited with status {}".format(process.returncode))
+        try:
+            with urllib.request.urlopen(url + "/_dash-dependencies", timeout = 5):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise SystemExit("gunicorn did not answer within {} s".format(timeout))
+
+
+# Run gunicorn on the repository data (or synthetic data of a scale) for
+# the duration of a with block, which gets its URL. Extra environment (VISA_*)
+# is passed on to the workers.
+class LocalGunicorn:
+
+    def __init__(self, workers, threads, scale = None):
+        self.workers = workers
+        self.threads = threads
+        self.scale = scale
+        self.workdir = None
+        self.process = None
+
+    def __enter__(self):
+        cwd = REPO_DIR
+        env = dict(os.environ, WEB_CONCURRENCY = str(self.workers), GUNICORN_THREADS = str(self.threads),
+                   PYTHONPATH = os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+        if self.scale is not None:
+            from synthetic import write_dataset
+
+            self.workdir = tempfile.TemporaryDirectory()
+            cwd = self.workdir.name
+            write_dataset(os.path.join(cwd, "data", "df_iso_schengen_origin.csv"), self.scale)
+            subprocess.run([sys.executable, os.path.join(REPO_DIR, "data_store.py")], cwd = cwd, env = env,
+                           check = True, stdout = subprocess.DEVNULL)
+
+        port = free_port()
+        env["PORT"] = str(port)
+        self.process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+                                         "--access-logfile", "/dev/null", "wsgi:server"],
+                                        cwd = cwd, env = env, stdout = subprocess.DEVNULL)
+        url = "http://127.0.0.1:{}".format(port)
+        try:
+            wait_until_up(url, self.process)
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return url
+
+    def __exit__(self, *exc):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout = 30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.workdir is not None:
+            self.workdir.cleanup()
+
+
+def print_report(report):
+    print("{} users, {:.0f} s: {} requests, {:.1f} req/s, {:.2%} errors".format(
+        report["users"], report["duration_s"], report["requests"], report["throughput_rps"], report["error_rate"]))
+    for name, stats in report["callbacks"].items():
+        latency = ("p50 {p50_ms:8.1f}  p95 {p95_ms:8.1f}  p99 {p99_ms:8.1f} ms".format(**stats)
+                   if stats["n"] else "{:>41}".format("no responses"))
+        print("  {:<30} {:>7} req {:>7.1f} req/s  {}  {:>5} superseded  {:>6.2%} errors".format(
+            name, stats["requests"], stats["throughput_rps"], latency, stats["superseded"], stats["error_rate"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Load test the dashboard with simulated browser sessions")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default = "http://127.0.0.1:8050", help = "running dashboard")
+    target.add_argument("--gunicorn", action = "store_true", help = "start a local gunicorn for the test")
+    parser.add_argument("--workers", type = int, default = 2, help = "gunicorn workers (--gunicorn)")
+    parser.add_argument("--threads", type = int, default = 4, help = "threads per gunicorn worker (--gunicorn)")
+    parser.add_argument("--scale", type = int, help = "serve synthetic data of this size (--gunicorn)")
+    parser.add_argument("--users", type = int, default = 10, help = "concurrent simulated users")
+    parser.add_argument("--duration", type = float, default = 30, help = "seconds to run")
+    parser.add_argument("--think", type = float, default = 1.0, help = "mean seconds between actions of a user")
+    parser.add_argument("--hover-interval", type = float, default = 0.03, help = "seconds between hover events of a burst")
+    parser.add_argument("--actions", type = int, default = 20, help = "actions per session before reloading the page")
+    parser.add_argument("--timeout", type = float, default = 30, help = "request timeout in seconds")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed of the sessions")
+    parser.add_argument("--output", help = "write the results to this JSON file")
+    args = parser.parse_args()
+
+    def run(url):
+        return load_test(url, args.users, args.duration, args.think, args.hover_interval, args.actions,
+                         args.timeout, args.seed)
+
+    if args.gunicorn:
+        with LocalGunicorn(args.workers, args.threads, args.scale) as url:
+            report = run(url)
+        report.update(workers = args.workers, threads = args.threads, scale = args.scale)
+    else:
+        report = run(args.url)
+    report.update(commit = git_commit(), created = time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#############################
+# Synthetic visa dataset
+#############################
+# Generates a dataset with the columns of data/df_iso_schengen_origin.csv
+# so benchmarks run offline and at any size. Scale 1 has the size of the
+# original (26 Schengen states x all origin countries x 6 years); larger
+# scales add earlier years, so scale k has k times the rows.
+#
+#   $ python benchmarks/synthetic.py --scale 10 --output data/df_iso_schengen_origin.csv
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from country_codes import country_table
+
+
+# Schengen member states (alpha-3)
+SCHENGEN_CODES = ["AUT", "BEL", "CHE", "CZE", "DEU", "DNK", "ESP", "EST", "FIN", "FRA", "GRC", "HUN", "ISL",
+                  "ITA", "LIE", "LTU", "LUX", "LVA", "MLT", "NLD", "NOR", "POL", "PRT", "SVK", "SVN", "SWE"]
+
+# Years of the original dataset
+LAST_YEAR = 2019
+YEARS_PER_SCALE = 6
+
+
+def make_dataset(scale = 1, seed = 0):
+    rng = np.random.default_rng(seed)
+    table = country_table()
+    origins = table[~table["alpha3"].isin(SCHENGEN_CODES) & table["name"].notna()]
+    years = np.arange(LAST_YEAR - YEARS_PER_SCALE * scale + 1, LAST_YEAR + 1)
+
+    # Every (Schengen state, origin, year) combination
+    n_schengen, n_origins, n_years = len(SCHENGEN_CODES), len(origins), len(years)
+    schengen = np.repeat(np.arange(n_schengen), n_origins * n_years)
+    origin = np.tile(np.repeat(np.arange(n_origins), n_years), n_schengen)
+    year = np.tile(years, n_schengen * n_origins)
+    n_rows = len(year)
+
+    # Origin attributes are shared by all Schengen states, visa numbers are not
+    population = rng.lognormal(15, 2, n_origins)[origin].round()
+    gdp = rng.lognormal(8.5, 1.2, n_origins)[origin].round(2)
+    life_expectancy = rng.normal(72, 7, n_origins)[origin].round(1)
+    applications = rng.lognormal(6, 2, n_rows).round()
+    denied = (applications * rng.beta(2, 10, n_rows)).round()
+
+    df = pd.DataFrame({
+        "SCH_CODE": np.asarray(SCHENGEN_CODES)[schengen],
+        "COUNTRY": origins["name"].to_numpy()[origin],
+        "COUNTRY_CODE": origins["alpha3"].to_numpy()[origin],
+        "YEAR": year,
+        "NUMBER_OF_VISA_APPLICATIONS": applications,
+        "VISAS_ISSUED": applications - denied,
+        "VISAS_DENIED": denied,
+        "TOTAL_POPULATION": population,
+        "GDP_PER_CAPITA": gdp,
+        "LIFE_EXPECTANCY": life_expectancy,
+    })
+    # Some gaps like in the original data
+    df.loc[rng.random(n_rows) < 0.02, "GDP_PER_CAPITA"] = np.nan
+    return df
+
+
+def write_dataset(path, scale = 1, seed = 0):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    df = make_dataset(scale, seed)
+    df.to_csv(path, index = False)
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Write a synthetic visa dataset")
+    parser.add_argument("--scale", type = int, default = 1, help = "size as a multiple of the original dataset")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--output", default = "data/df_iso_schengen_origin.csv")
+    args = parser.parse_args()
+
+    df = write_dataset(args.output, args.scale, args.seed)
+    print("Wrote {} rows to {}".format(len(df), args.output))
@@ -0,0 +1,232 @@
+#############################
+# Shared filter cache
+#############################
+# Hovering a country of origin selects its rows from the rows of the
+# Schengen country and year range, which scans the whole selection. The
+# first callback computes the row positions and the others read them from
+# a bounded LRU cache keyed on (source, schengen_country, year_range,
+# origin_country). The selection itself comes from the index (a slice of
+# the memory-mapped frame), so only the positions are cached.
+#
+# The "memory" backend keeps one cache per worker process. The "disk"
+# backend writes the positions as .npz files (no pickles) into a directory
+# only the dashboard user can access (in /dev/shm by default) that all
+# gunicorn workers on the box share.
+
+import hashlib
+import json
+import os
+import stat
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Marker for cache misses (None is a valid cached value)
+MISSING = object()
+
+
+class MemoryBackend:
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return MISSING
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last = False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def keys(self):
+        with self.lock:
+            return list(self.items)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+
+# Directory only this user can read and write, created if missing; refuses
+# anything else (another owner, a symlink, access for group or others), so
+# no other local user can plant or read cache files
+def private_directory(path):
+    os.makedirs(path, mode = 0o700, exist_ok = True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError("Cache directory {} is not a directory owned by this user".format(path))
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        raise PermissionError("Cache directory {} has mode {:o}, not accessible to this user only (chmod 700)"
+                              .format(path, stat.S_IMODE(info.st_mode)))
+    return path
+
+
+# Cache keys (tuples of strings, numbers, None and tuples) as JSON and back
+def key_to_json(key):
+    return json.dumps(key)
+
+def key_from_json(text):
+    def as_tuple(value):
+        return tuple(as_tuple(item) for item in value) if isinstance(value, list) else value
+    return as_tuple(json.loads(text))
+
+
+class DiskBackend:
+
+    # Values are numpy arrays of numbers, stored with their key as .npz files
+    # and read back without pickle
+    def __init__(self, maxsize, directory):
+        self.maxsize = maxsize
+        self.directory = private_directory(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".npz")
+
+    def read(self, path):
+        with np.load(path, allow_pickle = False) as stored:
+            return key_from_json(str(stored["key"])), stored["value"]
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            stored_key, value = self.read(path)
+        except (OSError, ValueError, KeyError):
+            return MISSING
+        if stored_key != key:
+            return MISSING
+        # Touch the file so eviction drops the least recently used entries
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        value = np.asarray(value)
+        if value.dtype.kind not in "biuf":
+            raise TypeError("The disk cache stores numeric arrays, not {}".format(value.dtype))
+        path = self.path(key)
+        # Write and rename so other workers never read a partial file
+        tmp_path = "{}.{}.{}.npz".format(path[:-len(".npz")], os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, key = np.array(key_to_json(key)), value = value)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            # 40 hex digits: skips the temporary files of writes in progress
+            if not name.endswith(".npz") or len(name) != 44:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.stat(path).st_mtime_ns, path))
+            except OSError:
+                pass
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        if len(entries) <= self.maxsize:
+            return
+        for _, path in sorted(entries)[:len(entries) - self.maxsize]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def keys(self):
+        keys = []
+        for _, path in self.entries():
+            try:
+                keys.append(self.read(path)[0])
+            except (OSError, ValueError, KeyError):
+                pass
+        return keys
+
+    def clear(self):
+        for _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self.entries())
+
+
+def make_backend(name, maxsize, directory = None):
+    if name == "memory":
+        return MemoryBackend(maxsize)
+    if name == "disk":
+        return DiskBackend(maxsize, directory)
+    raise ValueError("Unknown cache backend: {!r} (use 'memory' or 'disk')".format(name))
+
+
+class FilterCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        value = self.backend.get(key)
+        if value is not MISSING:
+            with self.lock:
+                self.hits += 1
+            return value
+
+        with self.lock:
+            self.misses += 1
+        value = compute()
+        self.backend.set(key, value)
+        return value
+
+    def clear(self):
+        self.backend.clear()
+
+    # Move every entry to rename(key), dropping the entries it maps to None
+    def rekey(self, rename):
+        for key in self.backend.keys():
+            new_key = rename(key)
+            if new_key == key:
+                continue
+            value = self.backend.get(key)
+            self.backend.delete(key)
+            if new_key is not None and value is not MISSING:
+                self.backend.set(new_key, value)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.backend),
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
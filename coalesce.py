@@ -0,0 +1,171 @@
+#############################
+# Hover request coalescing
+#############################
+# Moving the mouse over the world map fires the hover-driven callbacks for
+# every country the pointer crosses. The coalescer protects the workers:
+#
+# - at most `max_concurrent` hover computations run at once per worker,
+#   the others queue
+# - a queued request is dropped as soon as a newer request of the same
+#   callback arrives from the same browser tab (the tab only shows the
+#   newest one anyway)
+# - identical computations in flight (same callback and inputs) are run
+#   once and shared by every request waiting for them
+#
+# Tabs are told apart by a random id in a memory store of the page, which
+# the callbacks registered with tab_callback() send along. Requests without
+# it fall back to the session cookie, then to the client address.
+
+import itertools
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+
+import flask
+from dash import State, callback_context
+from dash.exceptions import PreventUpdate
+
+
+# Cookie identifying a browser session
+SESSION_COOKIE = "visa_session"
+
+# Sessions remembered for superseding requests
+MAX_SESSIONS = 10000
+
+
+# Memory store holding the tab id (one per page load)
+TAB_STORE = "tab_id"
+
+
+def new_tab_id():
+    return uuid.uuid4().hex
+
+
+# Tab id among the states of a callback request, None if it has none
+def tab_id():
+    body = flask.request.get_json(silent = True)
+    states = body.get("state") if isinstance(body, dict) else None
+    for state in states or []:
+        if isinstance(state, dict) and state.get("id") == TAB_STORE:
+            return state.get("value")
+    return None
+
+
+def session_id():
+    return tab_id() or flask.request.cookies.get(SESSION_COOKIE) or flask.request.remote_addr
+
+
+# Register a callback of an app that also sends the tab id, as a last State
+# the callback function does not see (session_id() reads it from the request).
+# The function stays callable with its own arguments.
+def tab_callback(app, *args, **kwargs):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*values):
+            return function(*values[:-1])
+        app.callback(*args, State(TAB_STORE, "data"), **kwargs)(wrapper)
+        return function
+    return decorator
+
+
+# Hand out a session cookie with the first response of a browser
+def install_session_cookie(server):
+    @server.after_request
+    def set_session_cookie(response):
+        if SESSION_COOKIE not in flask.request.cookies:
+            response.set_cookie(SESSION_COOKIE, uuid.uuid4().hex, httponly = True, samesite = "Lax")
+        return response
+
+
+class HoverCoalescer:
+
+    def __init__(self, max_concurrent = 2):
+        self.max_concurrent = max_concurrent
+        self.condition = threading.Condition()
+        self.generations = OrderedDict() # (session, callback) -> newest request
+        self.flights = {}     # key -> Future of the computation in flight
+        self.waiters = {}     # key -> requests sharing that computation
+        self.counter = itertools.count()
+        self.running = 0
+        self.queued = 0
+        self.dropped = 0
+        self.deduplicated = 0
+        self.executed = 0
+
+    def run(self, session, name, key, compute):
+        with self.condition:
+            generation = next(self.counter)
+            self.generations[(session, name)] = generation
+            self.generations.move_to_end((session, name))
+            if len(self.generations) > MAX_SESSIONS:
+                self.generations.popitem(last = False)
+            # Wake queued requests so superseded ones can drop out
+            self.condition.notify_all()
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if not leader:
+                self.waiters[key] += 1
+                self.deduplicated += 1
+            else:
+                flight = self.flights[key] = Future()
+                self.waiters[key] = 0
+
+                self.queued += 1
+                try:
+                    while self.running >= self.max_concurrent:
+                        # Nobody else waits for this result, so drop it if it is stale
+                        if self.generations.get((session, name)) != generation and self.waiters[key] == 0:
+                            del self.flights[key], self.waiters[key]
+                            self.dropped += 1
+                            raise PreventUpdate
+                        self.condition.wait()
+                finally:
+                    self.queued -= 1
+                self.running += 1
+
+        if not leader:
+            return flight.result()
+
+        try:
+            result = compute()
+        except BaseException as error:
+            flight.set_exception(error)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.executed += 1
+                del self.flights[key], self.waiters[key]
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queue_depth": self.queued,
+                "running": self.running,
+                "dropped": self.dropped,
+                "deduplicated": self.deduplicated,
+                "executed": self.executed,
+            }
+
+
+# Run a callback through the coalescer when called from a request
+def coalesced(coalescer):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args):
+            if coalescer is None or not flask.has_request_context():
+                return function(*args)
+            # Whether the figure may be patched depends on the triggering inputs
+            triggered = sorted(callback_context.triggered_prop_ids)
+            key = (function.__name__, json.dumps([args, triggered], sort_keys = True, default = str))
+            return coalescer.run(session_id(), function.__name__, key, lambda: function(*args))
+        return wrapper
+    return decorator
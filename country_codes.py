@@ -0,0 +1,60 @@
+#############################
+# Country code lookup table
+#############################
+# ISO 3166 alpha-2 / alpha-3 codes and names of all countries, built once
+# from the pycountry_convert mappings. The row position in the table is
+# the integer id of a country. Country code columns are stored as
+# categoricals with the table's alpha-3 codes as categories, so the codes
+# of a column are the country ids and finding the rows of one country is
+# an integer comparison instead of a regex scan.
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+@lru_cache(maxsize = None)
+def country_table():
+    from pycountry_convert.country_mappings import (map_country_alpha2_to_country_name,
+                                                    map_country_alpha3_to_country_alpha2)
+
+    alpha2_by_alpha3 = map_country_alpha3_to_country_alpha2()
+    name_by_alpha2 = map_country_alpha2_to_country_name()
+
+    alpha3 = sorted(alpha2_by_alpha3)
+    alpha2 = [alpha2_by_alpha3[code] for code in alpha3]
+    return pd.DataFrame({
+        "alpha2": alpha2,
+        "alpha3": alpha3,
+        "name": [name_by_alpha2.get(code) for code in alpha2],
+    })
+
+
+# Full country names for a Series of alpha-3 codes (NaN for unknown codes)
+def alpha3_to_name(codes):
+    table = country_table()
+    return codes.map(pd.Series(table["name"].to_numpy(), index = table["alpha3"]))
+
+
+# Categorical of alpha-3 codes whose codes are the country ids. Codes
+# missing from the table get ids after the table's countries.
+def encode_alpha3(codes):
+    categories = country_table()["alpha3"].to_list()
+    known = set(categories)
+    extra = sorted(code for code in pd.unique(codes.dropna()) if code not in known)
+    return pd.Categorical(codes, categories = categories + extra)
+
+
+# Id of a country in a categorical code column (-1 if it does not occur)
+def country_id(codes, alpha3):
+    return codes.cat.categories.get_indexer([alpha3])[0]
+
+
+# Boolean mask of the rows of one country, by integer equality on the category codes
+def country_mask(codes, alpha3):
+    position = country_id(codes, alpha3)
+    if position < 0:
+        return np.zeros(len(codes), dtype = bool)
+    return codes.cat.codes.to_numpy() == position
+
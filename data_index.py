@@ -0,0 +1,100 @@
+#############################
+# (Schengen country x year) index
+#############################
+# The frame is kept sorted by (Schengen country, Year). Every Schengen
+# country is then one contiguous block of rows, ordered by year, and a
+# (country, year range) query is two binary searches inside that block
+# returning a slice of the frame without copying it.
+#
+# "All countries" over every year is the whole frame, also without a copy.
+# Other year ranges of "All countries" gather their rows in year order,
+# which copies them; the last few of these are kept, so the callbacks of
+# one slider position and later hovers share one copy.
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# Dropdown value selecting every Schengen country
+ALL_COUNTRIES = "All countries"
+
+# Sort order of the indexed frame
+INDEX_COLUMNS = ["Schengen country", "Year"]
+
+# "All countries" year ranges kept per index
+YEAR_RANGE_CACHE_SIZE = 4
+
+
+# Sort a frame into index order (the store is written in this order, so
+# loading it needs no sort and keeps the memory map shared)
+def sort_frame(df):
+    return df.sort_values(INDEX_COLUMNS, kind = "mergesort").reset_index(drop = True)
+
+
+def is_sorted(codes, years):
+    code_step = np.diff(codes)
+    return bool(np.all((code_step > 0) | ((code_step == 0) & (np.diff(years) >= 0))))
+
+
+class CountryYearIndex:
+
+    def __init__(self, df):
+        codes, countries = pd.factorize(df["Schengen country"], sort = True)
+        years = df["Year"].to_numpy()
+        if not is_sorted(codes, years):
+            df = sort_frame(df)
+            codes, countries = pd.factorize(df["Schengen country"], sort = True)
+            years = df["Year"].to_numpy()
+
+        self.frame = df
+        self.years = years
+        self.countries = list(countries)
+
+        # Offset table: first and last row + 1 of every Schengen country
+        starts = np.searchsorted(codes, np.arange(len(countries)), side = "left")
+        stops = np.searchsorted(codes, np.arange(len(countries)), side = "right")
+        self.offsets = {name: (start, stop) for name, start, stop in zip(countries, starts, stops)}
+
+        # Row order by year for the "All countries" path
+        self.year_order = np.argsort(years, kind = "mergesort")
+        self.sorted_years = years[self.year_order]
+        # (first, last + 1) position in year order -> rows of these years
+        self.year_ranges = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Row range [start, stop) of a Schengen country within a year range
+    def bounds(self, schengen_country, year_range):
+        start, stop = self.offsets.get(schengen_country, (0, 0))
+        block = self.years[start:stop]
+        return (start + np.searchsorted(block, year_range[0], side = "left"),
+                start + np.searchsorted(block, year_range[1], side = "right"))
+
+    # Rows of one Schengen country (exact match) or of all Schengen countries within a year range
+    def query(self, schengen_country, year_range):
+        if schengen_country == ALL_COUNTRIES:
+            lo = np.searchsorted(self.sorted_years, year_range[0], side = "left")
+            hi = np.searchsorted(self.sorted_years, year_range[1], side = "right")
+            return self.all_countries(int(lo), int(hi))
+
+        lo, hi = self.bounds(schengen_country, year_range)
+        return self.frame.iloc[lo:hi]
+
+    # Rows of all Schengen countries at positions [lo, hi) of the year order
+    def all_countries(self, lo, hi):
+        if lo == 0 and hi == len(self.frame):
+            return self.frame
+        key = (lo, hi)
+        with self.lock:
+            rows = self.year_ranges.get(key)
+            if rows is not None:
+                self.year_ranges.move_to_end(key)
+                return rows
+        rows = self.frame.take(self.year_order[lo:hi])
+        with self.lock:
+            rows = self.year_ranges.setdefault(key, rows)
+            while len(self.year_ranges) > YEAR_RANGE_CACHE_SIZE:
+                self.year_ranges.popitem(last = False)
+        return rows
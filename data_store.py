@@ -0,0 +1,311 @@
+#############################
+# Columnar data store
+#############################
+# The dashboard data is prepared once by a build step
+#
+#   $ python data_store.py
+#
+# which parses the source CSV, resolves the Schengen country names,
+# normalizes the column names and writes the result as a directory of
+# .npy files. Numeric features live in one 2D block per dtype and country
+# columns are stored as integer codes plus a categories array. Workers
+# memory-map the blocks, so loading takes milliseconds and all gunicorn
+# workers share the same pages through the OS page cache.
+#
+# Columns get compact dtypes (see apply_schema): country columns are
+# categoricals, years int16, and features float32 unless a value would
+# change in single precision.
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_index import sort_frame
+from country_codes import alpha3_to_name, encode_alpha3
+
+
+# Default locations of the source CSV and of the prebuilt store
+DATA_PATH = "data/df_iso_schengen_origin.csv"
+STORE_PATH = "data/df_iso_schengen_origin.store"
+
+# Bump when the on-disk layout changes so stale stores are rebuilt
+STORE_VERSION = 4
+
+# Columns holding integer keys instead of features, with their dtype
+INTEGER_COLUMNS = {"Year": np.int16}
+
+# String columns kept as categoricals (any other string column is too)
+CATEGORICAL_COLUMNS = ["Sch code", "Country", "Country code", "Schengen country"]
+
+
+####################################
+# Parse the source CSV
+####################################
+
+def read_source(path = DATA_PATH):
+    df = pd.read_csv(path)
+
+    # Add columns for full Schengen country names
+    df["Schengen_country"] = alpha3_to_name(df["SCH_CODE"])
+
+    # Capatilize all column names to prevent string matching conflicts
+    df.columns = [x.capitalize() for x in df.columns]
+    # Remove underscores from column names
+    df.columns = [name.replace("_", ' ') for name in df.columns]
+
+    # drop all nan from all country columns
+    df.dropna(subset = ['Schengen country'], inplace = True)
+    df.dropna(subset = ['Country'], inplace = True)
+
+    # Country codes as categorical of country ids
+    df['Country code'] = encode_alpha3(df['Country code'])
+
+    return apply_schema(df.reset_index(drop = True))
+
+
+####################################
+# Compact column dtypes
+####################################
+
+# float32 if every value (NaN included) survives the round trip, else float64
+def feature_dtype(values):
+    values = np.asarray(values, dtype = np.float64)
+    single = values.astype(np.float32).astype(np.float64)
+    return np.float32 if np.array_equal(single, values, equal_nan = True) else np.float64
+
+
+def is_categorical(column):
+    return isinstance(column.dtype, pd.CategoricalDtype)
+
+
+def apply_schema(df):
+    for name in df.columns:
+        column = df[name]
+        if name in CATEGORICAL_COLUMNS or column.dtype == object:
+            if not is_categorical(column):
+                df[name] = column.astype("category")
+        elif name in INTEGER_COLUMNS:
+            df[name] = column.astype(INTEGER_COLUMNS[name])
+        else:
+            df[name] = column.astype(feature_dtype(column))
+    return df
+
+
+# Whether an array is a view of a memory-mapped store file
+def is_mapped(values):
+    while values is not None:
+        if isinstance(values, np.memmap):
+            return True
+        values = getattr(values, "base", None)
+    return False
+
+
+# Memory of every column: bytes in its current dtype, bytes with the dtypes
+# pandas.read_csv infers (float64/int64 and object strings), and whether
+# the bytes are shared by all workers through the memory map
+def memory_report(df):
+    report = {}
+    for name in df.columns:
+        column = df[name]
+        if is_categorical(column):
+            codes = column.cat.codes.to_numpy()
+            sizes = np.array([sys.getsizeof(value) for value in column.cat.categories] + [0])
+            # Object column: one pointer plus the string object per row
+            baseline = codes.nbytes // codes.itemsize * 8 + int(sizes.take(codes).sum())
+            values = codes
+        else:
+            values = column.to_numpy()
+            baseline = len(values) * 8
+        report[name] = {
+            "dtype": str(column.dtype),
+            "bytes": int(column.memory_usage(index = False, deep = True)),
+            "baseline_bytes": int(baseline),
+            "mapped": is_mapped(values),
+        }
+    return report
+
+
+####################################
+# Build the store
+####################################
+
+# [Schengen country, year] cells whose rows differ between two frames, or
+# None if the columns differ. Every cell is compared by its number of rows
+# and the sum of its row hashes, so row order does not matter.
+def changed_cells(old, new):
+    if list(old.columns) != list(new.columns) or list(map(str, old.dtypes)) != list(map(str, new.dtypes)):
+        return None
+
+    def cell_hashes(df):
+        cells = pd.DataFrame({
+            "Schengen country": np.asarray(df["Schengen country"], dtype = object),
+            "Year": df["Year"].to_numpy(dtype = np.int64),
+            "hash": pd.util.hash_pandas_object(df, index = False).to_numpy(),
+        })
+        return cells.groupby(["Schengen country", "Year"])["hash"].agg(["sum", "size"])
+
+    old_cells, new_cells = cell_hashes(old), cell_hashes(new)
+    cells = old_cells.index.union(new_cells.index)
+    old_cells = old_cells.reindex(cells, fill_value = 0)
+    new_cells = new_cells.reindex(cells, fill_value = 0)
+    differ = ((old_cells["sum"].to_numpy() != new_cells["sum"].to_numpy())
+              | (old_cells["size"].to_numpy() != new_cells["size"].to_numpy()))
+    return [[country, int(year)] for country, year in cells[differ]]
+
+
+# Size, mtime and content hash of the source file to detect stale stores
+def source_signature(path):
+    stat = os.stat(path)
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1.hexdigest()}
+
+
+def build_store(path = DATA_PATH, store_path = STORE_PATH):
+    # Rows are written in index order so loading needs no sort
+    df = sort_frame(read_source(path))
+
+    # Cells that differ from the store this one replaces, so running
+    # workers can keep caches of the other cells
+    changes = None
+    previous = read_meta(store_path)
+    if previous is not None and previous.get("version") == STORE_VERSION:
+        changes = {"base": previous["source"]["sha1"], "cells": changed_cells(load_store(store_path), df)}
+
+    return write_store(df, store_path, source_signature(path), changes)
+
+
+# Write a frame in index order (see sort_frame) as a store of the source
+# with this signature
+def write_store(df, store_path, source, changes = None):
+    categorical = [name for name in df.columns if is_categorical(df[name])]
+    integer = [name for name in df.columns if name in INTEGER_COLUMNS]
+    features = [name for name in df.columns if name not in categorical + integer]
+    # Features grouped by dtype, one block each
+    blocks = {}
+    for name in features:
+        blocks.setdefault(df[name].dtype.name, []).append(name)
+
+    # Write into a temporary directory first and swap it in at the end,
+    # so running workers never see a half written store
+    tmp_path = "{}.tmp-{}".format(store_path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    os.makedirs(tmp_path)
+
+    # Features of one dtype in one block, one row per column, so every
+    # column is a contiguous view of the memory map
+    for dtype, names in blocks.items():
+        np.save(os.path.join(tmp_path, "features.{}.npy".format(dtype)),
+                np.ascontiguousarray(df[names].to_numpy(dtype = dtype).T))
+
+    for i, name in enumerate(integer):
+        np.save(os.path.join(tmp_path, "int{}.npy".format(i)), df[name].to_numpy())
+
+    # Codes in the smallest integer type pandas uses for the categories
+    for i, name in enumerate(categorical):
+        np.save(os.path.join(tmp_path, "cat{}.codes.npy".format(i)), df[name].cat.codes.to_numpy())
+        np.save(os.path.join(tmp_path, "cat{}.categories.npy".format(i)),
+                np.asarray(df[name].cat.categories, dtype = str))
+
+    meta = {
+        "version": STORE_VERSION,
+        "rows": len(df),
+        "columns": df.columns.to_list(),
+        "features": features,
+        "blocks": blocks,
+        "integer": integer,
+        "categorical": categorical,
+        "source": source,
+        "changes": changes,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent = 2)
+
+    old_path = store_path + ".old"
+    shutil.rmtree(old_path, ignore_errors = True)
+    if os.path.exists(store_path):
+        os.rename(store_path, old_path)
+    os.rename(tmp_path, store_path)
+    shutil.rmtree(old_path, ignore_errors = True)
+
+    return meta
+
+
+####################################
+# Load the store
+####################################
+
+def read_meta(store_path = STORE_PATH):
+    try:
+        with open(os.path.join(store_path, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# The store is usable if it has the current layout and was built from the
+# current source file. Without a source file (slim deploys) the store wins.
+def store_is_fresh(path = DATA_PATH, store_path = STORE_PATH):
+    meta = read_meta(store_path)
+    if meta is None or meta.get("version") != STORE_VERSION:
+        return False
+    if not os.path.exists(path):
+        return True
+
+    source = meta["source"]
+    stat = os.stat(path)
+    if stat.st_size != source["size"]:
+        return False
+    if stat.st_mtime_ns == source["mtime_ns"]:
+        return True
+    # A checkout or copy touches the mtime, so compare contents before giving up
+    return source_signature(path)["sha1"] == source["sha1"]
+
+
+def load_store(store_path = STORE_PATH):
+    meta = read_meta(store_path)
+
+    columns = {}
+    for dtype, names in meta["blocks"].items():
+        block = np.load(os.path.join(store_path, "features.{}.npy".format(dtype)), mmap_mode = "r")
+        columns.update(zip(names, block))
+    for i, name in enumerate(meta["integer"]):
+        columns[name] = np.load(os.path.join(store_path, "int{}.npy".format(i)), mmap_mode = "r")
+    for i, name in enumerate(meta["categorical"]):
+        codes = np.load(os.path.join(store_path, "cat{}.codes.npy".format(i)), mmap_mode = "r")
+        categories = np.load(os.path.join(store_path, "cat{}.categories.npy".format(i))).astype(object)
+        columns[name] = pd.Categorical.from_codes(codes, categories)
+
+    # One block per column, so pandas neither consolidates nor copies the
+    # memory-mapped arrays
+    return pd.DataFrame({name: columns[name] for name in meta["columns"]}, copy = False)
+
+
+# Build the store from the command line
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Build the columnar data store for the dashboard")
+    parser.add_argument("--source", default = DATA_PATH, help = "source CSV file")
+    parser.add_argument("--store", default = STORE_PATH, help = "output store directory")
+    parser.add_argument("--report", action = "store_true", help = "print the memory of every column of the store")
+    args = parser.parse_args()
+
+    if not args.report:
+        meta = build_store(args.source, args.store)
+        print("Wrote {} rows and {} columns to {}".format(meta["rows"], len(meta["columns"]), args.store))
+    else:
+        report = memory_report(load_store(args.store))
+        for name, column in report.items():
+            print("{:<30} {:<9} {:>12,} bytes ({:>12,} as read_csv){}".format(
+                name, column["dtype"], column["bytes"], column["baseline_bytes"], "  mapped" if column["mapped"] else ""))
+        print("{:<40} {:>12,} bytes ({:>12,} as read_csv)".format(
+            "total", sum(column["bytes"] for column in report.values()),
+            sum(column["baseline_bytes"] for column in report.values())))
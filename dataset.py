@@ -0,0 +1,197 @@
+#############################
+# Live dataset and refresh
+#############################
+# Everything derived from the data (sorted frame, index, cube, features,
+# year range) lives in one Dataset. A worker keeps the current Dataset in
+# a LiveDataset and every callback reads it once, so a refresh swaps all
+# of it with a single assignment and callbacks already running finish on
+# the snapshot they started with.
+#
+# A refresh rebuilds the store if the source CSV changed (one worker at a
+# time, under a file lock) and memory-maps the new store. build_store
+# records which (Schengen country, year) cells differ from the store it
+# replaces; listeners get these cells to keep the caches of all other
+# cells, and the cube copies its built features over.
+#
+# POST /admin/refresh refreshes the worker receiving it right away. With
+# VISA_REFRESH_INTERVAL=<seconds> every worker also checks the source and
+# the store at most once per interval while serving requests and refreshes
+# in the background, which picks up a store rebuilt by another worker or
+# by `python data_store.py`.
+
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import flask
+
+import settings
+from aggregates import FeatureCube
+from data_index import ALL_COUNTRIES, CountryYearIndex
+from data_store import (DATA_PATH, STORE_PATH, STORE_VERSION, build_store, load_store, read_meta,
+                        read_source, source_signature, store_is_fresh)
+from instrumentation import authorized
+from timeseries import TimeSeriesStore
+
+
+# Columns that are keys or labels, not selectable features
+KEY_COLUMNS = ['Year', 'Country code', 'Sch code', 'Schengen country', "Country"]
+
+
+class Dataset:
+
+    def __init__(self, frame, source = None, generation = 0, previous = None, changed = None, store = None):
+        # Index sorted by (Schengen country, Year); frame is the sorted frame
+        self.index = CountryYearIndex(frame)
+        self.frame = self.index.frame
+        # Dense (Schengen country, origin, year) arrays, built per feature on first use
+        self.cube = FeatureCube(self.index, previous.cube if previous is not None else None, changed)
+        # Line plot series per (Schengen country, origin) with rollups and derived series
+        self.timeseries = TimeSeriesStore(self.cube)
+
+        # Features that can be selected by the user
+        self.features = [name for name in self.frame.columns.unique() if name not in KEY_COLUMNS]
+
+        # Time range for slider and graphs
+        self.min_time = int(self.frame["Year"].min())
+        self.max_time = int(self.frame["Year"].max())
+
+        # SHA-1 of the source file, the same in every worker holding this data
+        self.source = source
+        # Number of refreshes of this worker
+        self.generation = generation
+        # Store directory the frame is memory-mapped from (None: parsed from the CSV)
+        self.store = store
+
+    def summary(self):
+        return {
+            "source": self.source,
+            "generation": self.generation,
+            "rows": len(self.frame),
+            "min_time": self.min_time,
+            "max_time": self.max_time,
+        }
+
+
+# Whether a (Schengen country, year range) query reads any of the changed
+# cells (None: everything changed)
+def affected(changed, schengen_country, year_range):
+    if changed is None:
+        return True
+    return any(schengen_country in (ALL_COUNTRIES, country) and year_range[0] <= year <= year_range[1]
+               for country, year in changed)
+
+
+# Exclusive lock of the store directory across processes
+@contextmanager
+def store_lock(store_path):
+    with open(store_path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def source_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+class LiveDataset:
+
+    def __init__(self, path = DATA_PATH, store_path = STORE_PATH, interval = settings.REFRESH_INTERVAL):
+        self.path = path
+        self.store_path = store_path
+        self.interval = interval
+        self.listeners = [] # called with (previous, dataset, changed cells) after a swap
+        self.lock = threading.Lock() # one refresh at a time
+        self.checked = time.monotonic()
+        self.seen = source_stat(path)
+        self.current, _ = self.load()
+
+    # Memory-map the store if it is fresh, parse the CSV otherwise
+    def load(self, previous = None):
+        changes, store = None, None
+        if store_is_fresh(self.path, self.store_path):
+            meta = read_meta(self.store_path)
+            if previous is not None and meta["source"]["sha1"] == previous.source:
+                return previous, set()
+            frame, source, changes = load_store(self.store_path), meta["source"]["sha1"], meta.get("changes")
+            store = self.store_path
+        else:
+            source = source_signature(self.path)["sha1"]
+            if previous is not None and source == previous.source:
+                return previous, set()
+            frame = read_source(self.path)
+
+        if previous is None:
+            return Dataset(frame, source, store = store), None
+
+        # Incremental only if the store was built on top of the data this worker holds
+        changed = None
+        if changes and changes["cells"] is not None and changes["base"] == previous.source:
+            changed = {(country, year) for country, year in changes["cells"]}
+        return Dataset(frame, source, previous.generation + 1, previous, changed, store), changed
+
+    # Rebuild the store if the source changed and swap in the new data.
+    # Returns the changed cells (None: all, empty: nothing changed).
+    def refresh(self):
+        with self.lock:
+            self.seen = source_stat(self.path)
+            if self.seen is not None and not store_is_fresh(self.path, self.store_path):
+                try:
+                    with store_lock(self.store_path):
+                        # Another worker may have built it while this one waited
+                        if not store_is_fresh(self.path, self.store_path):
+                            build_store(self.path, self.store_path)
+                except OSError:
+                    pass # read-only deploy: load() parses the CSV
+
+            previous = self.current
+            dataset, changed = self.load(previous)
+            if dataset is previous:
+                return changed
+            self.current = dataset
+            for listener in self.listeners:
+                listener(previous, dataset, changed)
+            return changed
+
+    # Whether the source file or the store changed since the last check
+    def stale(self):
+        meta = read_meta(self.store_path)
+        if (meta is not None and meta.get("version") == STORE_VERSION
+                and meta["source"]["sha1"] != self.current.source and store_is_fresh(self.path, self.store_path)):
+            return True
+        stat = source_stat(self.path)
+        if stat == self.seen:
+            return False
+        self.seen = stat
+        return True
+
+    # Check for new data at most once per interval, refreshing in the background
+    def watch(self):
+        now = time.monotonic()
+        if now - self.checked < self.interval:
+            return
+        self.checked = now
+        if not self.lock.locked() and self.stale():
+            threading.Thread(target = self.refresh, daemon = True).start()
+
+    def install(self, server):
+        if self.interval > 0:
+            server.before_request(self.watch)
+
+        @server.route("/admin/refresh", methods = ["POST"])
+        def refresh_endpoint():
+            if not authorized():
+                flask.abort(403)
+            changed = self.refresh()
+            return dict(self.current.summary(),
+                        changed_cells = "all" if changed is None else len(changed),
+                        worker = os.getpid())
@@ -0,0 +1,234 @@
+#############################
+# Execution backend
+#############################
+# The medians behind the world map and the bar chart scan every row of
+# the selection, which for "All countries" keeps a request thread busy
+# long enough to stall the other users of the worker. With
+# VISA_EXECUTOR=process these aggregations run in a small pool of
+# processes instead:
+#
+# - the pool processes memory-map the same store as the worker, so the
+#   data is shared through the page cache and only the arguments and the
+#   (small) results cross the process boundary
+# - every request waits at most VISA_EXECUTOR_TIMEOUT seconds for its
+#   result and answers 504 after that
+# - a request superseded by a newer one of the same callback and browser
+#   tab (session_id() of coalesce.py) stops waiting and its task is
+#   cancelled if it did not start
+# - at most VISA_EXECUTOR_MAX_PENDING tasks are queued or running; later
+#   requests wait for a slot until their deadline and answer 503 after that
+#
+# Data the pool cannot map (parsed from the CSV, or replaced by a refresh
+# the pool has not seen yet) is aggregated in the request thread, as is
+# everything with VISA_EXECUTOR=inline (the default, and what the
+# benchmarks and the prerender script measure).
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import flask
+from dash.exceptions import PreventUpdate
+
+from coalesce import MAX_SESSIONS, session_id
+from data_store import load_store, read_meta
+
+
+# Pool saturated until the deadline of a request
+class Overloaded(Exception):
+    pass
+
+
+# Result not ready before the deadline of a request
+class DeadlineExceeded(Exception):
+    pass
+
+
+# The store of a pool process holds other data than the request
+class StaleStore(Exception):
+    pass
+
+
+####################################
+# Pool processes
+####################################
+
+# Datasets of this pool process by store and source hash (only the newest source of a store is kept)
+process_datasets = {}
+
+def process_dataset(store, source):
+    dataset = process_datasets.get((store, source))
+    if dataset is None:
+        from dataset import Dataset
+
+        meta = read_meta(store)
+        if meta is None or meta["source"]["sha1"] != source:
+            raise StaleStore(store)
+        frame = load_store(store)
+        # The store may have been replaced while it was mapped
+        if read_meta(store)["source"]["sha1"] != source:
+            raise StaleStore(store)
+        for key in [key for key in process_datasets if key[0] == store]:
+            del process_datasets[key]
+        dataset = process_datasets[(store, source)] = Dataset(frame, source, store = store)
+    return dataset
+
+def run_task(task, store, source, args):
+    return task(process_dataset(store, source), *args)
+
+
+####################################
+# Executors
+####################################
+
+class InlineExecutor:
+
+    def run(self, name, dataset, task, *args, inline = None):
+        return inline() if inline is not None else task(dataset, *args)
+
+    def stats(self):
+        return {"backend": "inline"}
+
+
+class ProcessExecutor:
+
+    def __init__(self, workers = 2, max_pending = 8, timeout = 10):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pool = None
+        self.pool_pid = None # process the pool belongs to (gunicorn forks after preloading)
+        self.condition = threading.Condition()
+        self.generations = OrderedDict() # (session, callback) -> newest request
+        self.counter = 0
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.superseded = 0
+        self.inline = 0
+
+    # Pool of this process, started on first use
+    def get_pool(self):
+        if self.pool is None or self.pool_pid != os.getpid():
+            self.pool = ProcessPoolExecutor(self.workers, mp_context = multiprocessing.get_context("spawn"))
+            self.pool_pid = os.getpid()
+        return self.pool
+
+    def remaining(self, deadline):
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    def release(self, future):
+        with self.condition:
+            self.pending -= 1
+            self.completed += 1
+            self.condition.notify_all()
+
+    def run(self, name, dataset, task, *args, inline = None):
+        if inline is None:
+            inline = lambda: task(dataset, *args)
+        if dataset.store is None:
+            return self.run_inline(inline)
+
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        key = (session_id(), name) if flask.has_request_context() else None
+
+        with self.condition:
+            self.counter += 1
+            generation = self.counter
+            if key is not None:
+                self.generations[key] = generation
+                self.generations.move_to_end(key)
+                if len(self.generations) > MAX_SESSIONS:
+                    self.generations.popitem(last = False)
+                # Wake older requests of this tab so they stop waiting
+                self.condition.notify_all()
+
+            superseded = lambda: key is not None and self.generations.get(key) != generation
+
+            # Back-pressure: wait for a free slot
+            while self.pending >= self.max_pending:
+                if superseded():
+                    self.superseded += 1
+                    raise PreventUpdate
+                if self.remaining(deadline) == 0:
+                    self.rejected += 1
+                    raise Overloaded("{} tasks pending".format(self.pending))
+                self.condition.wait(self.remaining(deadline))
+
+            try:
+                future = self.get_pool().submit(run_task, task, dataset.store, dataset.source, args)
+            except BrokenProcessPool:
+                self.pool = None
+                return self.run_inline(inline)
+            self.pending += 1
+            self.submitted += 1
+
+        future.add_done_callback(self.release)
+
+        with self.condition:
+            while not future.done() and not superseded() and self.remaining(deadline) != 0:
+                self.condition.wait(self.remaining(deadline))
+            if not future.done():
+                if superseded():
+                    self.superseded += 1
+                    outcome = PreventUpdate()
+                else:
+                    self.timeouts += 1
+                    outcome = DeadlineExceeded("{} took longer than {} s".format(name, self.timeout))
+        if not future.done():
+            # Drops the task if no pool process picked it up yet
+            future.cancel()
+            raise outcome
+
+        try:
+            return future.result()
+        except (StaleStore, BrokenProcessPool) as error:
+            if isinstance(error, BrokenProcessPool):
+                with self.condition:
+                    self.pool = None
+            return self.run_inline(inline)
+
+    def run_inline(self, inline):
+        with self.condition:
+            self.inline += 1
+        return inline()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "backend": "process",
+                "workers": self.workers,
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "superseded": self.superseded,
+                "inline": self.inline,
+            }
+
+
+def make_executor(name, workers = 2, max_pending = 8, timeout = 10):
+    if name == "inline":
+        return InlineExecutor()
+    if name == "process":
+        return ProcessExecutor(workers, max_pending, timeout)
+    raise ValueError("Unknown executor: {!r} (use 'inline' or 'process')".format(name))
+
+
+# Answer saturated and late requests with 503 and 504 instead of 500
+def install(server):
+
+    @server.errorhandler(Overloaded)
+    def overloaded(error):
+        return flask.Response(str(error), status = 503, headers = {"Retry-After": "1"})
+
+    @server.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(error):
+        return flask.Response(str(error), status = 504)
@@ -0,0 +1,108 @@
+#############################
+# Figure templates and patch updates
+#############################
+# Building a Plotly figure validates the whole layout (geo settings, fonts,
+# hover labels, the plotly_dark template, ...) on every callback although
+# only the data arrays change. A figure template is built once per set of
+# static arguments (e.g. the selected feature) and stored as a plain dict.
+# Figures are then the cached dict with new data arrays, without any
+# validation.
+#
+# With VISA_FIGURE_PATCH=1 callbacks fired only by data inputs (country,
+# years, hover) return a dash Patch with the new arrays instead of the
+# whole figure, so neither the layout nor the template is serialized and
+# sent to the browser again.
+
+from functools import lru_cache
+
+import numpy as np
+from dash import callback_context
+
+try:
+    # Partial property updates need dash >= 2.9
+    from dash import Patch
+except ImportError:
+    Patch = None
+
+try:
+    from dash.exceptions import MissingCallbackContextException
+except ImportError:
+    MissingCallbackContextException = LookupError
+
+import figure_encoding
+import settings
+
+
+# Cache the plain dict of the figure returned by a builder, per argument tuple
+def figure_template(build):
+    @lru_cache(maxsize = settings.FIGURE_TEMPLATE_CACHE_SIZE)
+    def template(*args):
+        return build(*args).to_plotly_json()
+    return template
+
+
+# Copy of a dict with some (possibly nested, "a.b") keys replaced, sharing everything else
+def replace(base, updates):
+    result = dict(base)
+    for path, value in updates.items():
+        keys = path.split(".")
+        node = result
+        for key in keys[:-1]:
+            node[key] = dict(node.get(key, {}))
+            node = node[key]
+        node[keys[-1]] = value
+    return result
+
+
+# New figure from a template: one dict of data updates per trace plus layout updates
+def fill_template(template, trace_updates, layout_updates = {}):
+    trace_updates = figure_encoding.encode_updates(trace_updates, figure_encoding.current)
+    return {
+        "data": [replace(trace, updates) for trace, updates in zip(template["data"], trace_updates)],
+        "layout": replace(template["layout"], layout_updates),
+    }
+
+
+# Whether the figure on the client can be patched: patching is enabled and
+# the callback was fired only by inputs that change data, not figure settings
+def can_patch(data_inputs):
+    if not settings.FIGURE_PATCH or Patch is None:
+        return False
+    try:
+        triggered = set(callback_context.triggered_prop_ids)
+    except MissingCallbackContextException:
+        return False
+    return bool(triggered) and triggered <= set(data_inputs)
+
+
+def assign(node, path, value):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        node = node[key]
+    node[keys[-1]] = value
+
+
+# Patch that assigns the same updates fill_template() would apply
+def patch_figure(trace_updates, layout_updates = {}):
+    patch = Patch()
+    trace_updates = figure_encoding.encode_updates(trace_updates, figure_encoding.current)
+    for i, updates in enumerate(trace_updates):
+        for path, value in updates.items():
+            assign(patch["data"][i], path, value)
+    for path, value in layout_updates.items():
+        assign(patch["layout"], path, value)
+    return patch
+
+
+# Values rounded to some decimals and significant digits (0 keeps all), so
+# they serialize to fewer characters
+def round_values(values, decimals, significant = 0):
+    values = np.round(np.asarray(values, dtype = np.float64), decimals)
+    if significant > 0:
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            magnitude = np.floor(np.log10(np.abs(values)))
+        exponent = np.where(np.isfinite(magnitude), significant - 1 - magnitude, 0)
+        # Divide by exact powers of ten so the results print short
+        scale = 10.0 ** np.abs(exponent)
+        values = np.where(exponent >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+    return values
@@ -0,0 +1,123 @@
+#############################
+# Figure encoding
+#############################
+# Dash serializes every figure with plotly's JSON encoder, which formats
+# the data arrays number by number and converts pandas Series and object
+# arrays on the way. VISA_FIGURE_ENCODING selects how the data arrays of
+# the figures (fill_template and patch_figure in figure_cache.py) are
+# encoded:
+#
+# - "json"    lists, serialized by plotly's standard JSON encoder
+# - "orjson"  lists, serialized by orjson (plotly's orjson engine)
+# - "typed"   numeric arrays as base64 plotly.js typed arrays
+#             ({"dtype": "f4", "bdata": "..."}) of the smallest type that
+#             holds the values exactly, text arrays (country codes and
+#             names) as lists, serialized by orjson if installed
+#
+# Without orjson the encodings serialize with the standard encoder, and
+# "typed" falls back to lists when the plotly.js served by dash predates
+# typed arrays (2.28).
+#
+#   $ python benchmarks/bench_serialization.py   # compares the encodings
+
+import base64
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+ENCODINGS = ["json", "orjson", "typed"]
+
+# First plotly.js version decoding typed arrays
+TYPED_ARRAYS_PLOTLYJS = (2, 28)
+
+# Integer types of plotly.js typed arrays, smallest first
+INTEGER_TYPES = [("u1", 0, 2 ** 8 - 1), ("i1", -2 ** 7, 2 ** 7 - 1), ("u2", 0, 2 ** 16 - 1),
+                 ("i2", -2 ** 15, 2 ** 15 - 1), ("u4", 0, 2 ** 32 - 1), ("i4", -2 ** 31, 2 ** 31 - 1)]
+
+
+# Version of the plotly.js dash serves, None if unknown
+def plotlyjs_version():
+    import dash
+    # dash >= 3 serves the plotly.js of plotly.py, older versions bundle their own
+    if not hasattr(dash.Dash, "_setup_plotlyjs"):
+        return None
+    from plotly.offline import get_plotlyjs_version
+    try:
+        return tuple(int(part) for part in get_plotlyjs_version().split(".")[:2])
+    except ValueError:
+        return None
+
+
+# Encoding in effect for a requested one, and the plotly JSON engine serializing it
+def resolve(encoding):
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown figure encoding: {!r} (use {})".format(encoding, ", ".join(ENCODINGS)))
+    if encoding == "typed" and (plotlyjs_version() or (0,)) < TYPED_ARRAYS_PLOTLYJS:
+        encoding = "orjson"
+    if encoding == "json" or orjson is None:
+        return encoding, "json"
+    return encoding, "orjson"
+
+
+# Smallest little endian typed array type holding the values exactly, None if none does
+def compact_dtype(values):
+    if values.dtype.kind == "f":
+        finite = values[np.isfinite(values)]
+        # Fractions, NaN and infinities stay float, in single precision if that changes nothing
+        if finite.size < values.size or not np.array_equal(finite, np.trunc(finite)):
+            return "<f4" if np.array_equal(values.astype(np.float32), values, equal_nan = True) else "<f8"
+    low, high = (values.min(), values.max()) if values.size else (0, 0)
+    for dtype, type_min, type_max in INTEGER_TYPES:
+        if type_min <= low and high <= type_max:
+            return "<" + dtype
+    return "<f4" if np.array_equal(values.astype(np.float32), values) else None
+
+
+def typed_array(values, dtype):
+    values = np.ascontiguousarray(values.astype(dtype, copy = False))
+    spec = {"dtype": values.dtype.str[1:], "bdata": base64.b64encode(values).decode("ascii")}
+    if values.ndim > 1:
+        spec["shape"] = ", ".join(str(size) for size in values.shape)
+    return spec
+
+
+# One data array as the encoding sends it: numeric arrays as typed arrays
+# or numpy arrays (which orjson writes directly), text as lists
+def encode_array(values, encoding):
+    if isinstance(values, (pd.Series, pd.Index)):
+        values = values.to_numpy()
+    # Scalars (the bubble sizeref) as Python numbers, written alike by all engines
+    if isinstance(values, np.generic):
+        return values.item()
+    if not isinstance(values, np.ndarray):
+        return values
+    if values.dtype.kind not in "iuf":
+        return values.tolist()
+    dtype = compact_dtype(values) if encoding == "typed" and values.size else None
+    return typed_array(values, dtype) if dtype is not None else values
+
+
+# Data updates of the traces with their arrays encoded ("json" keeps them as they are)
+def encode_updates(trace_updates, encoding):
+    if encoding == "json":
+        return trace_updates
+    return [{key: encode_array(value, encoding) for key, value in updates.items()} for updates in trace_updates]
+
+
+# Encoding of the figures of this process, set by install()
+current = "json"
+
+# Encode the data arrays of all figures and serialize them with the matching engine
+def install(encoding):
+    import plotly.io as pio
+
+    global current
+    current, engine = resolve(encoding)
+    pio.json.config.default_engine = engine
+    return current
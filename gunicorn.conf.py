@@ -0,0 +1,23 @@
+#############################
+# gunicorn settings
+#############################
+# Read by `gunicorn wsgi:server` from the working directory. Worker and
+# thread counts come from the environment:
+#
+#   WEB_CONCURRENCY  worker processes (set by Heroku from the dyno size)
+#   GUNICORN_THREADS threads per worker (gthread worker class when > 1)
+#   PORT             port to listen on
+
+import multiprocessing
+import os
+
+bind = "0.0.0.0:{}".format(os.environ.get("PORT", "8050"))
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread" if threads > 1 else "sync"
+
+# Load the app (and the dataset) in the master before forking the workers
+preload_app = True
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+accesslog = "-"
@@ -0,0 +1,222 @@
+#############################
+# HTTP caching and compression
+#############################
+# Figures go over the wire as plain JSON and are computed again whenever
+# a client repeats a state it already had (toggling the bar chart order
+# back and forth, hovering the same countries again). This module adds:
+#
+# - a response cache of callback outputs per worker, keyed on the
+#   normalized request (outputs, input and state values, triggering
+#   inputs) and the version of the data, so a repeated state is answered
+#   with the stored bytes without running or serializing the callback
+# - ETags (SHA-1 of the body, per content encoding) on GET and HEAD
+#   responses, answering 304 to a matching If-None-Match (assets and
+#   component suites keep their own ETags). Conditional requests only
+#   apply to these methods (RFC 9110), so callback POSTs get neither.
+# - gzip, or brotli when the brotli package is installed and the client
+#   accepts it, for text responses from VISA_COMPRESS_MIN_BYTES on.
+#   Compressed bodies are kept by ETag, so static bundles and cached
+#   callback outputs are compressed once.
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import flask
+
+from coalesce import TAB_STORE
+from instrumentation import CALLBACK_PATH
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Parts of a callback request that determine its response
+REQUEST_FIELDS = ["output", "outputs", "inputs", "state", "changedPropIds"]
+
+# Content types worth compressing
+COMPRESSIBLE_TYPES = ["text/", "application/json", "application/javascript", "image/svg+xml"]
+
+
+# Key of a callback request: the normalized request and the data version
+def request_key(body, version):
+    fields = {name: body.get(name) for name in REQUEST_FIELDS}
+    # Every browser tab sends its own tab id, which does not change the response
+    fields["state"] = [state for state in fields["state"] or []
+                       if not (isinstance(state, dict) and state.get("id") == TAB_STORE)]
+    # The renderer lists the triggering inputs in no particular order
+    fields["changedPropIds"] = sorted(fields["changedPropIds"] or [])
+    canonical = json.dumps([version, fields], sort_keys = True, separators = (",", ":"), default = str)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def body_etag(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def compress(data, encoding, level):
+    if encoding == "br":
+        return brotli.compress(data, quality = min(level, 11))
+    # No timestamp, so the same body always compresses to the same bytes
+    return gzip.compress(data, compresslevel = level, mtime = 0)
+
+
+# LRU of byte strings bounded by their total size
+class BytesCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, size):
+        # Entries larger than the whole cache are not kept
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.items.popitem(last = False)
+                self.size -= evicted
+
+    def __len__(self):
+        return len(self.items)
+
+
+class HttpCache:
+
+    def __init__(self, response_bytes = 64 << 20, min_bytes = 1024, level = 6, version = lambda: None):
+        self.responses = BytesCache(response_bytes) if response_bytes else None
+        self.compressed = BytesCache(max(response_bytes, 16 << 20))
+        self.min_bytes = min_bytes
+        self.level = level
+        self.version = version
+        self.encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    # Stored response of a repeated callback request, None otherwise
+    def cached_response(self):
+        request = flask.request
+        if self.responses is None or request.method != "POST" or not request.path.endswith(CALLBACK_PATH):
+            return None
+        body = request.get_json(silent = True)
+        if not isinstance(body, dict):
+            return None
+        key = flask.g.response_key = request_key(body, self.version())
+        cached = self.responses.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        data, mimetype, etag = cached[0]
+        flask.g.response_cached = True
+        response = flask.Response(data, mimetype = mimetype)
+        response.set_etag(etag)
+        return response
+
+    def store(self, response):
+        key = flask.g.pop("response_key", None)
+        if (key is None or flask.g.pop("response_cached", False)
+                or response.status_code != 200 or response.direct_passthrough):
+            return
+        data = response.get_data()
+        etag = body_etag(data)
+        self.responses.set(key, (data, response.mimetype, etag), len(data))
+        response.set_etag(etag)
+
+    def encoding(self, response, size):
+        if not self.min_bytes or size < self.min_bytes or "Content-Encoding" in response.headers:
+            return None
+        if not any((response.mimetype or "").startswith(kind) for kind in COMPRESSIBLE_TYPES):
+            return None
+        response.vary.add("Accept-Encoding")
+        return flask.request.accept_encodings.best_match(self.encodings)
+
+    # ETag, 304 and compression of a finished response
+    def finish(self, response):
+        request = flask.request
+        if request.method not in ("GET", "HEAD", "POST") or response.status_code != 200:
+            return response
+
+        etag, _ = response.get_etag()
+        if etag is None:
+            response.direct_passthrough = False
+            etag = body_etag(response.get_data())
+        size = response.content_length
+        if size is None:
+            response.direct_passthrough = False
+            size = len(response.get_data())
+
+        encoding = self.encoding(response, size)
+        if encoding is not None:
+            etag = "{}-{}".format(etag, encoding)
+        # Callback POSTs only use the ETag to find their compressed body
+        conditional = request.method in ("GET", "HEAD")
+        if conditional:
+            response.set_etag(etag)
+        else:
+            response.headers.pop("ETag", None)
+
+        if conditional and request.if_none_match.contains(etag):
+            self.not_modified += 1
+            not_modified = flask.Response(status = 304)
+            not_modified.set_etag(etag)
+            not_modified.vary.update(response.vary)
+            return not_modified
+
+        if encoding is not None:
+            data = self.compressed.get(etag)
+            if data is None:
+                response.direct_passthrough = False
+                data = compress(response.get_data(), encoding, self.level)
+                self.compressed.set(etag, data, len(data))
+            else:
+                data = data[0]
+            response.direct_passthrough = False
+            response.set_data(data)
+            response.headers["Content-Encoding"] = encoding
+            self.bytes_in += size
+            self.bytes_out += len(data)
+        return response
+
+    def install(self, server):
+        server.before_request(self.cached_response)
+
+        def after_request(response):
+            self.store(response)
+            return self.finish(response)
+
+        # After-request hooks run in reverse order of registration; this one
+        # goes first in the list so it runs last, on the final body
+        server.after_request_funcs.setdefault(None, []).insert(0, after_request)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "responses": len(self.responses) if self.responses is not None else 0,
+            "response_bytes": self.responses.size if self.responses is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "not_modified": self.not_modified,
+            "compression_ratio": self.bytes_out / self.bytes_in if self.bytes_in else 1.0,
+        }
@@ -0,0 +1,318 @@
+#############################
+# Callback instrumentation
+#############################
+# Opt-in (VISA_METRICS=1) timings of the dashboard callbacks, served in the
+# Prometheus text format at /metrics:
+#
+# - visa_callback_seconds{callback}        whole callback
+# - visa_stage_seconds{callback,stage}     filter, groupby, figure and
+#                                          serialize (the rest of the request
+#                                          after the callback returned, which
+#                                          is mostly JSON encoding)
+# - visa_response_bytes{callback}          callback response payload
+# - cache and hover queue gauges from registered collectors
+#
+# Requests answered from the response cache of http_cache.py keep the label
+# of the callback that answered the same output before (with no callback
+# and stage timings, as none ran).
+#
+# /metrics/profile?rate=0.05 profiles a random 5% of the callback requests
+# with cProfile, GET /metrics/profile returns the accumulated profile and
+# /metrics/profile?rate=0 stops profiling (all with VISA_ADMIN_TOKEN in the
+# X-Admin-Token header; never in the URL, which the access log records).
+# Metrics are kept per worker process.
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+import flask
+from dash.exceptions import PreventUpdate
+
+import settings
+
+
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+BYTES_BUCKETS = [1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6]
+
+# Dash posts every server-side callback to this path
+CALLBACK_PATH = "/_dash-update-component"
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {} # (name, labels) -> Histogram
+        self.counters = {}   # (name, labels) -> value
+        self.collectors = [] # callables returning [(name, labels, value)]
+        self.help = {}
+
+    def observe(self, name, labels, value, buckets = SECONDS_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, labels, value = 1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+
+        def format_labels(labels):
+            if not labels:
+                return ""
+            return "{" + ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels) + "}"
+
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append("# TYPE {} histogram".format(name))
+            cumulative = 0
+            for bound, count in zip(self.format_bounds(histogram.buckets), histogram.counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(name, format_labels(labels + (("le", bound),)), cumulative))
+            lines.append("{}_sum{} {}".format(name, format_labels(labels), histogram.sum))
+            lines.append("{}_count{} {}".format(name, format_labels(labels), histogram.count))
+
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append("# TYPE {} counter".format(name))
+            lines.append("{}{} {}".format(name, format_labels(labels), value))
+
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                if name not in seen:
+                    seen.add(name)
+                    lines.append("# TYPE {} gauge".format(name))
+                lines.append("{}{} {}".format(name, format_labels(tuple(sorted(labels.items()))), value))
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def format_bounds(buckets):
+        return ["{:g}".format(bound) for bound in buckets] + ["+Inf"]
+
+
+metrics = Metrics()
+
+# Callback and timings of the request handled by the current thread
+current = threading.local()
+
+# Callback names by the output id the renderer posts, learned from the
+# requests that ran them; labels requests answered without running the
+# callback (the response cache of http_cache.py)
+callback_names = {}
+
+
+####################################
+# Spans and callback timing
+####################################
+
+@contextmanager
+def timed_span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe("visa_stage_seconds",
+                        {"callback": getattr(current, "callback", "none"), "stage": stage}, seconds)
+        stages = getattr(current, "stages", None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+# Time a stage of the running callback (no-op unless metrics are enabled)
+def span(stage):
+    if not settings.METRICS:
+        return nullcontext()
+    return timed_span(stage)
+
+
+# Seconds per stage of the callbacks this thread runs inside the block, as
+# the spans measure them (the benchmarks read them; needs VISA_METRICS=1)
+@contextmanager
+def record_stages():
+    current.stages = stages = {}
+    try:
+        yield stages
+    finally:
+        current.stages = None
+
+
+# Time a whole callback and remember it for the request hooks
+def instrumented(function):
+    name = function.__name__
+
+    @wraps(function)
+    def wrapper(*args):
+        if not settings.METRICS:
+            return function(*args)
+        current.callback = name
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        except PreventUpdate:
+            metrics.increment("visa_callback_prevented_total", {"callback": name})
+            raise
+        except Exception:
+            metrics.increment("visa_callback_errors_total", {"callback": name})
+            raise
+        finally:
+            current.callback_seconds = time.perf_counter() - start
+            metrics.observe("visa_callback_seconds", {"callback": name}, current.callback_seconds)
+    return wrapper
+
+
+####################################
+# Sampled profiling
+####################################
+
+class Profiler:
+
+    def __init__(self):
+        self.rate = 0.0
+        self.lock = threading.Lock()
+        self.stats = None
+        self.samples = 0
+
+    def add(self, profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.samples += 1
+
+    def dump(self, limit = 60):
+        with self.lock:
+            if self.stats is None:
+                return "No profile samples (rate {})\n".format(self.rate)
+            output = io.StringIO()
+            self.stats.stream = output
+            self.stats.sort_stats("cumulative").print_stats(limit)
+            return "{} samples (rate {})\n{}".format(self.samples, self.rate, output.getvalue())
+
+    def reset(self):
+        with self.lock:
+            self.stats = None
+            self.samples = 0
+
+
+profiler = Profiler()
+
+
+####################################
+# Flask hooks and endpoints
+####################################
+
+# Admin endpoints need VISA_ADMIN_TOKEN in the X-Admin-Token header: without
+# one configured they are closed. Query strings end up in the access log, so
+# a ?token= is not accepted.
+def authorized():
+    token = settings.ADMIN_TOKEN
+    if not token:
+        return False
+    given = flask.request.headers.get("X-Admin-Token") or ""
+    return hmac.compare_digest(given.encode(), token.encode())
+
+
+def install(server):
+
+    @server.before_request
+    def start_request():
+        if flask.request.path.endswith(CALLBACK_PATH):
+            body = flask.request.get_json(silent = True)
+            current.output = body.get("output") if isinstance(body, dict) else None
+            current.callback = callback_names.get(current.output, "unknown")
+            current.callback_seconds = None
+            current.request_start = time.perf_counter()
+            current.profile = None
+            if profiler.rate and random.random() < profiler.rate:
+                current.profile = cProfile.Profile()
+                current.profile.enable()
+
+    @server.after_request
+    def finish_request(response):
+        start = getattr(current, "request_start", None)
+        if start is None:
+            return response
+        current.request_start = None
+
+        if current.profile is not None:
+            current.profile.disable()
+            profiler.add(current.profile)
+            current.profile = None
+
+        callback = current.callback
+        if current.callback_seconds is not None and current.output is not None:
+            callback_names[current.output] = callback
+        seconds = time.perf_counter() - start
+        metrics.observe("visa_request_seconds", {"callback": callback}, seconds)
+        if current.callback_seconds is not None:
+            metrics.observe("visa_stage_seconds", {"callback": callback, "stage": "serialize"},
+                            max(seconds - current.callback_seconds, 0))
+        if not response.direct_passthrough:
+            metrics.observe("visa_response_bytes", {"callback": callback},
+                            len(response.get_data()), BYTES_BUCKETS)
+        return response
+
+    @server.route("/metrics")
+    def metrics_endpoint():
+        return flask.Response(metrics.render(), mimetype = "text/plain; version=0.0.4")
+
+    @server.route("/metrics/profile")
+    def profile_endpoint():
+        if not authorized():
+            flask.abort(403)
+        if "rate" in flask.request.args:
+            try:
+                rate = float(flask.request.args["rate"])
+            except ValueError:
+                rate = None
+            # Also rejects nan
+            if rate is None or not 0.0 <= rate <= 1.0:
+                flask.abort(400, "rate must be a number from 0 to 1")
+            profiler.rate = rate
+            if "reset" in flask.request.args:
+                profiler.reset()
+            return flask.Response("Profiling rate {} in worker {}\n".format(profiler.rate, os.getpid()),
+                                  mimetype = "text/plain")
+        return flask.Response(profiler.dump(), mimetype = "text/plain")
@@ -0,0 +1,204 @@
+#############################
+# Partitioned datasets
+#############################
+# The datasets served next to the default one (VISA_DATASETS) are stored
+# as one store per Schengen country:
+#
+#   $ python partitions.py data/other.csv   # writes data/other.parts/
+#
+# data/other.parts/meta.json lists the partitions with the features and
+# the time range of the whole dataset, and every partition is a store of
+# its own (see data_store.py). Workers only map the partitions of the
+# Schengen countries users select; "All countries" maps the combined store
+# data/other.parts/all, which holds every row, so it is not assembled in
+# memory. Loaded partitions (with their index and cube) are kept in an LRU
+# cache bounded by VISA_PARTITION_MEMORY_MB, so the memory of a worker
+# follows the working set and not the size of all datasets. A partition is
+# loaded outside the cache lock, once: other requests for the same one wait
+# for it, requests for other partitions do not.
+#
+# Partitions are built when a worker starts and finds them missing or
+# older than the CSV; unlike the default dataset they are not refreshed
+# while the workers run.
+
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from data_index import sort_frame
+from data_store import STORE_VERSION, load_store, read_meta, read_source, source_signature, store_is_fresh, write_store
+from dataset import KEY_COLUMNS, Dataset, store_lock
+
+
+# Store of all rows inside a partition directory
+COMBINED_STORE = "all"
+
+
+# Partition directory of a source CSV
+def partitions_path(path):
+    return os.path.splitext(path)[0] + ".parts"
+
+
+# Partitions built from the current source, with the combined store
+def partitions_are_fresh(path, parts_path):
+    return store_is_fresh(path, parts_path) and read_meta(parts_path).get("combined") == COMBINED_STORE
+
+
+def build_partitions(path, parts_path = None):
+    parts_path = parts_path or partitions_path(path)
+    df = sort_frame(read_source(path))
+    source = source_signature(path)
+
+    # Same swap as build_store: workers never see a half written directory
+    tmp_path = "{}.tmp-{}".format(parts_path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    os.makedirs(tmp_path)
+
+    # Partitions keep all categories, so they concatenate to categoricals again
+    partitions = {}
+    for i, (country, rows) in enumerate(df.groupby("Schengen country", observed = True, sort = True)):
+        name = "part{}".format(i)
+        write_store(rows.reset_index(drop = True), os.path.join(tmp_path, name), source)
+        partitions[country] = {"store": name, "rows": len(rows)}
+    write_store(df, os.path.join(tmp_path, COMBINED_STORE), source)
+
+    meta = {
+        "version": STORE_VERSION,
+        "rows": len(df),
+        "source": source,
+        "features": [name for name in df.columns if name not in KEY_COLUMNS],
+        "min_time": int(df["Year"].min()),
+        "max_time": int(df["Year"].max()),
+        "partitions": partitions,
+        "combined": COMBINED_STORE,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent = 2)
+
+    old_path = parts_path + ".old"
+    shutil.rmtree(old_path, ignore_errors = True)
+    if os.path.exists(parts_path):
+        os.rename(parts_path, old_path)
+    os.rename(tmp_path, parts_path)
+    shutil.rmtree(old_path, ignore_errors = True)
+
+    return meta
+
+
+class PartitionedDataset:
+
+    def __init__(self, path, parts_path = None):
+        self.path = path
+        self.parts_path = parts_path or partitions_path(path)
+        if not partitions_are_fresh(self.path, self.parts_path):
+            with store_lock(self.parts_path):
+                # Another worker may have built them while this one waited
+                if not partitions_are_fresh(self.path, self.parts_path):
+                    build_partitions(self.path, self.parts_path)
+        meta = read_meta(self.parts_path)
+
+        self.partitions = meta["partitions"]
+        self.countries = list(self.partitions)
+        self.features = meta["features"]
+        self.min_time = meta["min_time"]
+        self.max_time = meta["max_time"]
+        self.source = meta["source"]["sha1"]
+
+    # Store of a Schengen country, the combined store for any other value
+    def store_path(self, schengen_country):
+        partition = self.partitions.get(schengen_country)
+        return os.path.join(self.parts_path, partition["store"] if partition is not None else COMBINED_STORE)
+
+    # Dataset of one Schengen country, or of all of them for any other value
+    def load(self, schengen_country):
+        store = self.store_path(schengen_country)
+        dataset = Dataset(load_store(store), self.source, store = store)
+        # The time axis of the figures follows the dataset, not the years of one partition
+        dataset.min_time, dataset.max_time = self.min_time, self.max_time
+        return dataset
+
+
+# Bytes held by a loaded dataset: its columns (mapped or not) and the built cube features
+def dataset_bytes(dataset):
+    return (int(dataset.frame.memory_usage(index = False).sum())
+            + sum(cube.nbytes for cube in list(dataset.cube.cubes.values())))
+
+
+class PartitionCache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict() # (dataset, source, partition) -> Dataset
+        self.loading = {}          # key -> Event set when its load finished
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, key, load):
+        while True:
+            with self.lock:
+                dataset = self.items.get(key)
+                if dataset is not None:
+                    self.items.move_to_end(key)
+                    self.hits += 1
+                    return dataset
+                loading = self.loading.get(key)
+                if loading is None:
+                    loading = self.loading[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another request is loading this partition; look again once it is done
+            # (and load it here if that failed)
+            loading.wait()
+
+        try:
+            dataset = load()
+            with self.lock:
+                self.items[key] = dataset
+                self.evict()
+        finally:
+            with self.lock:
+                del self.loading[key]
+            loading.set()
+        # Returned even when evicted right away: the request still gets its data
+        return dataset
+
+    # Drop the least recently used partitions until the rest fits the cap;
+    # a partition larger than the cap on its own is not kept either
+    def evict(self):
+        sizes = {key: dataset_bytes(dataset) for key, dataset in self.items.items()}
+        total = sum(sizes.values())
+        while total > self.max_bytes and self.items:
+            key, _ = self.items.popitem(last = False)
+            total -= sizes[key]
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "partitions": len(self.items),
+                "bytes": sum(dataset_bytes(dataset) for dataset in self.items.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+# Build the partitions from the command line
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Build the per Schengen country partitions of a dataset")
+    parser.add_argument("source", help = "source CSV file")
+    parser.add_argument("--output", help = "partition directory (default: next to the CSV, .parts)")
+    args = parser.parse_args()
+
+    meta = build_partitions(args.source, args.output)
+    print("Wrote {} rows in {} partitions to {}".format(meta["rows"], len(meta["partitions"]),
+                                                        args.output or partitions_path(args.source)))
@@ -0,0 +1,104 @@
+#############################
+# Pre-rendered figures
+#############################
+# Most page loads show the default view (first dropdown values, the whole
+# time range, no hovered country). The figures of that view are embedded
+# in the layout, so the first paint needs no callback round trips, and
+# callbacks answer states found in the snapshot without computing them.
+#
+#   $ python prerender.py                  # default view
+#   $ python prerender.py --combinations   # and the world map and bar chart of
+#                                          # every Schengen country x feature
+#
+# writes the figures as JSON next to the store. The snapshot belongs to the
+# source the store was built from; after a data refresh the default view
+# is rendered again once per worker until the snapshot is rebuilt.
+
+import json
+import os
+import threading
+
+
+# Default location of the snapshot
+PRERENDER_PATH = "data/df_iso_schengen_origin.prerender.json"
+
+
+class Snapshot:
+
+    def __init__(self, path = PRERENDER_PATH):
+        self.path = path
+        self.source = None
+        self.figures = {} # (figure, inputs...) -> figure
+        self.loaded = None # stat of the loaded file
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            stat = os.stat(self.path)
+        except (OSError, TypeError):
+            return False
+        if (stat.st_size, stat.st_mtime_ns) == self.loaded:
+            return False
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.loaded = (stat.st_size, stat.st_mtime_ns)
+        self.source = data["source"]
+        self.figures = {tuple(json.loads(key)): figure for key, figure in data["figures"].items()}
+        return True
+
+    # Figure for a state of the data with this source hash, None if not pre-rendered
+    def get(self, source, key):
+        if source != self.source:
+            with self.lock:
+                # A snapshot of the new data may have been written meanwhile
+                if source != self.source and not (self.load() and source == self.source):
+                    self.source, self.figures = source, {}
+        return self.figures.get(key)
+
+    def get_or_render(self, source, key, render):
+        figure = self.get(source, key)
+        if figure is None:
+            figure = render()
+            with self.lock:
+                if source == self.source:
+                    self.figures[key] = figure
+        return figure
+
+
+def write_snapshot(path, source, figures):
+    from plotly.io.json import to_json_plotly
+
+    tmp_path = "{}.tmp-{}".format(path, os.getpid())
+    with open(tmp_path, "w") as f:
+        f.write(to_json_plotly({
+            "source": source,
+            "figures": {json.dumps(list(key)): figure for key, figure in figures.items()},
+        }))
+    os.replace(tmp_path, path)
+
+
+# Render the snapshot from the command line
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Pre-render the figures of the default dashboard view")
+    parser.add_argument("--combinations", action = "store_true",
+                        help = "also every Schengen country x feature combination over the whole time range")
+    parser.add_argument("--output", default = PRERENDER_PATH, help = "snapshot file")
+    args = parser.parse_args()
+
+    import EU_map_layout as m
+
+    # Render everything from the data, not from an existing snapshot
+    m.snapshot = Snapshot(None)
+    dataset = m.live.current
+    figures = m.defaultFigures(dataset)
+    if args.combinations:
+        figures.update(m.combinationFigures(dataset))
+
+    write_snapshot(args.output, dataset.source, figures)
+    print("Wrote {} figures to {}".format(len(figures), args.output))
@@ -0,0 +1,66 @@
+#############################
+# Dataset registry
+#############################
+# One deployment serves several visa datasets, picked with the dataset
+# dropdown. The default dataset is the live one (dataset.py), memory-mapped
+# whole and refreshed in place. The others are listed in VISA_DATASETS as
+#
+#   VISA_DATASETS="Consulates=data/consulates.csv;2020s=data/visas_2020s.csv"
+#
+# and served from per Schengen country partitions (partitions.py) loaded
+# on demand. Callbacks ask the registry for the dataset of a selection,
+# which is the current live dataset or the partition of the selected
+# Schengen country; both have the same index and cube, so the figures do
+# not care which one they get.
+
+from collections import OrderedDict
+
+from data_index import ALL_COUNTRIES
+from partitions import PartitionCache, PartitionedDataset
+
+
+# [(name, CSV path)] of a VISA_DATASETS value
+def parse_datasets(spec):
+    datasets = []
+    for item in spec.split(";"):
+        if not item.strip():
+            continue
+        name, separator, path = item.partition("=")
+        if not separator or not name.strip() or not path.strip():
+            raise ValueError("Invalid dataset {!r} (use 'name=path.csv')".format(item))
+        datasets.append((name.strip(), path.strip()))
+    return datasets
+
+
+class DatasetRegistry:
+
+    def __init__(self, live, default_name, datasets = (), memory_bytes = 256 << 20):
+        self.live = live
+        self.default_name = default_name
+        self.partitioned = OrderedDict((name, PartitionedDataset(path)) for name, path in datasets
+                                       if name != default_name)
+        self.cache = PartitionCache(memory_bytes)
+
+    def names(self):
+        return [self.default_name] + list(self.partitioned)
+
+    # Dataset answering queries of a Schengen country (the live one for unknown names)
+    def view(self, name, schengen_country):
+        entry = self.partitioned.get(name)
+        if entry is None:
+            return self.live.current
+        partition = schengen_country if schengen_country in entry.partitions else ALL_COUNTRIES
+        return self.cache.get_or_load((name, entry.source, partition), lambda: entry.load(partition))
+
+    # Schengen countries, features and time range for the controls of a dataset
+    def controls(self, name):
+        entry = self.partitioned.get(name)
+        if entry is None:
+            dataset = self.live.current
+            return {"countries": list(dataset.index.countries), "features": list(dataset.features),
+                    "min_time": dataset.min_time, "max_time": dataset.max_time}
+        return {"countries": list(entry.countries), "features": list(entry.features),
+                "min_time": entry.min_time, "max_time": entry.max_time}
+
+    def stats(self):
+        return dict(self.cache.stats(), datasets = self.names())
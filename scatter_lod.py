@@ -0,0 +1,67 @@
+#############################
+# Bubble plot level of detail
+#############################
+# The bubble plot draws one marker per (Schengen country, origin, year)
+# row. The level of detail depends on the number of points in view:
+#
+# - "svg"      plain scatter markers
+# - "webgl"    the same markers as Scattergl above VISA_BUBBLE_WEBGL_THRESHOLD
+# - "density"  a 2D histogram of the points (VISA_BUBBLE_DENSITY_BINS per
+#              axis) above VISA_BUBBLE_DENSITY_THRESHOLD
+#
+# Zooming reports the axis ranges back to the server (assets/clientside.js
+# keeps them in the bubble_view store), which bins only the points in view
+# again, so zooming in far enough shows the raw points. Zooming never adds
+# points, so when all of them are plain markers the browser zooms alone.
+
+import numpy as np
+
+
+# Level of detail for a number of points (0 disables a threshold)
+def level_of_detail(points, webgl_threshold, density_threshold):
+    if density_threshold and points > density_threshold:
+        return "density"
+    if webgl_threshold and points > webgl_threshold:
+        return "webgl"
+    return "svg"
+
+
+# Axis ranges of a view ({'x': [lo, hi] or None, 'y': ...}), None for the full extent
+def view_ranges(view):
+    if not view:
+        return None, None
+    return tuple(tuple(sorted(view[axis])) if view.get(axis) else None for axis in ("x", "y"))
+
+
+# Points inside the axis ranges
+def in_view(x, y, x_range, y_range):
+    mask = np.ones(len(x), dtype = bool)
+    for values, bounds in [(x, x_range), (y, y_range)]:
+        if bounds is not None:
+            mask &= (values >= bounds[0]) & (values <= bounds[1])
+    return mask
+
+
+def extent(values, bounds):
+    if bounds is not None:
+        return bounds
+    if len(values) == 0:
+        return (0.0, 1.0)
+    lo, hi = float(values.min()), float(values.max())
+    # Single valued axes still get a bin of some width
+    return (lo - 0.5, hi + 0.5) if lo == hi else (lo, hi)
+
+
+# Point counts on a bins x bins grid over the ranges (the extent of the
+# points by default), as heatmap arrays with NaN for empty cells
+def density_grid(x, y, bins, x_range = None, y_range = None):
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    x_range, y_range = extent(x, x_range), extent(y, y_range)
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins = bins, range = [x_range, y_range])
+    return {
+        'x': (x_edges[:-1] + x_edges[1:]) / 2,
+        'y': (y_edges[:-1] + y_edges[1:]) / 2,
+        # Heatmap rows run along y
+        'z': np.where(counts > 0, counts, np.nan).T,
+    }
@@ -0,0 +1,130 @@
+#############################
+# Dashboard settings
+#############################
+# All tuning knobs are read from environment variables so they can be set
+# per deployment (e.g. `heroku config:set VISA_FILTER_CACHE_SIZE=256`).
+
+import os
+import tempfile
+
+
+def env_str(name, default):
+    return os.environ.get(name, default)
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Shared memory if available so disk caches never touch the disk
+def shared_tmp_dir():
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+####################################
+# Datasets
+####################################
+
+# Name of the default dataset (data/df_iso_schengen_origin.csv) in the dataset dropdown
+DEFAULT_DATASET = env_str("VISA_DEFAULT_DATASET", "Schengen visas")
+# More datasets as "name=path.csv;name=path.csv", served from per Schengen country partitions
+DATASETS = env_str("VISA_DATASETS", "")
+# Megabytes of loaded partitions kept per worker (least recently used ones are dropped)
+PARTITION_MEMORY_MB = env_int("VISA_PARTITION_MEMORY_MB", 256)
+
+
+####################################
+# Filtered-frame cache
+####################################
+
+# Number of filtered frames kept per cache
+FILTER_CACHE_SIZE = env_int("VISA_FILTER_CACHE_SIZE", 128)
+# "memory" keeps one cache per worker, "disk" shares it between workers
+FILTER_CACHE_BACKEND = env_str("VISA_FILTER_CACHE_BACKEND", "memory")
+# Directory of the disk backend
+FILTER_CACHE_DIR = env_str("VISA_FILTER_CACHE_DIR",
+                           os.path.join(shared_tmp_dir(), "visa_dashboard_cache-{}".format(os.getuid())))
+
+
+####################################
+# Figures
+####################################
+
+# Figure templates kept per figure kind (one per feature or feature pair)
+FIGURE_TEMPLATE_CACHE_SIZE = env_int("VISA_FIGURE_TEMPLATE_CACHE_SIZE", 128)
+# Answer data-only updates with a dash Patch instead of a full figure
+FIGURE_PATCH = env_bool("VISA_FIGURE_PATCH", False)
+# Data arrays of the figures as "json" lists, "orjson" serialized lists or
+# "typed" (base64) arrays, see figure_encoding.py
+FIGURE_ENCODING = env_str("VISA_FIGURE_ENCODING", "json")
+# Embed the figures of the default view in the layout instead of computing
+# them with callbacks after the page loaded
+PRERENDER = env_bool("VISA_PRERENDER", True)
+# Compute the hover highlight of the bubble and line plots in the browser
+CLIENTSIDE_HOVER = env_bool("VISA_CLIENTSIDE_HOVER", False)
+# Bubble plot points drawn with WebGL above this many points in view, 0 never
+BUBBLE_WEBGL_THRESHOLD = env_int("VISA_BUBBLE_WEBGL_THRESHOLD", 5000)
+# Bubble plot binned into a density grid above this many points in view, 0 never
+BUBBLE_DENSITY_THRESHOLD = env_int("VISA_BUBBLE_DENSITY_THRESHOLD", 50000)
+# Bins per axis of the density grid
+BUBBLE_DENSITY_BINS = env_int("VISA_BUBBLE_DENSITY_BINS", 80)
+# Decimals of the world map values (one median per origin country)
+MAP_DECIMALS = env_int("VISA_MAP_DECIMALS", 2)
+# Significant digits of the world map values, 0 keeps all
+MAP_SIGNIFICANT_DIGITS = env_int("VISA_MAP_SIGNIFICANT_DIGITS", 0)
+
+
+####################################
+# Hover requests
+####################################
+
+# Queue and deduplicate hover-driven callbacks, dropping superseded ones
+HOVER_COALESCE = env_bool("VISA_HOVER_COALESCE", True)
+# Hover computations running at once per worker
+HOVER_MAX_CONCURRENT = env_int("VISA_HOVER_MAX_CONCURRENT", 2)
+
+
+####################################
+# Execution backend
+####################################
+
+# "inline" aggregates in the request thread, "process" in a pool of processes
+EXECUTOR = env_str("VISA_EXECUTOR", "inline")
+# Processes of the pool per worker
+EXECUTOR_WORKERS = env_int("VISA_EXECUTOR_WORKERS", 2)
+# Tasks queued or running in the pool at once; more requests wait for a slot
+EXECUTOR_MAX_PENDING = env_int("VISA_EXECUTOR_MAX_PENDING", 8)
+# Seconds a request waits for a slot and its result, 0 waits forever
+EXECUTOR_TIMEOUT = env_int("VISA_EXECUTOR_TIMEOUT", 10)
+
+
+####################################
+# HTTP responses
+####################################
+
+# Memory per worker for callback responses served again for repeated inputs, 0 disables
+RESPONSE_CACHE_MB = env_int("VISA_RESPONSE_CACHE_MB", 64)
+# Responses from this many bytes are compressed (gzip, or brotli if installed), 0 disables
+COMPRESS_MIN_BYTES = env_int("VISA_COMPRESS_MIN_BYTES", 1024)
+# gzip level (1-9) or brotli quality of the compressed responses
+COMPRESS_LEVEL = env_int("VISA_COMPRESS_LEVEL", 6)
+
+
+####################################
+# Monitoring and administration
+####################################
+
+# Record callback timings and serve them at /metrics
+METRICS = env_bool("VISA_METRICS", False)
+# Seconds between checks of each worker for a changed source or store, 0 disables
+REFRESH_INTERVAL = env_int("VISA_REFRESH_INTERVAL", 0)
+# Token required by the admin endpoints (profiling, refresh, ...); empty disables them
+ADMIN_TOKEN = env_str("VISA_ADMIN_TOKEN", "")
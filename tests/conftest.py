@@ -0,0 +1,48 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from data_index import sort_frame
+from data_store import read_source
+
+
+# Schengen countries and origin countries of the test data (alpha-3)
+SCHENGEN_CODES = ["AUT", "BEL", "DEU"]
+ORIGIN_CODES = ["ALB", "CHN", "IND", "MAR", "TUR", "USA", "ZAF"]
+YEARS = range(2014, 2020)
+
+
+# Source CSV contents in the layout of data/df_iso_schengen_origin.csv,
+# with some GDP values missing
+def make_source(years = YEARS, seed = 0):
+    rng = np.random.default_rng(seed)
+    rows = [(schengen, origin, year) for schengen in SCHENGEN_CODES for origin in ORIGIN_CODES for year in years]
+    df = pd.DataFrame(rows, columns = ["SCH_CODE", "COUNTRY_CODE", "YEAR"])
+    df["COUNTRY"] = df["COUNTRY_CODE"] + " country"
+    applications = rng.lognormal(6, 2, len(df)).round()
+    df["NUMBER_OF_VISA_APPLICATIONS"] = applications
+    df["VISAS_DENIED"] = (applications * rng.beta(2, 10, len(df))).round()
+    df["GDP_PER_CAPITA"] = rng.lognormal(8.5, 1.2, len(df)).round(2)
+    df.loc[rng.random(len(df)) < 0.1, "GDP_PER_CAPITA"] = np.nan
+    return df
+
+
+def write_source(path, source):
+    source.to_csv(path, index = False)
+
+
+# Parsed frame of a source in index order, as the dashboard holds it
+def parse(source):
+    return sort_frame(read_source(io.StringIO(source.to_csv(index = False))))
+
+
+@pytest.fixture
+def frame():
+    return parse(make_source())
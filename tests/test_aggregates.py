@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import dataset_per_origin, nanmedian_rows, per_origin_frame, top_k_frame, top_k_positions
+from data_index import ALL_COUNTRIES
+from dataset import Dataset
+
+
+FEATURES = ["Number of visa applications", "Gdp per capita"]
+
+
+def test_nanmedian_rows_matches_numpy():
+    rng = np.random.default_rng(1)
+    block = rng.normal(size = (50, 9))
+    block[rng.random(block.shape) < 0.3] = np.nan
+    block[3] = np.nan
+    with pytest.warns(RuntimeWarning): # the all-NaN row
+        expected = np.nanmedian(block, axis = 1)
+    np.testing.assert_array_equal(nanmedian_rows(block), expected)
+
+
+def test_nanmedian_rows_of_empty_rows():
+    assert np.isnan(nanmedian_rows(np.empty((4, 0)))).all()
+
+
+@pytest.mark.parametrize("ascending", [False, True])
+@pytest.mark.parametrize("k", [1, 3, 10, 100])
+def test_top_k_positions_matches_sort(k, ascending):
+    rng = np.random.default_rng(2)
+    values = rng.integers(0, 20, 40).astype(np.float64)
+    values[rng.random(40) < 0.2] = np.nan
+
+    positions = top_k_positions(values, k, ascending)
+    expected = pd.Series(values).dropna().sort_values(ascending = ascending, kind = "mergesort")
+    assert len(positions) == min(k, len(expected))
+    # Ties may be picked in another order, the values may not
+    np.testing.assert_array_equal(values[positions], expected.to_numpy()[:k])
+
+
+@pytest.mark.parametrize("feature", FEATURES)
+@pytest.mark.parametrize("schengen_country", ["Austria", "Germany", ALL_COUNTRIES])
+@pytest.mark.parametrize("year_range", [(2014, 2019), (2016, 2017), (2018, 2018)])
+def test_cube_medians_match_pandas(frame, schengen_country, year_range, feature):
+    dataset = Dataset(frame)
+    assert dataset.cube.exact
+    data = dataset.index.query(schengen_country, year_range)
+
+    cube = dataset_per_origin(dataset, schengen_country, year_range, feature)
+    expected = per_origin_frame(data, feature)
+    np.testing.assert_array_equal(cube["Country"].to_numpy(), expected["Country"].to_numpy())
+    np.testing.assert_array_equal(cube[feature].to_numpy(), expected[feature].to_numpy(dtype = np.float64))
+
+    for ascending in [False, True]:
+        top = dataset.cube.top_k(schengen_country, year_range, feature, 3, ascending)
+        expected = top_k_frame(data, feature, 3, ascending)
+        np.testing.assert_array_equal(top[feature].to_numpy(), expected[feature].to_numpy(dtype = np.float64))
+
+
+def test_medians_are_cached_read_only(frame):
+    cube = Dataset(frame).cube
+    medians = cube.medians("Belgium", (2015, 2018), "Gdp per capita")
+    assert cube.medians("Belgium", (2015, 2018), "Gdp per capita") is medians
+    assert not medians.flags.writeable
+    assert cube.values("Gdp per capita").dtype == frame["Gdp per capita"].dtype
@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+import pytest
+
+from callback_cache import DiskBackend, FilterCache, MemoryBackend, make_backend, private_directory
+
+
+KEY = ("source", "All countries", (2014, 2019), "CHN")
+
+
+@pytest.fixture(params = ["memory", "disk"])
+def backend(request, tmp_path):
+    return make_backend(request.param, 2, str(tmp_path / "cache"))
+
+
+# Set the modification time of the file of a disk cache entry
+def set_mtime(backend, key, seconds):
+    os.utime(backend.path(key), ns = (seconds * 10 ** 9, seconds * 10 ** 9))
+
+
+def test_private_directory_is_created_for_this_user_only(tmp_path):
+    path = private_directory(str(tmp_path / "cache"))
+    assert os.stat(path).st_mode & 0o777 == 0o700
+    assert private_directory(path) == path
+
+
+def test_private_directory_refuses_access_for_others(tmp_path):
+    path = str(tmp_path / "shared")
+    os.mkdir(path)
+    os.chmod(path, 0o755)
+    with pytest.raises(PermissionError):
+        private_directory(path)
+
+
+def test_private_directory_refuses_other_owners(tmp_path, monkeypatch):
+    path = private_directory(str(tmp_path / "cache"))
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(path).st_uid + 1)
+    with pytest.raises(PermissionError):
+        private_directory(path)
+
+
+def test_private_directory_refuses_symlinks(tmp_path):
+    target = private_directory(str(tmp_path / "cache"))
+    os.symlink(target, str(tmp_path / "link"))
+    with pytest.raises(PermissionError):
+        private_directory(str(tmp_path / "link"))
+
+
+def test_disk_entries_round_trip_without_pickle(tmp_path):
+    backend = DiskBackend(8, str(tmp_path / "cache"))
+    positions = np.array([3, 5, 8], dtype = np.int64)
+    backend.set(KEY, positions)
+    value = backend.get(KEY)
+    np.testing.assert_array_equal(value, positions)
+    assert value.dtype == np.int64
+    # Keys come back as the tuples they were
+    assert backend.keys() == [KEY]
+    with np.load(backend.path(KEY), allow_pickle = False) as stored:
+        assert set(stored.files) == {"key", "value"}
+
+
+def test_disk_refuses_objects(tmp_path):
+    backend = DiskBackend(8, str(tmp_path / "cache"))
+    with pytest.raises(TypeError):
+        backend.set(KEY, np.array(["CHN"], dtype = object))
+    assert len(backend) == 0
+
+
+def test_disk_ignores_damaged_entries(tmp_path):
+    backend = DiskBackend(8, str(tmp_path / "cache"))
+    backend.set(KEY, np.arange(3))
+    with open(backend.path(KEY), "wb") as f:
+        f.write(b"not an npz file")
+    assert FilterCache(backend).get_or_compute(KEY, lambda: np.arange(2)).tolist() == [0, 1]
+
+
+def test_evicts_least_recently_used(backend):
+    backend.set("a", np.arange(1))
+    backend.set("b", np.arange(2))
+    if isinstance(backend, DiskBackend):
+        # Entries are ordered by file time, which may not tick between two writes
+        set_mtime(backend, "a", 1)
+        set_mtime(backend, "b", 2)
+    backend.get("a")
+    backend.set("c", np.arange(3))
+    assert sorted(backend.keys()) == ["a", "c"] and len(backend) == 2
+
+
+def test_rekey_keeps_renamed_entries(backend):
+    cache = FilterCache(backend)
+    old = ("v1", "Belgium", (2014, 2019), "CHN")
+    stale = ("v1", "Austria", (2014, 2019), "CHN")
+    cache.get_or_compute(old, lambda: np.arange(4))
+    cache.get_or_compute(stale, lambda: np.arange(2))
+
+    cache.rekey(lambda key: ("v2",) + key[1:] if key[1] == "Belgium" else None)
+    assert backend.keys() == [("v2", "Belgium", (2014, 2019), "CHN")]
+    assert cache.get_or_compute(("v2", "Belgium", (2014, 2019), "CHN"), lambda: None).tolist() == [0, 1, 2, 3]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_memory_cache_keeps_any_value():
+    cache = FilterCache(MemoryBackend(4))
+    assert cache.get_or_compute("key", lambda: None) is None
+    assert cache.get_or_compute("key", lambda: 1) is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        make_backend("redis", 4)
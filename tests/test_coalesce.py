@@ -0,0 +1,146 @@
+import threading
+import time
+
+import dash
+import flask
+from dash.exceptions import PreventUpdate
+
+from coalesce import SESSION_COOKIE, TAB_STORE, HoverCoalescer, session_id, tab_callback
+
+
+def wait_until(condition, timeout = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+# Runs a request in a thread, keeping its result or exception
+class Request(threading.Thread):
+
+    def __init__(self, coalescer, session, key, compute):
+        super().__init__(daemon = True)
+        self.args = (session, "hover", key, compute)
+        self.coalescer = coalescer
+        self.result = self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.coalescer.run(*self.args)
+        except BaseException as error:
+            self.error = error
+
+
+def test_queued_request_is_dropped_when_superseded():
+    coalescer = HoverCoalescer(max_concurrent = 1)
+    release = threading.Event()
+    running = Request(coalescer, "other", "a", lambda: release.wait() and "a")
+    wait_until(lambda: coalescer.stats()["running"] == 1)
+
+    stale = Request(coalescer, "session", "b", lambda: "b")
+    wait_until(lambda: coalescer.stats()["queue_depth"] == 1)
+    newest = Request(coalescer, "session", "c", lambda: "c")
+    # The newer request of the same session drops the queued one right away
+    stale.join(5)
+    assert isinstance(stale.error, PreventUpdate)
+
+    release.set()
+    for request in [running, newest]:
+        request.join(5)
+    assert (running.result, newest.result) == ("a", "c")
+    stats = coalescer.stats()
+    assert stats["dropped"] == 1 and stats["executed"] == 2 and stats["queue_depth"] == 0
+
+
+def test_identical_requests_share_one_computation():
+    coalescer = HoverCoalescer(max_concurrent = 2)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait()
+        return "figure"
+
+    requests = [Request(coalescer, "session {}".format(i), "same", compute) for i in range(3)]
+    wait_until(lambda: coalescer.stats()["deduplicated"] == 2)
+    release.set()
+    for request in requests:
+        request.join(5)
+    assert [request.result for request in requests] == ["figure"] * 3
+    assert len(calls) == 1
+
+
+def test_superseded_request_with_waiters_still_runs():
+    coalescer = HoverCoalescer(max_concurrent = 1)
+    release = threading.Event()
+    running = Request(coalescer, "other", "a", lambda: release.wait() and "a")
+    wait_until(lambda: coalescer.stats()["running"] == 1)
+
+    leader = Request(coalescer, "session", "b", lambda: "b")
+    wait_until(lambda: coalescer.stats()["queue_depth"] == 1)
+    # Another session waits for the same result, so it is not dropped
+    follower = Request(coalescer, "second", "b", lambda: "b")
+    wait_until(lambda: coalescer.stats()["deduplicated"] == 1)
+    newest = Request(coalescer, "session", "c", lambda: "c")
+
+    release.set()
+    for request in [running, leader, follower, newest]:
+        request.join(5)
+    assert (leader.result, follower.result, newest.result) == ("b", "b", "c")
+    assert coalescer.stats()["dropped"] == 0
+
+
+def test_errors_reach_every_waiter():
+    coalescer = HoverCoalescer(max_concurrent = 1)
+    release = threading.Event()
+
+    def fail():
+        release.wait()
+        raise ValueError("no data")
+
+    requests = [Request(coalescer, "session {}".format(i), "same", fail) for i in range(2)]
+    wait_until(lambda: coalescer.stats()["deduplicated"] == 1)
+    release.set()
+    for request in requests:
+        request.join(5)
+    assert all(isinstance(request.error, ValueError) for request in requests)
+    # The failed computation is not kept: the next request computes again
+    assert coalescer.run("session", "hover", "same", lambda: "figure") == "figure"
+
+
+# Callback request body of a browser tab
+def states(tab):
+    return {"state": [{"id": "other", "property": "data", "value": 1}, {"id": TAB_STORE, "property": "data", "value": tab}]}
+
+
+def test_tabs_of_one_browser_are_sessions_of_their_own():
+    app = flask.Flask(__name__)
+    cookie = {"Cookie": "{}=browser".format(SESSION_COOKIE)}
+    with app.test_request_context("/", method = "POST", json = states("tab-1"), headers = cookie):
+        assert session_id() == "tab-1"
+    with app.test_request_context("/", method = "POST", json = states("tab-2"), headers = cookie):
+        assert session_id() == "tab-2"
+    # Requests without a tab id fall back to the cookie, then to the address
+    with app.test_request_context("/", method = "POST", json = {"state": []}, headers = cookie):
+        assert session_id() == "browser"
+    with app.test_request_context("/", environ_base = {"REMOTE_ADDR": "10.0.0.1"}):
+        assert session_id() == "10.0.0.1"
+
+
+def test_tab_callback_sends_the_tab_id_past_the_function():
+    app = dash.Dash(__name__)
+    calls = []
+
+    @tab_callback(app, dash.Output("out", "children"), dash.Input("in", "value"))
+    def update(value):
+        calls.append(value)
+        return value
+
+    # Called directly, the function takes its own arguments
+    assert update("direct") == "direct"
+    callback = next(iter(app.callback_map.values()))
+    assert [state["id"] for state in callback["state"]] == [TAB_STORE]
+    callback["callback"].__wrapped__("posted", "tab-1")
+    assert calls == ["direct", "posted"]
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from country_codes import alpha3_to_name, country_id, country_mask, country_table, encode_alpha3
+
+
+# Codes of a source with aggregate and non ISO codes next to countries
+CODES = pd.Series(["CHN", "XKX", "EUU", "CHN", None, "IND", "EUU"])
+
+
+def test_table_ids_follow_the_alpha3_codes():
+    table = country_table()
+    assert table["alpha3"].is_unique and table["alpha3"].is_monotonic_increasing
+    row = table[table["alpha3"] == "DEU"].iloc[0]
+    assert row["alpha2"] == "DE" and row["name"] == "Germany"
+
+
+def test_codes_outside_the_table_get_ids_after_it():
+    codes = pd.Series(encode_alpha3(CODES))
+    size = len(country_table())
+    assert country_id(codes, "CHN") < size
+    assert country_id(codes, "EUU") == size and country_id(codes, "XKX") == size + 1
+    assert country_id(codes, "ZZZ") == -1
+    assert codes.isna().tolist() == CODES.isna().tolist()
+
+
+def test_country_mask_matches_whole_codes():
+    codes = pd.Series(encode_alpha3(CODES))
+    assert country_mask(codes, "CHN").tolist() == [True, False, False, True, False, False, False]
+    assert country_mask(codes, "EUU").tolist() == [False, False, True, False, False, False, True]
+    assert country_mask(codes, "XKX").tolist() == [False, True, False, False, False, False, False]
+    # Neither parts of codes nor unknown codes match anything
+    for code in ["CH", "EU", "ZZZ", ""]:
+        assert not country_mask(codes, code).any()
+    assert country_mask(codes, "ZZZ").dtype == np.bool_ and len(country_mask(codes, "ZZZ")) == len(CODES)
+
+
+def test_names_of_codes():
+    names = alpha3_to_name(pd.Series(["DEU", "EUU", "CHN"]))
+    assert names[0] == "Germany" and pd.isna(names[1]) and names[2] == "China"
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+import data_index
+from conftest import YEARS
+from data_index import ALL_COUNTRIES, CountryYearIndex
+
+
+# Rows of a query by boolean filtering, in index order
+def expected(frame, schengen_country, year_range):
+    mask = (frame["Year"] >= year_range[0]) & (frame["Year"] <= year_range[1])
+    if schengen_country != ALL_COUNTRIES:
+        mask &= frame["Schengen country"] == schengen_country
+    return frame[mask]
+
+
+# Whether two frames have the same rows, in any order
+def same_rows(left, right):
+    def ordered(df):
+        df = df.astype({"Schengen country": str, "Country code": str})
+        return df.sort_values(["Schengen country", "Country code", "Year"]).reset_index(drop = True)
+    pd.testing.assert_frame_equal(ordered(left), ordered(right), check_categorical = False)
+    return True
+
+
+def test_all_countries_over_every_year_is_the_frame(frame):
+    index = CountryYearIndex(frame)
+    assert index.query(ALL_COUNTRIES, [YEARS[0], YEARS[-1]]) is index.frame
+    # Ranges past the data select every year as well
+    assert index.query(ALL_COUNTRIES, [1990, 2100]) is index.frame
+    assert not index.year_ranges
+
+
+def test_single_countries_are_views(frame):
+    index = CountryYearIndex(frame)
+    rows = index.query("Belgium", [2015, 2017])
+    assert same_rows(rows, expected(frame, "Belgium", [2015, 2017]))
+    assert np.shares_memory(rows["Year"].to_numpy(), index.frame["Year"].to_numpy())
+    assert rows["Year"].is_monotonic_increasing
+    assert len(index.query("Norway", [2015, 2017])) == 0
+
+
+def test_all_countries_year_ranges_are_copies_in_year_order(frame):
+    index = CountryYearIndex(frame)
+    rows = index.query(ALL_COUNTRIES, [2015, 2017])
+    assert same_rows(rows, expected(frame, ALL_COUNTRIES, [2015, 2017]))
+    assert rows["Year"].is_monotonic_increasing
+    assert not np.shares_memory(rows["Year"].to_numpy(), index.frame["Year"].to_numpy())
+    # Later queries of the range share the copy
+    assert index.query(ALL_COUNTRIES, [2015, 2017]) is rows
+    assert len(index.query(ALL_COUNTRIES, [2030, 2040])) == 0
+
+
+def test_keeps_the_last_year_ranges(frame):
+    index = CountryYearIndex(frame)
+    ranges = [[2014, year] for year in YEARS[:-1]]
+    assert len(ranges) > data_index.YEAR_RANGE_CACHE_SIZE
+    first = index.query(ALL_COUNTRIES, ranges[0])
+    second = index.query(ALL_COUNTRIES, ranges[1])
+    for year_range in ranges[2:data_index.YEAR_RANGE_CACHE_SIZE]:
+        index.query(ALL_COUNTRIES, year_range)
+    # A hit makes the first range the most recent, so the second one goes
+    assert index.query(ALL_COUNTRIES, ranges[0]) is first
+    index.query(ALL_COUNTRIES, ranges[data_index.YEAR_RANGE_CACHE_SIZE])
+    assert len(index.year_ranges) == data_index.YEAR_RANGE_CACHE_SIZE
+    assert index.query(ALL_COUNTRIES, ranges[0]) is first
+    assert index.query(ALL_COUNTRIES, ranges[1]) is not second
+
+
+def test_sorts_unsorted_frames(frame):
+    shuffled = frame.sample(frac = 1, random_state = 0).reset_index(drop = True)
+    index = CountryYearIndex(shuffled)
+    assert index.frame is not shuffled
+    assert same_rows(index.query("Germany", [2014, 2016]), expected(frame, "Germany", [2014, 2016]))
+    assert index.query("Germany", [2014, 2016])["Year"].is_monotonic_increasing
+    # Frames already in index order are kept as they are
+    assert CountryYearIndex(frame).frame is frame
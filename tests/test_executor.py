@@ -0,0 +1,102 @@
+import time
+
+import flask
+import pytest
+
+import executor
+from data_store import load_store, write_store
+from dataset import Dataset
+
+
+# Tasks run in the pool processes, which import them from this module
+def rows(dataset, seconds = 0):
+    time.sleep(seconds)
+    return len(dataset.frame)
+
+
+@pytest.fixture
+def stored(frame, tmp_path):
+    store_path = str(tmp_path / "visas.store")
+    write_store(frame, store_path, {"size": 0, "mtime_ns": 0, "sha1": "v1"})
+    return Dataset(load_store(store_path), "v1", store = store_path)
+
+
+@pytest.fixture
+def pool():
+    pools = []
+
+    def make(**options):
+        pools.append(executor.ProcessExecutor(workers = 1, **options))
+        return pools[-1]
+    yield make
+    # The executor cancels the tasks it stops waiting for, so at most a
+    # running task is left to finish (shutdown has no cancel_futures on 3.8)
+    for backend in pools:
+        if backend.pool is not None:
+            backend.pool.shutdown(wait = True)
+
+
+# App answering /run?seconds=<s> with the task run by a backend
+def make_app(backend, dataset):
+    app = flask.Flask(__name__)
+    executor.install(app)
+
+    @app.route("/run")
+    def run():
+        return {"rows": backend.run("rows", dataset, rows, float(flask.request.args.get("seconds", 0)))}
+    return app.test_client()
+
+
+def test_runs_in_the_pool(stored, pool):
+    backend = pool(timeout = 60)
+    client = make_app(backend, stored)
+    assert client.get("/run").get_json() == {"rows": len(stored.frame)}
+    assert backend.stats()["completed"] == 1 and backend.stats()["inline"] == 0
+
+
+def test_deadline_answers_504(stored, pool):
+    backend = pool(timeout = 60)
+    client = make_app(backend, stored)
+    client.get("/run") # start the pool process
+
+    backend.timeout = 0.3
+    response = client.get("/run?seconds=1")
+    assert response.status_code == 504
+    assert backend.stats()["timeouts"] == 1
+
+
+def test_saturated_pool_answers_503(stored, pool):
+    backend = pool(timeout = 60, max_pending = 1)
+    client = make_app(backend, stored)
+    client.get("/run")
+
+    backend.timeout = 0.3
+    # Times out while its task keeps the only slot until it finishes
+    assert client.get("/run?seconds=1.5").status_code == 504
+    response = client.get("/run")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    assert backend.stats()["rejected"] == 1
+
+    # The slot frees up once the task finished
+    backend.timeout = 60
+    assert client.get("/run").status_code == 200
+
+
+def test_stale_store_runs_inline(stored, pool):
+    backend = pool(timeout = 60)
+    newer = Dataset(stored.frame, "v2", store = stored.store)
+    client = make_app(backend, newer)
+    assert client.get("/run").get_json() == {"rows": len(stored.frame)}
+    assert backend.stats()["inline"] == 1
+
+
+def test_data_without_store_runs_inline(frame, pool):
+    backend = pool(timeout = 60)
+    assert backend.run("rows", Dataset(frame), rows) == len(frame)
+    assert backend.stats()["inline"] == 1 and backend.pool is None
+
+
+def test_make_executor():
+    assert isinstance(executor.make_executor("inline"), executor.InlineExecutor)
+    with pytest.raises(ValueError):
+        executor.make_executor("threads")
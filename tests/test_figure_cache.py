@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pytest
+
+from figure_cache import fill_template, replace, round_values
+
+
+def test_round_values_to_decimals():
+    np.testing.assert_array_equal(round_values([1.23456, -2.5, 10.0], 2), [1.23, -2.5, 10.0])
+
+
+@pytest.mark.parametrize("value, expected", [
+    (123456.0, 123000.0),
+    (0.00123456, 0.00123),
+    (-98765.4, -98800.0),
+    (1.0, 1.0),
+    (0.0, 0.0),
+])
+def test_round_values_to_significant_digits(value, expected):
+    assert round_values([value], 9, 3)[0] == expected
+
+
+def test_round_values_print_short():
+    values = round_values([0.1234567, 987654.321, 3.14159], 6, 3)
+    assert json.dumps(values.tolist()) == "[0.123, 988000.0, 3.14]"
+
+
+def test_round_values_keep_missing():
+    values = round_values(np.array([np.nan, np.inf, 2.345]), 1, 2)
+    assert np.isnan(values[0]) and values[1] == np.inf and values[2] == 2.3
+
+
+def test_fill_template_leaves_template_unchanged():
+    template = {"data": [{"type": "bar", "x": [], "marker": {"color": "red"}}], "layout": {"title": {"text": "a"}}}
+    before = json.dumps(template)
+    figure = fill_template(template, [{"x": [1, 2], "marker.color": "blue"}], {"title.text": "b"})
+    assert json.dumps(template) == before
+    assert figure["data"][0] == {"type": "bar", "x": [1, 2], "marker": {"color": "blue"}}
+    assert figure["layout"] == {"title": {"text": "b"}}
+
+
+def test_replace_shares_untouched_values():
+    base = {"a": {"b": 1}, "c": [1, 2]}
+    result = replace(base, {"a.b": 2})
+    assert result["c"] is base["c"] and base["a"]["b"] == 1
@@ -0,0 +1,62 @@
+import base64
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from figure_encoding import compact_dtype, encode_array, encode_updates, resolve, typed_array
+
+
+@pytest.mark.parametrize("values, dtype", [
+    ([0, 1, 255], "<u1"),
+    ([-1, 0, 127], "<i1"),
+    ([0, 256], "<u2"),
+    ([-129, 0], "<i2"),
+    ([0, 2 ** 16], "<u4"),
+    ([-2 ** 15 - 1, 2 ** 16], "<i4"),
+    ([0, 2 ** 32], "<f4"),
+    ([0, 2 ** 32 + 1], None),
+])
+def test_compact_dtype_of_integers(values, dtype):
+    for array in [np.array(values, dtype = np.int64), np.array(values, dtype = np.float64)]:
+        assert compact_dtype(array) == dtype
+
+
+@pytest.mark.parametrize("values, dtype", [
+    (np.array([0.5, 1.25], dtype = np.float64), "<f4"),
+    (np.array([0.1, 2.0], dtype = np.float64), "<f8"),
+    (np.array([0.1, 2.0], dtype = np.float32), "<f4"),
+    (np.array([1.0, np.nan], dtype = np.float64), "<f4"),
+    (np.array([0.1, np.inf], dtype = np.float64), "<f8"),
+])
+def test_compact_dtype_of_fractions(values, dtype):
+    assert compact_dtype(values) == dtype
+
+
+@pytest.mark.parametrize("values", [
+    np.array([3, 200, 70000], dtype = np.int64),
+    np.array([0.1, np.nan, -2.5], dtype = np.float64),
+    np.array([1.5, 2.25], dtype = np.float32),
+])
+def test_typed_arrays_hold_the_values_exactly(values):
+    spec = typed_array(values, compact_dtype(values))
+    decoded = np.frombuffer(base64.b64decode(spec["bdata"]), dtype = "<" + spec["dtype"])
+    np.testing.assert_array_equal(decoded.astype(np.float64), values.astype(np.float64))
+
+
+def test_encode_array():
+    assert encode_array(pd.Series(["a", "b"]), "typed") == ["a", "b"]
+    assert encode_array(np.float32(0.5), "typed") == 0.5 and type(encode_array(np.float32(0.5), "typed")) is float
+    assert encode_array(np.array([1.0, 2.0]), "typed")["dtype"] == "u1"
+    assert isinstance(encode_array(np.array([1.0, 2.0]), "orjson"), np.ndarray)
+    assert encode_array(np.array([], dtype = np.float64), "typed").size == 0
+
+
+def test_json_keeps_updates_as_they_are():
+    updates = [{"x": np.array([1, 2])}]
+    assert encode_updates(updates, "json") is updates
+
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        resolve("msgpack")
@@ -0,0 +1,146 @@
+import gzip
+import json
+from types import SimpleNamespace
+
+import flask
+import pytest
+
+import http_cache
+from coalesce import TAB_STORE
+from http_cache import HttpCache, request_key
+from instrumentation import CALLBACK_PATH
+
+
+# Callback body of the Dash renderer for one input value
+def callback_body(value, changed = ("a.value", "b.value")):
+    return {"output": "graph.figure", "outputs": {"id": "graph", "property": "figure"},
+            "inputs": [{"id": "a", "property": "value", "value": value}], "state": [],
+            "changedPropIds": list(changed)}
+
+
+# App with a callback endpoint echoing its input in a large response, a
+# page and a small text response, behind a cache of this version
+def make_app(version = lambda: "v1", min_bytes = 1024):
+    app = flask.Flask(__name__)
+    app.calls = 0
+
+    @app.route(CALLBACK_PATH, methods = ["POST"])
+    def callback():
+        app.calls += 1
+        value = flask.request.get_json()["inputs"][0]["value"]
+        if value == "fail":
+            return flask.Response("error", status = 500)
+        return flask.jsonify({"response": {"graph": {"figure": {"data": [value] * 500}}}})
+
+    @app.route("/", methods = ["GET", "HEAD"])
+    def page():
+        return flask.Response("<html>{}</html>".format("x" * 4000), mimetype = "text/html")
+
+    @app.route("/small")
+    def small():
+        return flask.Response("small", mimetype = "text/plain")
+
+    cache = HttpCache(1 << 20, min_bytes = min_bytes, version = version)
+    cache.install(app)
+    app.http_cache = cache
+    return app
+
+
+def test_repeated_callback_is_served_from_the_cache():
+    app = make_app()
+    client = app.test_client()
+    first = client.post(CALLBACK_PATH, json = callback_body("x"))
+    # The renderer lists the triggering inputs in any order
+    second = client.post(CALLBACK_PATH, json = callback_body("x", changed = ("b.value", "a.value")))
+    assert app.calls == 1
+    assert second.get_data() == first.get_data()
+    assert app.http_cache.stats()["hits"] == 1 and app.http_cache.stats()["misses"] == 1
+
+
+def test_other_inputs_and_data_versions_miss():
+    version = ["v1"]
+    app = make_app(version = lambda: version[0])
+    client = app.test_client()
+    client.post(CALLBACK_PATH, json = callback_body("x"))
+    client.post(CALLBACK_PATH, json = callback_body("y"))
+    version[0] = "v2"
+    client.post(CALLBACK_PATH, json = callback_body("x"))
+    assert app.calls == 3 and app.http_cache.stats()["hits"] == 0
+
+
+def test_errors_are_not_cached():
+    app = make_app()
+    client = app.test_client()
+    for _ in range(2):
+        assert client.post(CALLBACK_PATH, json = callback_body("fail")).status_code == 500
+    assert app.calls == 2
+
+
+def test_request_key_ignores_other_fields():
+    body = callback_body("x")
+    assert request_key(body, "v1") == request_key(dict(body, extra = 1), "v1")
+    assert request_key(body, "v1") != request_key(body, "v2")
+
+
+def test_tabs_share_cached_responses():
+    body = callback_body("x")
+    tabs = [dict(body, state = [{"id": TAB_STORE, "property": "data", "value": tab}]) for tab in ["t1", "t2"]]
+    assert request_key(tabs[0], "v1") == request_key(tabs[1], "v1") == request_key(body, "v1")
+    other_state = dict(body, state = [{"id": "bubble_view", "property": "data", "value": None}])
+    assert request_key(other_state, "v1") != request_key(body, "v1")
+
+
+@pytest.mark.parametrize("method", ["GET", "HEAD"])
+def test_matching_etag_answers_304(method):
+    client = make_app().test_client()
+    etag = client.get("/").headers["ETag"]
+    response = client.open("/", method = method, headers = {"If-None-Match": etag})
+    assert response.status_code == 304 and response.headers["ETag"] == etag
+    assert client.get("/", headers = {"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_callbacks_get_no_etag_and_no_304():
+    client = make_app().test_client()
+    response = client.post(CALLBACK_PATH, json = callback_body("x"), headers = {"Accept-Encoding": "gzip"})
+    assert "ETag" not in response.headers
+    for etag in ["*", '"anything"']:
+        response = client.post(CALLBACK_PATH, json = callback_body("x"), headers = {"If-None-Match": etag})
+        assert response.status_code == 200 and "ETag" not in response.headers
+
+
+def test_compresses_callbacks_and_pages():
+    app = make_app()
+    client = app.test_client()
+    response = client.post(CALLBACK_PATH, json = callback_body("x"), headers = {"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip" and "Accept-Encoding" in response.headers["Vary"]
+    assert json.loads(gzip.decompress(response.get_data()))["response"]["graph"]["figure"]["data"][0] == "x"
+
+    page = client.get("/", headers = {"Accept-Encoding": "gzip"})
+    assert page.headers["Content-Encoding"] == "gzip" and page.headers["ETag"].endswith('-gzip"')
+    assert app.http_cache.stats()["compression_ratio"] < 0.5
+
+
+def test_small_and_unaccepted_responses_stay_plain():
+    client = make_app().test_client()
+    assert "Content-Encoding" not in client.get("/small", headers = {"Accept-Encoding": "gzip"}).headers
+    assert "Content-Encoding" not in client.get("/").headers
+    assert "Content-Encoding" not in client.get("/", headers = {"Accept-Encoding": "br"}).headers
+
+
+def test_compression_can_be_disabled():
+    client = make_app(min_bytes = 0).test_client()
+    assert "Content-Encoding" not in client.get("/", headers = {"Accept-Encoding": "gzip"}).headers
+
+
+@pytest.mark.parametrize("accept, encoding", [
+    ("gzip, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("gzip", "gzip"),
+    ("br", "br"),
+])
+def test_brotli_when_installed_and_accepted(monkeypatch, accept, encoding):
+    # Stand-in for the brotli package
+    monkeypatch.setattr(http_cache, "brotli", SimpleNamespace(compress = lambda data, quality: b"br" + data[:10]))
+    response = make_app().test_client().get("/", headers = {"Accept-Encoding": accept})
+    assert response.headers["Content-Encoding"] == encoding
+    assert response.headers["ETag"].endswith('-{}"'.format(encoding))
@@ -0,0 +1,151 @@
+import cProfile
+import re
+
+import flask
+import pytest
+
+import instrumentation
+import settings
+from http_cache import HttpCache
+from instrumentation import CALLBACK_PATH, Metrics, Profiler, instrumented, record_stages, span
+
+
+@pytest.fixture(autouse = True)
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS", True)
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(instrumentation, "metrics", Metrics())
+    monkeypatch.setattr(instrumentation, "profiler", Profiler())
+    monkeypatch.setattr(instrumentation, "callback_names", {})
+
+
+@instrumented
+def update_test(value):
+    with span("groupby"):
+        with span("filter"):
+            rows = list(range(value))
+    with span("figure"):
+        return {"data": rows}
+
+
+# App with one callback at the Dash callback path, optionally behind the response cache
+def make_client(response_cache = False):
+    app = flask.Flask(__name__)
+    instrumentation.install(app)
+    if response_cache:
+        HttpCache(1 << 20).install(app)
+
+    @app.route(CALLBACK_PATH, methods = ["POST"])
+    def callback():
+        return flask.jsonify(update_test(flask.request.get_json()["inputs"][0]["value"]))
+    return app.test_client()
+
+
+def post_callback(client, value = 3):
+    return client.post(CALLBACK_PATH, json = {"output": "graph.figure", "inputs": [{"value": value}],
+                                             "changedPropIds": ["a.value"]})
+
+
+# Value of one sample of the /metrics exposition (labels in their order
+# there: sorted, then le), None if it is missing
+def sample(text, name, **labels):
+    label_text = ",".join('{}="{}"'.format(key, value) for key, value in labels.items())
+    match = re.search(r"^{}\{{{}\}} (\S+)$".format(re.escape(name), re.escape(label_text)), text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_metrics_after_one_callback():
+    client = make_client()
+    assert post_callback(client).status_code == 200
+    text = client.get("/metrics").get_data(as_text = True)
+
+    assert "# TYPE visa_stage_seconds histogram" in text
+    assert sample(text, "visa_callback_seconds_count", callback = "update_test") == 1
+    assert sample(text, "visa_request_seconds_count", callback = "update_test") == 1
+    assert sample(text, "visa_response_bytes_count", callback = "update_test") == 1
+    for stage in ["filter", "groupby", "figure", "serialize"]:
+        assert sample(text, "visa_stage_seconds_count", callback = "update_test", stage = stage) == 1
+        # Every observation falls into the +Inf bucket
+        assert sample(text, "visa_stage_seconds_bucket", callback = "update_test", stage = stage, le = "+Inf") == 1
+
+
+def test_cached_responses_keep_the_callback_label():
+    client = make_client(response_cache = True)
+    post_callback(client)
+    post_callback(client)
+    text = client.get("/metrics").get_data(as_text = True)
+    assert sample(text, "visa_callback_seconds_count", callback = "update_test") == 1
+    assert sample(text, "visa_request_seconds_count", callback = "update_test") == 2
+    assert 'callback="unknown"' not in text
+
+
+def test_histograms_gauges_and_counters():
+    metrics = Metrics()
+    for value in [0.002, 0.02, 20]:
+        metrics.observe("latency_seconds", {"callback": "a"}, value)
+    metrics.increment("errors_total", {"callback": "a"})
+    metrics.add_collector(lambda: [("queue_depth", {}, 3)])
+    text = metrics.render()
+
+    assert sample(text, "latency_seconds_bucket", callback = "a", le = "0.001") == 0
+    assert sample(text, "latency_seconds_bucket", callback = "a", le = "0.0025") == 1
+    assert sample(text, "latency_seconds_bucket", callback = "a", le = "0.025") == 2
+    assert sample(text, "latency_seconds_bucket", callback = "a", le = "+Inf") == 3
+    assert sample(text, "latency_seconds_sum", callback = "a") == pytest.approx(20.022)
+    assert "# TYPE errors_total counter" in text and sample(text, "errors_total", callback = "a") == 1
+    assert "# TYPE queue_depth gauge" in text and "\nqueue_depth 3\n" in text
+
+
+def test_record_stages():
+    with record_stages() as stages:
+        update_test(10)
+    assert set(stages) == {"filter", "groupby", "figure"}
+    # Nested spans: the groupby includes the filter
+    assert stages["groupby"] >= stages["filter"]
+    update_test(10)
+    assert set(stages) == {"filter", "groupby", "figure"}
+
+
+def test_spans_are_off_without_metrics(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS", False)
+    with record_stages() as stages:
+        update_test(10)
+    assert stages == {}
+
+
+def test_profile_needs_the_token_header():
+    client = make_client()
+    assert client.get("/metrics/profile").status_code == 403
+    assert client.get("/metrics/profile?token=secret").status_code == 403
+    assert client.get("/metrics/profile", headers = {"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/metrics/profile", headers = {"X-Admin-Token": "secret"}).status_code == 200
+
+
+def test_admin_endpoints_are_closed_without_a_token(monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "")
+    response = make_client().get("/metrics/profile", headers = {"X-Admin-Token": ""})
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("rate, status", [("0.5", 200), ("1", 200), ("abc", 400), ("1.5", 400), ("nan", 400),
+                                          ("", 400)])
+def test_profile_rate(rate, status):
+    client = make_client()
+    response = client.get("/metrics/profile?rate=" + rate, headers = {"X-Admin-Token": "secret"})
+    assert response.status_code == status
+    if status == 200:
+        assert instrumentation.profiler.rate == float(rate)
+
+
+def test_profiler_collects_samples():
+    profiler = Profiler()
+    assert "No profile samples" in profiler.dump()
+    for _ in range(2):
+        profile = cProfile.Profile()
+        profile.enable()
+        update_test(3)
+        profile.disable()
+        profiler.add(profile)
+    assert profiler.dump().startswith("2 samples")
+    profiler.reset()
+    assert profiler.samples == 0 and "No profile samples" in profiler.dump()
@@ -0,0 +1,93 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_source, write_source
+from data_index import ALL_COUNTRIES
+from data_store import is_mapped
+from partitions import PartitionCache, PartitionedDataset
+
+
+# Stand-in for a loaded dataset of some bytes
+class Loaded:
+
+    def __init__(self, size):
+        self.size = size
+        self.frame = pd.DataFrame({"values": np.zeros(size, dtype = np.uint8)})
+        self.cube = SimpleNamespace(cubes = {})
+
+
+def test_evicts_least_recently_used():
+    cache = PartitionCache(max_bytes = 100)
+    a = cache.get_or_load("a", lambda: Loaded(40))
+    cache.get_or_load("b", lambda: Loaded(40))
+    assert cache.get_or_load("a", lambda: Loaded(40)) is a
+    cache.get_or_load("c", lambda: Loaded(40))
+    assert list(cache.items) == ["a", "c"]
+    assert cache.stats()["evictions"] == 1 and cache.stats()["hits"] == 1
+
+
+def test_does_not_keep_partitions_over_the_cap():
+    cache = PartitionCache(max_bytes = 100)
+    cache.get_or_load("a", lambda: Loaded(40))
+    large = cache.get_or_load("large", lambda: Loaded(150))
+    # The request still gets its partition
+    assert large.size == 150
+    assert len(cache.items) == 0 and cache.stats()["evictions"] == 2
+
+
+def test_loads_a_partition_once_without_blocking_others():
+    cache = PartitionCache(max_bytes = 1000)
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append("slow")
+        release.wait(5)
+        return Loaded(1)
+
+    threads = [threading.Thread(target = cache.get_or_load, args = ("slow", slow)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while not calls and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+    # Another partition loads while the slow one is in flight
+    assert cache.get_or_load("fast", lambda: Loaded(1)).size == 1
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == ["slow"]
+    assert cache.stats()["misses"] == 2 and cache.stats()["hits"] == 2
+
+
+def test_failed_load_is_retried():
+    cache = PartitionCache(max_bytes = 100)
+
+    def fail():
+        raise OSError("missing")
+    with pytest.raises(OSError):
+        cache.get_or_load("a", fail)
+    assert cache.get_or_load("a", lambda: Loaded(1)).size == 1
+    assert not cache.loading
+
+
+def test_all_countries_maps_the_combined_store(tmp_path):
+    path = str(tmp_path / "visas.csv")
+    write_source(path, make_source())
+    partitioned = PartitionedDataset(path)
+
+    belgium = partitioned.load("Belgium")
+    combined = partitioned.load(ALL_COUNTRIES)
+    assert list(belgium.index.countries) == ["Belgium"]
+    assert combined.store.endswith("all") and list(combined.index.countries) == partitioned.countries
+    assert is_mapped(combined.frame["Year"].to_numpy())
+    # The time axis of a partition is the one of the whole dataset
+    assert (belgium.min_time, belgium.max_time) == (combined.min_time, combined.max_time)
+    np.testing.assert_array_equal(combined.index.query("Belgium", (2014, 2019))["Gdp per capita"],
+                                  belgium.frame["Gdp per capita"])
@@ -0,0 +1,104 @@
+import importlib
+import os
+
+import pytest
+
+from conftest import make_source, write_source
+from prerender import Snapshot, write_snapshot
+
+
+# The dashboard module, imported once on generated data
+@pytest.fixture(scope = "module")
+def layout(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("dashboard")
+    os.mkdir(str(workdir / "data"))
+    write_source(str(workdir / "data" / "df_iso_schengen_origin.csv"), make_source())
+    cwd = os.getcwd()
+    os.chdir(str(workdir))
+    try:
+        return importlib.import_module("EU_map_layout")
+    finally:
+        os.chdir(cwd)
+
+
+# Snapshot holding the default figures of the current data
+@pytest.fixture
+def snapshot(layout, monkeypatch):
+    snapshot = Snapshot(None)
+    monkeypatch.setattr(layout, "snapshot", snapshot)
+    layout.defaultFigures(layout.live.current)
+    return snapshot
+
+
+# Callback function behind prerendered() recording the inputs it renders
+def rendering(layout, key):
+    calls = []
+
+    @layout.prerendered(key)
+    def render(*args):
+        calls.append(args)
+        return "rendered"
+    return render, calls
+
+
+def default_inputs(layout):
+    state = layout.defaultState(layout.live.current)
+    return state, [state['schengen_country'], state['hoverData'], state['feature_1'], state['feature_2'],
+                   state['year_range']]
+
+
+def test_default_view_is_served_from_the_snapshot(layout, snapshot):
+    state, inputs = default_inputs(layout)
+    render, calls = rendering(layout, layout.bubbleplotKey)
+    figure = render(*inputs)
+    assert figure == snapshot.figures[layout.bubbleplotKey(*inputs)] and calls == []
+    # The default dataset by its name
+    assert render(*inputs, None, layout.datasets.default_name) is figure and calls == []
+    assert {key[0] for key in snapshot.figures} == {'worldmap', 'barplot', 'bubble_plot', 'line_plot'}
+
+
+@pytest.mark.parametrize("change", ["hover", "feature", "years", "zoom", "dataset"])
+def test_other_inputs_are_rendered(layout, snapshot, change):
+    state, inputs = default_inputs(layout)
+    view, dataset_name = None, None
+    if change == "hover":
+        inputs[1] = {'points': [{'location': 'CHN'}]}
+    elif change == "feature":
+        inputs[3] = "Visas denied" if inputs[3] != "Visas denied" else "Number of visa applications"
+    elif change == "years":
+        inputs[4] = [state['year_range'][0] + 1, state['year_range'][1]]
+    elif change == "zoom":
+        view = {'revision': 'r', 'x': [0, 1], 'y': None}
+    else:
+        dataset_name = "other"
+    render, calls = rendering(layout, layout.bubbleplotKey)
+    assert render(*inputs, view, dataset_name) == "rendered" and len(calls) == 1
+
+
+def test_line_plot_series_other_than_values_are_rendered(layout, snapshot):
+    state, _ = default_inputs(layout)
+    inputs = [state['schengen_country'], state['hoverData'], state['feature_1'], state['year_range']]
+    render, calls = rendering(layout, layout.lineplotKey)
+    assert render(*inputs, None, 'value') != "rendered"
+    assert render(*inputs, None, 'share') == "rendered" and len(calls) == 1
+
+
+def test_snapshot_of_other_data_is_not_served(layout, snapshot):
+    _, inputs = default_inputs(layout)
+    key = layout.bubbleplotKey(*inputs)
+    assert snapshot.get(layout.live.current.source, key) is not None
+    assert snapshot.get("other source", key) is None
+    assert snapshot.figures == {}
+
+
+def test_snapshot_file_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    key = ('bubble_plot', 'Austria', 'DEU', 'Visas issued', 'Visas denied', 2014, 2019)
+    write_snapshot(path, "v1", {key: {"data": [], "layout": {}}})
+    snapshot = Snapshot(path)
+    assert snapshot.source == "v1" and snapshot.get("v1", key) == {"data": [], "layout": {}}
+    assert snapshot.get_or_render("v1", key[:-1] + (2018,), lambda: "rendered") == "rendered"
+    assert snapshot.get("v1", key[:-1] + (2018,)) == "rendered"
+    # New data drops the figures of the old one
+    assert snapshot.get_or_render("v2", key, lambda: "v2") == "v2"
+    assert snapshot.get("v1", key) is None
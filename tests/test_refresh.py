@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from conftest import make_source, parse, write_source
+from data_store import build_store, changed_cells, read_meta
+from dataset import Dataset, LiveDataset, affected
+
+
+FEATURE = "Gdp per capita"
+
+
+def test_no_changes(frame):
+    assert changed_cells(frame, frame.copy()) == []
+
+
+def test_row_order_does_not_matter(frame):
+    shuffled = frame.sample(frac = 1, random_state = 0).reset_index(drop = True)
+    assert changed_cells(frame, shuffled) == []
+
+
+def test_changed_added_and_removed_cells():
+    source = make_source()
+    changed = pd.concat([source, make_source(years = [2020], seed = 1)], ignore_index = True)
+    changed.loc[(changed["SCH_CODE"] == "BEL") & (changed["YEAR"] == 2016), "GDP_PER_CAPITA"] += 1
+    changed = changed[~((changed["SCH_CODE"] == "DEU") & (changed["YEAR"] == 2014))]
+
+    cells = changed_cells(parse(source), parse(changed))
+    assert sorted(map(tuple, cells)) == [("Austria", 2020), ("Belgium", 2016), ("Belgium", 2020),
+                                         ("Germany", 2014), ("Germany", 2020)]
+
+
+def test_other_columns_change_everything(frame):
+    assert changed_cells(frame, frame.drop(columns = [FEATURE])) is None
+
+
+def test_affected():
+    changed = {("Belgium", 2016)}
+    assert affected(changed, "Belgium", (2014, 2019))
+    assert affected(changed, "All countries", (2016, 2016))
+    assert not affected(changed, "Belgium", (2017, 2019))
+    assert not affected(changed, "Austria", (2014, 2019))
+    assert affected(None, "Austria", (2014, 2019))
+
+
+def test_refresh_carries_over_unchanged_cells(tmp_path):
+    path, store_path = str(tmp_path / "visas.csv"), str(tmp_path / "visas.store")
+    source = make_source()
+    write_source(path, source)
+    build_store(path, store_path)
+    live = LiveDataset(path, store_path, interval = 0)
+    previous = live.current
+    assert previous.store == store_path
+    previous.cube.values(FEATURE)
+
+    swaps = []
+    live.listeners.append(lambda old, new, changed: swaps.append((old, new, changed)))
+    source.loc[(source["SCH_CODE"] == "BEL") & (source["YEAR"] == 2016), "GDP_PER_CAPITA"] *= 2
+    write_source(path, source)
+
+    changed = live.refresh()
+    assert changed == {("Belgium", 2016)}
+    assert read_meta(store_path)["changes"]["base"] == previous.source
+    dataset = live.current
+    assert dataset is not previous and dataset.generation == 1
+    assert swaps == [(previous, dataset, changed)]
+
+    # The feature was copied from the previous cube and matches a cube built from scratch
+    assert FEATURE in dataset.cube.cubes
+    np.testing.assert_array_equal(dataset.cube.values(FEATURE), Dataset(parse(source)).cube.values(FEATURE))
+
+    # Nothing new: the dataset stays
+    assert live.refresh() == set() and live.current is dataset
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from scatter_lod import density_grid, in_view, level_of_detail, view_ranges
+
+
+@pytest.mark.parametrize("points, detail", [
+    (0, "svg"),
+    (100, "svg"),
+    (101, "webgl"),
+    (1000, "webgl"),
+    (1001, "density"),
+])
+def test_level_of_detail_thresholds(points, detail):
+    assert level_of_detail(points, 100, 1000) == detail
+
+
+def test_disabled_thresholds():
+    assert level_of_detail(10 ** 6, 0, 1000) == "density"
+    assert level_of_detail(10 ** 6, 100, 0) == "webgl"
+    assert level_of_detail(10 ** 6, 0, 0) == "svg"
+
+
+def test_zooming_in_lowers_the_detail():
+    x = np.arange(2000, dtype = np.float64)
+    y = x.copy()
+    assert level_of_detail(len(x), 100, 1000) == "density"
+    shown = in_view(x, y, *view_ranges({"x": [1500, 0], "y": None}))
+    assert shown.sum() == 1501 and level_of_detail(int(shown.sum()), 100, 1000) == "density"
+    shown = in_view(x, y, *view_ranges({"x": [0, 500], "y": [100, 900]}))
+    assert shown.sum() == 401 and level_of_detail(int(shown.sum()), 100, 1000) == "webgl"
+    shown = in_view(x, y, *view_ranges({"x": [10.5, 20.5], "y": None}))
+    assert level_of_detail(int(shown.sum()), 100, 1000) == "svg"
+
+
+def test_view_ranges():
+    assert view_ranges(None) == (None, None)
+    assert view_ranges({"revision": "r", "x": [3, 1], "y": None}) == ((1, 3), None)
+
+
+def test_density_grid_counts_every_finite_point():
+    x = np.array([0.0, 0.1, 1.0, np.nan, 0.9])
+    y = np.array([0.0, 0.1, 1.0, 5.0, np.inf])
+    grid = density_grid(x, y, 2)
+    assert np.nansum(grid["z"]) == 3
+    # Rows run along y, empty cells are NaN
+    assert grid["z"][0, 0] == 2 and grid["z"][1, 1] == 1 and np.isnan(grid["z"][0, 1])
+    np.testing.assert_allclose(grid["x"], [0.25, 0.75])
+
+
+def test_density_grid_of_a_single_value_axis():
+    grid = density_grid(np.array([2.0, 2.0]), np.array([1.0, 3.0]), 4, y_range = (0, 4))
+    assert np.nansum(grid["z"]) == 2
+    assert grid["x"][0] > 1.5 and grid["x"][-1] < 2.5
@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Same budget as `make startup-budget`
+IMPORT_BUDGET_S = 2.5
+
+
+# Importing the app (what every worker does at boot) stays within budget and
+# leaves plotly.express and IPython unloaded; runs on generated data
+def test_import_within_budget_without_heavy_modules(tmp_path):
+    result = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, "benchmarks", "import_time.py"),
+         "--budget", str(IMPORT_BUDGET_S), "--forbid", "plotly.express,IPython"],
+        cwd = tmp_path, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+    assert result.returncode == 0, result.stdout
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from data_index import ALL_COUNTRIES
+from dataset import Dataset
+from timeseries import series_frame
+
+
+FEATURE = "Number of visa applications"
+
+
+@pytest.mark.parametrize("schengen_country", ["Belgium", ALL_COUNTRIES])
+def test_series_by_origin_match_the_line_plot(frame, schengen_country):
+    dataset = Dataset(frame)
+    series = dataset.timeseries.by_origin(schengen_country, FEATURE, (2015, 2018))
+    assert set(series) == set(frame["Country code"].astype(str))
+    for code, (years, values) in series.items():
+        expected = dataset.timeseries.frame(schengen_country, code, FEATURE, (2015, 2018))
+        np.testing.assert_array_equal(years, expected["Year"])
+        np.testing.assert_array_equal(values, expected[FEATURE])
+        # Rolled up over the Schengen countries like the frame fallback
+        rows = dataset.index.query(schengen_country, (2014, 2019))
+        fallback = series_frame(rows[rows["Country code"] == code], FEATURE, (2015, 2018))
+        np.testing.assert_allclose(values, fallback[FEATURE])
+
+
+def test_series_of_unknown_country(frame):
+    assert Dataset(frame).timeseries.by_origin("Narnia", FEATURE, (2014, 2019)) == {}
@@ -0,0 +1,165 @@
+#############################
+# Time series of the line plot
+#############################
+# The line plot shows one series per (Schengen country, country of
+# origin) over the years. The series are read straight from the feature
+# cube (aggregates.py), which already holds one dense year axis per
+# (Schengen country, origin) pair. "All countries" reads a rollup over the
+# Schengen countries: visa counts are added up, the characteristics of
+# the country of origin (population, GDP, ...) take the median, since
+# every Schengen country repeats them.
+#
+# Besides the features the line plot offers derived series:
+#
+# - "yoy"             change of the feature to the previous year in %
+# - "rejection_rate"  visas denied per visa application in %, of the
+#                     summed counts for "All countries"
+#
+# Rollups and derived series are computed once per dataset, on first use,
+# for all Schengen countries and origins at once.
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from aggregates import nanmedian_rows
+from data_index import ALL_COUNTRIES
+
+
+# Features added up over the Schengen countries for "All countries"
+SUMMED_FEATURES = ["Number of visa applications", "Visas issued", "Visas denied"]
+
+# Visas denied and visa applications, the counts of the rejection rate
+RATE_COLUMNS = ["Visas denied", "Number of visa applications"]
+
+# Series of the line plot besides the plain feature, with their labels
+SERIES_LABELS = {
+    "value": "{}",
+    "yoy": "{}, change to previous year (%)",
+    "rejection_rate": "Rejection rate (%)",
+}
+
+
+def series_label(series, feature):
+    return SERIES_LABELS.get(series or "value", "{}").format(feature)
+
+
+# Sum ignoring NaN over axis 0 in double precision, NaN where every value is NaN
+def nansum_first(values):
+    total = np.nansum(values, axis = 0, dtype = np.float64)
+    total[np.all(np.isnan(values), axis = 0)] = np.nan
+    return total
+
+
+# Median ignoring NaN over axis 0
+def nanmedian_first(values):
+    rows = values.reshape(values.shape[0], -1).T
+    return nanmedian_rows(rows).reshape(values.shape[1:])
+
+
+# Change to the previous value along the last axis in %, NaN for the first
+# year and after years without a value or with a value of 0
+def change_to_previous(values):
+    values = np.asarray(values, dtype = np.float64)
+    change = np.full(values.shape, np.nan)
+    previous = values[..., :-1]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        change[..., 1:] = np.where(previous != 0, (values[..., 1:] - previous) / np.abs(previous) * 100, np.nan)
+    return change
+
+
+def rate(numerator, denominator):
+    numerator = np.asarray(numerator, dtype = np.float64)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        return np.where(denominator > 0, numerator / denominator * 100, np.nan)
+
+
+class TimeSeriesStore:
+
+    def __init__(self, cube):
+        self.cube = cube
+        self.origin_positions = {code: i for i, code in enumerate(cube.origin_codes)}
+        # (series, feature) -> (Schengen country, origin, year) array and its (origin, year) rollup
+        self.arrays = {}
+        self.lock = threading.Lock()
+
+    def rollup(self, feature):
+        values = self.cube.values(feature)
+        return nansum_first(values) if feature in SUMMED_FEATURES else nanmedian_first(values)
+
+    def build(self, series, feature):
+        if series == "rejection_rate":
+            denied, applications = (self.cube.values(column) for column in RATE_COLUMNS)
+            return (rate(denied, applications),
+                    rate(nansum_first(denied), nansum_first(applications)))
+        if series == "yoy":
+            values, rollup = self.get("value", feature)
+            return change_to_previous(values), change_to_previous(rollup)
+        return self.cube.values(feature), self.rollup(feature)
+
+    def get(self, series, feature):
+        # The rejection rate does not depend on the selected feature
+        key = (series, None if series == "rejection_rate" else feature)
+        arrays = self.arrays.get(key)
+        if arrays is None:
+            # Built outside the lock: a derived series builds the series it derives from
+            arrays = self.build(series, feature)
+            with self.lock:
+                arrays = self.arrays.setdefault(key, arrays)
+        return arrays
+
+    # (origin, year) array of a series within the year range, None if the series does not exist
+    def block(self, schengen_country, feature, year_range, series = "value"):
+        if ((schengen_country != ALL_COUNTRIES and schengen_country not in self.cube.country_positions)
+                or (series == "rejection_rate" and not set(RATE_COLUMNS) <= set(self.cube.frame.columns))):
+            return None, None
+        values, rollup = self.get(series or "value", feature)
+        years = self.cube.year_slice(year_range)
+        if schengen_country == ALL_COUNTRIES:
+            return rollup[:, years], self.cube.years[years]
+        return values[self.cube.country_positions[schengen_country], :, years], self.cube.years[years]
+
+    # Years and values of one series within the year range, without the years lacking a value
+    def frame(self, schengen_country, origin_code, feature, year_range, series = "value"):
+        label = series_label(series, feature)
+        origin = self.origin_positions.get(origin_code)
+        block, years = self.block(schengen_country, feature, year_range, series)
+        if origin is None or block is None:
+            return pd.DataFrame({"Year": np.array([], dtype = np.int64), label: np.array([])})
+        row = block[origin]
+        valid = ~np.isnan(row)
+        return pd.DataFrame({"Year": years[valid], label: row[valid]})
+
+    # Years and values of the series of every origin with a value in the year range, by origin code
+    def by_origin(self, schengen_country, feature, year_range, series = "value"):
+        block, years = self.block(schengen_country, feature, year_range, series)
+        if block is None:
+            return {}
+        valid = ~np.isnan(block)
+        return {self.cube.origin_codes[origin]: (years[valid[origin]], block[origin, valid[origin]])
+                for origin in np.flatnonzero(valid.any(axis = 1))}
+
+
+# Same series from the rows of one country of origin over all years
+# (datasets the cube cannot hold)
+def series_frame(data, feature, year_range, series = "value"):
+    label = series_label(series, feature)
+    columns = RATE_COLUMNS if series == "rejection_rate" else [feature]
+    if not set(columns) <= set(data.columns):
+        return pd.DataFrame({"Year": np.array([], dtype = np.int64), label: np.array([])})
+    grouped = data.groupby("Year", sort = True)[columns]
+    summed = all(column in SUMMED_FEATURES for column in columns)
+    per_year = grouped.sum(min_count = 1) if summed else grouped.median()
+    # One row per year, so the change to the previous year is to the year before
+    if len(per_year):
+        per_year = per_year.reindex(np.arange(per_year.index.min(), per_year.index.max() + 1))
+    if series == "rejection_rate":
+        values = rate(*(per_year[column].to_numpy(dtype = np.float64) for column in RATE_COLUMNS))
+    elif series == "yoy":
+        values = change_to_previous(per_year[feature].to_numpy(dtype = np.float64))
+    else:
+        values = per_year[feature].to_numpy(dtype = np.float64)
+    years = per_year.index.to_numpy()
+    valid = ~np.isnan(values) & (years >= year_range[0]) & (years <= year_range[1])
+    return pd.DataFrame({"Year": years[valid], label: values[valid]})
@@ -0,0 +1,22 @@
+#############################
+# Production entry point
+#############################
+# Serves the visa dashboard with plain Dash (no Jupyter imports):
+#
+#   $ gunicorn wsgi:server
+#
+# gunicorn.conf.py preloads this module, so the dataset, its index and
+# the figure templates are loaded once in the master process and shared
+# copy-on-write by all forked workers.
+
+import gc
+
+from EU_map_layout import app
+
+# Needed by the gunicorn command in the Procfile
+server = app.server
+
+# Move everything loaded so far into the permanent generation. The garbage
+# collector then never touches these objects in the workers, which would
+# otherwise dirty (and copy) the shared pages.
+gc.freeze()